@@ -0,0 +1,185 @@
+import os
+import re
+import csv
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Abreviaturas de tipo de vía → nombre canónico
+STREET_TYPES = {
+    'cl': 'Calle', 'cll': 'Calle', 'clle': 'Calle', 'calle': 'Calle', 'call': 'Calle',
+    'cr': 'Carrera', 'cra': 'Carrera', 'kr': 'Carrera', 'kra': 'Carrera', 'crr': 'Carrera', 'carrera': 'Carrera', 'carera': 'Carrera',
+    'dg': 'Diagonal', 'diag': 'Diagonal', 'diagonal': 'Diagonal',
+    'tv': 'Transversal', 'tr': 'Transversal', 'trans': 'Transversal', 'transv': 'Transversal', 'transversal': 'Transversal',
+    'av': 'Avenida', 'avda': 'Avenida', 'avenida': 'Avenida',
+    'ak': 'Avenida Carrera', 'ac': 'Avenida Calle',
+    'cq': 'Circular', 'circ': 'Circular', 'circular': 'Circular',
+    'mz': 'Manzana', 'manzana': 'Manzana',
+    'autopista': 'Autopista', 'km': 'Kilómetro', 'vereda': 'Vereda',
+}
+
+# Abreviaturas de departamento que aparecen en la línea de ciudad
+DEPARTMENT_ALIASES = {
+    'ant': 'antioquia', 'antq': 'antioquia',
+    'cund': 'cundinamarca', 'cundi': 'cundinamarca',
+    'valle': 'valle del cauca', 'vlle': 'valle del cauca',
+    'dc': 'bogota d c', 'd c': 'bogota d c', 'bogota dc': 'bogota d c', 'bogota d c': 'bogota d c',
+    'atl': 'atlantico', 'stder': 'santander', 'sder': 'santander',
+    'nte de santander': 'norte de santander', 'n de santander': 'norte de santander',
+    'risaralda': 'risaralda', 'guajira': 'la guajira',
+}
+
+STREET_TYPE_PATTERN = '|'.join(sorted(STREET_TYPES, key=len, reverse=True))
+# "Cra 45A #86-54 Casa", "Cr 17 145A 51", "Cl 21 Sur #41-117", "Calle 47a 53-51"
+ADDRESS_RE = re.compile(
+    rf'^\s*(?P<tipo>{STREET_TYPE_PATTERN})\.?\s*'
+    r'(?P<via>\d+\s*[a-z]{0,2}(?:\s*bis)?(?:\s*[a-z])?(?:\s+(?:sur|este|norte))?)\s*'
+    r'(?:#|no\.?|n[°º]|numero|número)?\s*'
+    r'(?P<cruce>\d+\s*[a-z]{0,2}(?:\s*bis)?(?:\s+(?:sur|este))?)\s*(?:-|\s)\s*'
+    r'(?P<placa>\d+)\b(?P<resto>.*)$',
+    re.IGNORECASE
+)
+POSTAL_CODE_RE = re.compile(r'\b\d{6}\b|\b0\d{4}\b')
+DEFAULT_GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'localidades_colombia.csv')
+
+
+def fold(text: str) -> str:
+    """Minúsculas, sin tildes ni puntuación"""
+    text = unicodedata.normalize('NFD', (text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+
+def _clean_component(text: str) -> str:
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = re.sub(r'(\d)\s+([a-z])\b', r'\1\2', text, flags=re.IGNORECASE)
+    return re.sub(r'\b(sur|este|norte|bis)\b', lambda m: m.group(1).capitalize(), text.upper(), flags=re.IGNORECASE)
+
+
+@lru_cache(maxsize=16384)
+def normalize_street_address(line: str) -> Dict[str, str]:
+    """Dirección con el tipo de vía expandido: "Cra 45A #86-54 Casa" → "Carrera 45A # 86-54" + complemento"""
+    match = ADDRESS_RE.match(line or '')
+    if not match:
+        return {'tipo_via': '', 'via': '', 'cruce': '', 'placa': '', 'complemento': (line or '').strip(),
+                'direccion_normalizada': ''}
+    street_type = STREET_TYPES[match.group('tipo').lower()]
+    via = _clean_component(match.group('via'))
+    cruce = _clean_component(match.group('cruce'))
+    placa = match.group('placa')
+    complement = match.group('resto').strip(' ,.-')
+    return {
+        'tipo_via': street_type,
+        'via': via,
+        'cruce': cruce,
+        'placa': placa,
+        'complemento': complement,
+        'direccion_normalizada': f"{street_type} {via} # {cruce}-{placa}"
+    }
+
+
+class LocalityIndex:
+    """Índice en memoria de municipios y departamentos a partir del gazetteer local"""
+
+    def __init__(self, rows: List[Dict[str, str]]):
+        self.by_name: Dict[str, List[Tuple[str, str]]] = {}
+        self.departments: Dict[str, str] = {}
+        for row in rows:
+            municipality, department = row['municipio'].strip(), row['departamento'].strip()
+            self.departments[fold(department)] = department
+            names = [municipality] + [a for a in (row.get('alias') or '').split('|') if a.strip()]
+            for name in names:
+                entries = self.by_name.setdefault(fold(name), [])
+                if (municipality, department) not in entries:
+                    entries.append((municipality, department))
+        # Nombres de más palabras primero: "santa rosa de cabal" antes que "cabal"
+        self.max_words = max((len(name.split()) for name in self.by_name), default=1)
+        self.resolve = lru_cache(maxsize=16384)(self._resolve)
+
+    @classmethod
+    def from_csv(cls, path: str = DEFAULT_GAZETTEER) -> 'LocalityIndex':
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            return cls(list(csv.DictReader(f)))
+
+    def _department(self, text: str) -> str:
+        folded = fold(text)
+        folded = DEPARTMENT_ALIASES.get(folded, folded)
+        return self.departments.get(folded, '')
+
+    def _resolve(self, text: str) -> Dict[str, object]:
+        """Línea de ciudad → municipio/departamento canónicos ("Itagui ANT" → Itagüí, Antioquia)"""
+        raw = POSTAL_CODE_RE.sub(' ', text or '')
+        department_hint = ''
+        if ',' in raw:
+            raw, _, tail = raw.rpartition(',')
+            department_hint = self._department(tail)
+            if not department_hint and not raw.strip():
+                raw = tail
+
+        words = fold(raw).split()
+        # Departamento abreviado al final sin coma: "Itagui ANT", "Bogotá D.C"
+        for size in (3, 2, 1):
+            if len(words) > size and not department_hint:
+                hint = self._department(' '.join(words[-size:]))
+                if hint:
+                    department_hint = hint
+                    words = words[:-size]
+                    break
+
+        candidates: List[Tuple[str, str]] = []
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                found = self.by_name.get(' '.join(words[start:start + size]))
+                if found:
+                    candidates = found
+                    break
+            if candidates:
+                break
+
+        if department_hint:
+            matching = [c for c in candidates if c[1] == department_hint]
+            if matching:
+                candidates = matching
+            elif not candidates and department_hint == 'Bogotá D.C.':
+                candidates = self.by_name.get('bogota', [])
+
+        if not candidates:
+            return {'municipio': '', 'departamento': department_hint, 'ambigua': False, 'reconocida': False}
+        municipality, department = candidates[0]
+        return {'municipio': municipality, 'departamento': department,
+                'ambigua': len(candidates) > 1, 'reconocida': True}
+
+
+def load_localities(path: str = DEFAULT_GAZETTEER) -> Optional[LocalityIndex]:
+    """Gazetteer si el archivo existe (la normalización de direcciones es opcional)"""
+    try:
+        return LocalityIndex.from_csv(path)
+    except FileNotFoundError:
+        print(f"⚠️ Gazetteer de localidades no encontrado ({path}): ciudades sin normalizar")
+        return None
+
+
+def normalize_address_fields(address_lines: List[str], city_line: str,
+                             localities: Optional[LocalityIndex] = None) -> Dict[str, object]:
+    """Campos estructurados de envío a partir de las líneas de dirección y ciudad del pedido"""
+    street = normalize_street_address(address_lines[0]) if address_lines else normalize_street_address('')
+    complement = [street['complemento']] if street['complemento'] else []
+    complement.extend(line.strip() for line in address_lines[1:] if line.strip())
+
+    location = {'municipio': '', 'departamento': '', 'ambigua': False, 'reconocida': False}
+    if localities:
+        location = localities.resolve(city_line or '')
+        if not location['reconocida'] and address_lines:
+            # "Cr 17 145A 51 bogota": a veces la ciudad viene pegada a la dirección
+            from_address = localities.resolve(street['complemento'] or address_lines[0])
+            if from_address['reconocida']:
+                location = from_address
+
+    return {
+        'tipo_via': street['tipo_via'],
+        'direccion_normalizada': street['direccion_normalizada'],
+        'complemento_direccion': ', '.join(complement),
+        'municipio': location['municipio'],
+        'departamento': location['departamento'],
+        'ciudad_ambigua': location['ambigua'],
+    }
@@ -0,0 +1,201 @@
+import re
+import argparse
+import unicodedata
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+MONTHS = {
+    'enero': 1, 'ene': 1,
+    'febrero': 2, 'feb': 2,
+    'marzo': 3, 'mar': 3,
+    'abril': 4, 'abr': 4,
+    'mayo': 5, 'may': 5,
+    'junio': 6, 'jun': 6,
+    'julio': 7, 'jul': 7,
+    'agosto': 8, 'ago': 8,
+    'septiembre': 9, 'setiembre': 9, 'sept': 9, 'sep': 9, 'set': 9,
+    'octubre': 10, 'oct': 10,
+    'noviembre': 11, 'nov': 11,
+    'diciembre': 12, 'dic': 12,
+}
+MONTH_NAMES = ['', 'enero', 'febrero', 'marzo', 'abril', 'mayo', 'junio', 'julio',
+               'agosto', 'septiembre', 'octubre', 'noviembre', 'diciembre']
+DAYS_IN_MONTH = [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+MONTH_PATTERN = '|'.join(sorted(MONTHS, key=len, reverse=True))
+# "10 de julio", "18de noviembre", "28 septiembre", "07/abril", "6-enero"
+DAY_MONTH_RE = re.compile(rf'\b(\d{{1,2}})\s*(?:de\s*|[/\-.]\s*)?({MONTH_PATTERN})\b')
+# "julio 10", "Julio 10 de 1990"
+MONTH_DAY_RE = re.compile(rf'\b({MONTH_PATTERN})\s*(?:de\s*)?(\d{{1,2}})\b')
+# "07/05", "7-5", "07.05.1990"
+NUMERIC_RE = re.compile(r'\b(\d{1,2})\s*[/\-.]\s*(\d{1,2})(?:\s*[/\-.]\s*(\d{2,4}))?\b')
+# "1990-05-07"
+ISO_RE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize('NFD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def day_of_year(month: int, day: int) -> int:
+    """Día del año en un año bisiesto (1-366), para que el 29 de febrero tenga su lugar"""
+    return sum(DAYS_IN_MONTH[1:month]) + day
+
+
+def _result(month: int, day: int, ambiguous: bool = False, reason: str = '') -> Optional[Dict]:
+    if not 1 <= month <= 12 or not 1 <= day <= DAYS_IN_MONTH[month]:
+        return None
+    return {'mes': month, 'dia': day, 'dia_del_ano': day_of_year(month, day), 'ambigua': ambiguous, 'motivo': reason}
+
+
+@lru_cache(maxsize=4096)
+def parse_birthday(text: str) -> Optional[Dict]:
+    """FC en texto libre → mes/día normalizados; None si no hay fecha reconocible"""
+    if not text:
+        return None
+    folded = _fold(text).strip()
+    if not folded or folded in ('n/a', 'na', 'no', 'sin fecha', 'no especificada', 'no proporcionada'):
+        return None
+
+    match = DAY_MONTH_RE.search(folded)
+    if match:
+        return _result(MONTHS[match.group(2)], int(match.group(1)))
+
+    match = MONTH_DAY_RE.search(folded)
+    if match:
+        return _result(MONTHS[match.group(1)], int(match.group(2)))
+
+    match = ISO_RE.search(folded)
+    if match:
+        return _result(int(match.group(2)), int(match.group(3)))
+
+    match = NUMERIC_RE.search(folded)
+    if match:
+        first, second = int(match.group(1)), int(match.group(2))
+        # En Colombia se escribe día/mes; si el primer número no puede ser día del mes, se invierte
+        if second > 12 and first <= 12:
+            return _result(first, second, reason='mes/día invertido')
+        ambiguous = first <= 12 and second <= 12 and first != second
+        return _result(second, first, ambiguous, 'dd/mm asumido' if ambiguous else '')
+
+    return None
+
+
+def format_birthday(parsed: Optional[Dict]) -> str:
+    """Fecha normalizada legible: "10 de julio" (con "?" si es ambigua)"""
+    if not parsed:
+        return ''
+    return f"{parsed['dia']:02d} de {MONTH_NAMES[parsed['mes']]}{' (?)' if parsed['ambigua'] else ''}"
+
+
+class BirthdayIndex:
+    """Índice por día del año sobre los clientes del CRM: las consultas recorren solo los días pedidos"""
+
+    def __init__(self):
+        self.days: List[List[Dict]] = [[] for _ in range(367)]
+        self.unparsed: List[Dict] = []
+        self.ambiguous = 0
+
+    def add(self, record: Dict):
+        parsed = parse_birthday(record.get('fecha_cumpleanos', ''))
+        if parsed is None:
+            self.unparsed.append(record)
+            return
+        if parsed['ambigua']:
+            self.ambiguous += 1
+        self.days[parsed['dia_del_ano']].append(dict(record, cumpleanos=dict(parsed)))
+
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'BirthdayIndex':
+        index = cls()
+        for record in records:
+            index.add(record)
+        return index
+
+    def on(self, month: int, day: int) -> List[Dict]:
+        return list(self.days[day_of_year(month, day)])
+
+    def between(self, start: date, days: int) -> List[Dict]:
+        """Clientes que cumplen años en los próximos `days` días desde `start` (cruza fin de año)"""
+        results = []
+        seen = set()
+        for offset in range(days):
+            current = start + timedelta(days=offset)
+            doy = day_of_year(current.month, current.day)
+            if doy in seen:
+                continue
+            seen.add(doy)
+            results.extend(self.days[doy])
+            # En años no bisiestos los del 29 de febrero se saludan el 28
+            if current.month == 2 and current.day == 28 and not _is_leap(current.year):
+                results.extend(self.days[day_of_year(2, 29)])
+        return results
+
+    def this_week(self, today: Optional[date] = None) -> List[Dict]:
+        today = today or date.today()
+        return self.between(today - timedelta(days=today.weekday()), 7)
+
+    def in_month(self, month: int) -> List[Dict]:
+        start = day_of_year(month, 1)
+        results = []
+        for doy in range(start, start + DAYS_IN_MONTH[month]):
+            results.extend(self.days[doy])
+        return results
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.days)
+
+
+def _is_leap(year: int) -> bool:
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def load_crm_txt(filename: str) -> List[Dict[str, str]]:
+    """Lee un archivo CRM_WALAKY_*.txt generado por el scraper"""
+    keys = {'Nombre': 'nombre', 'Cédula': 'cedula', 'Email': 'email', 'Fecha cumpleaños': 'fecha_cumpleanos'}
+    records, current = [], None
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('CLIENTE '):
+                current = {'nombre': '', 'cedula': '', 'email': '', 'fecha_cumpleanos': ''}
+                records.append(current)
+                continue
+            if current is not None and ':' in line:
+                label, _, value = line.partition(':')
+                if label in keys:
+                    current[keys[label]] = value.strip()
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultas de cumpleaños (FC) sobre el CRM")
+    parser.add_argument('files', nargs='+', help="Archivos CRM_WALAKY_*.txt")
+    parser.add_argument('--desde', help="Fecha inicial YYYY-MM-DD (por defecto, inicio de esta semana)")
+    parser.add_argument('--dias', type=int, default=7)
+    parser.add_argument('--mes', help="Mes completo (nombre o número)")
+    args = parser.parse_args()
+
+    # El mismo cliente aparece en varias corridas: se deja el último registro por cédula
+    by_client = {}
+    for filename in args.files:
+        for record in load_crm_txt(filename):
+            by_client[record['cedula'] or record['nombre']] = record
+    index = BirthdayIndex.from_records(list(by_client.values()))
+    print(f"🎂 {len(index)} clientes con FC normalizada, {index.ambiguous} ambiguas (dd/mm asumido), "
+          f"{len(index.unparsed)} sin fecha reconocible")
+
+    if args.mes:
+        month = int(args.mes) if args.mes.isdigit() else MONTHS[_fold(args.mes)]
+        results = index.in_month(month)
+        title = f"cumpleaños de {MONTH_NAMES[month]}"
+    else:
+        start = datetime.strptime(args.desde, '%Y-%m-%d').date() if args.desde else None
+        results = index.between(start, args.dias) if start else index.this_week()
+        title = f"cumpleaños {'desde ' + args.desde if start else 'de esta semana'}"
+
+    print(f"\n📅 {len(results)} {title}:")
+    for record in results:
+        print(f"   {format_birthday(record['cumpleanos']):22} {record['nombre']:40} {record['email']}")
@@ -0,0 +1,107 @@
+import os
+import json
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+
+class BudgetController:
+    """Control de admisión por presupuesto (dólares/tokens por corrida y por día)"""
+
+    # Niveles de degradación en orden
+    NORMAL = 'normal'
+    ECONOMICO = 'economico'   # modelo más barato
+    LOCAL = 'local'           # solo parsing local, sin Claude
+    PAUSA = 'pausa'           # detener la corrida
+
+    def __init__(self, run_id: str, state_file: str = 'presupuesto_estado.json',
+                 max_run_cost: Optional[float] = None, max_daily_cost: Optional[float] = None,
+                 max_run_tokens: Optional[int] = None, max_daily_tokens: Optional[int] = None,
+                 cheap_model_at: float = 0.70, local_only_at: float = 0.90):
+        self.run_id = run_id
+        self.state_file = state_file
+        self.limits = {
+            'run_cost': max_run_cost,
+            'daily_cost': max_daily_cost,
+            'run_tokens': max_run_tokens,
+            'daily_tokens': max_daily_tokens,
+        }
+        self.cheap_model_at = cheap_model_at
+        self.local_only_at = local_only_at
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+
+    def _load_state(self) -> Dict:
+        """Carga el estado persistido para que las corridas reanudadas sumen al mismo presupuesto"""
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+                state.setdefault('runs', {})
+                state.setdefault('days', {})
+                return state
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'runs': {}, 'days': {}}
+
+    def _save_state(self):
+        """Escritura atómica del estado"""
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now().strftime('%Y-%m-%d')
+
+    def _bucket(self, section: str, key: str) -> Dict:
+        return self.state[section].setdefault(key, {'cost': 0.0, 'tokens': 0, 'requests': 0})
+
+    def record(self, input_tokens: int, output_tokens: int, cost: float):
+        """Registra el consumo de un request de Claude"""
+        with self._lock:
+            for bucket in (self._bucket('runs', self.run_id), self._bucket('days', self._today())):
+                bucket['cost'] += cost
+                bucket['tokens'] += input_tokens + output_tokens
+                bucket['requests'] += 1
+            try:
+                self._save_state()
+            except Exception as e:
+                print(f"⚠️ Error guardando presupuesto: {e}")
+
+    def usage(self) -> Dict[str, float]:
+        """Consumo actual de la corrida y del día"""
+        run = self.state['runs'].get(self.run_id, {})
+        day = self.state['days'].get(self._today(), {})
+        return {
+            'run_cost': run.get('cost', 0.0),
+            'daily_cost': day.get('cost', 0.0),
+            'run_tokens': run.get('tokens', 0),
+            'daily_tokens': day.get('tokens', 0),
+        }
+
+    def usage_ratio(self) -> float:
+        """Fracción consumida del límite más cercano a agotarse"""
+        usage = self.usage()
+        ratios = [usage[key] / limit for key, limit in self.limits.items() if limit]
+        return max(ratios) if ratios else 0.0
+
+    def level(self) -> str:
+        """Nivel de degradación según el presupuesto consumido"""
+        ratio = self.usage_ratio()
+        if ratio >= 1.0:
+            return self.PAUSA
+        if ratio >= self.local_only_at:
+            return self.LOCAL
+        if ratio >= self.cheap_model_at:
+            return self.ECONOMICO
+        return self.NORMAL
+
+    def print_status(self):
+        """Imprime el estado del presupuesto"""
+        usage = self.usage()
+        print(f"💳 PRESUPUESTO ({self.run_id}) - nivel: {self.level().upper()}")
+        for key, limit in self.limits.items():
+            if limit:
+                value = usage[key]
+                shown = f"${value:.4f} / ${limit:.2f}" if 'cost' in key else f"{value:,} / {limit:,}"
+                print(f"   • {key}: {shown} ({value / limit:.0%})")
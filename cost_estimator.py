@@ -0,0 +1,182 @@
+from typing import List, Dict, Optional
+from message_normalizer import normalize_message, smart_truncate, estimate_tokens
+
+
+class DryRunPlanner:
+    """Proyecta requests, costo y duración de una corrida sin llamar a Claude"""
+
+    # Latencias observadas de Claude (segundos) y tokens de salida típicos
+    verification_latency = 1.5
+    format_latency = 5.0
+    single_call_latency = 6.0
+    crm_latency = 2.0
+    crm_batch_latency = 8.0
+    whatsapp_fetch_latency = 3.0
+    # Pausas fijas del scraper: tras verificar, tras una extracción CRM válida y entre extracciones individuales
+    # (1s, y 3s cada 10 pedidos)
+    verification_pause = 1.0
+    crm_success_pause = 0.5
+    crm_item_pause = 1.2
+    verification_output_tokens = 2
+    crm_output_tokens = 60
+    format_output_max_tokens = 1000
+
+    LATENCIES = ('verification_latency', 'format_latency', 'single_call_latency', 'crm_latency', 'crm_batch_latency',
+                 'whatsapp_fetch_latency', 'verification_pause', 'crm_success_pause', 'crm_item_pause')
+
+    def __init__(self, scraper, verification_pass_rate: float = 0.95, latencies: Optional[Dict[str, float]] = None):
+        self.scraper = scraper
+        self.verification_pass_rate = verification_pass_rate
+        for name, seconds in (latencies or {}).items():
+            if name not in self.LATENCIES:
+                raise ValueError(f"Latencia desconocida: {name} (opciones: {', '.join(self.LATENCIES)})")
+            setattr(self, name, float(seconds))
+
+    def plan(self, messages: List[Dict], fetch_from_whatsapp: bool = True) -> Dict:
+        """Recorre los mensajes como la rutina de producción y acumula la proyección"""
+        s = self.scraper
+        plan = {
+            'total_messages': len(messages),
+            'skipped_short': 0,
+            'prefilter_rejected': 0,
+            'candidates': 0,
+            'local_orders': 0,
+            'speculative': 0,
+            'expected_orders': 0.0,
+            'verification_requests': 0.0,
+            'format_requests': 0.0,
+            'single_call_requests': 0.0,
+            'crm_requests': 0.0,
+            'input_tokens': {'verification': 0.0, 'format': 0.0, 'single_call': 0.0, 'crm_extraction': 0.0},
+            'output_tokens': {'verification': 0.0, 'format': 0.0, 'single_call': 0.0, 'crm_extraction': 0.0},
+            'seconds': 0.0,
+        }
+        # Extracción CRM por lotes de K si está activado; el encabezado del prompt se reparte entre el lote
+        k = max(s.crm_batch_size, 1)
+        crm_header = s.build_crm_batch_prompt([]) if k > 1 else s.build_crm_prompt('')
+        crm_seconds = (self.crm_batch_latency + s.claude_delay) / k if k > 1 else \
+            self.crm_latency + self.crm_success_pause + self.crm_item_pause
+
+        if fetch_from_whatsapp:
+            plan['seconds'] += (s.whatsapp_delay_min + s.whatsapp_delay_max) / 2
+            plan['seconds'] += self.whatsapp_fetch_latency + (s.whatsapp_cooldown_min + s.whatsapp_cooldown_max) / 2
+
+        for message in messages:
+            message_text = message.get('body', '') or ''
+
+            if len(message_text.strip()) < 20:
+                plan['skipped_short'] += 1
+                continue
+
+            if not s.quick_filter_message(message_text):
+                plan['prefilter_rejected'] += 1
+                plan['seconds'] += s.prefilter_delay
+                continue
+
+            plan['candidates'] += 1
+            p = self.verification_pass_rate
+            compact_text = normalize_message(message_text)
+            # El texto formateado ocupa aprox. lo mismo que el mensaje compacto
+            formatted_tokens = min(estimate_tokens(compact_text), self.format_output_max_tokens)
+
+            # Mismo orden de caminos que process_candidate: plantilla local, llamada única, especulación, secuencial
+            local_text, confidence, _ = s.local_format(message_text)
+            if s.local_format_confidence is not None and local_text and confidence >= s.local_format_confidence:
+                # Pedido en plantilla: ni verificación ni formateo; el CRM sí pasa por Claude
+                plan['local_orders'] += 1
+                orders, crm_orders = 1.0, 1.0
+                formatted_tokens = estimate_tokens(local_text)
+            elif s.single_call:
+                # Una sola llamada decide, formatea y trae el CRM
+                plan['single_call_requests'] += 1
+                plan['input_tokens']['single_call'] += estimate_tokens(s.build_single_call_prompt(compact_text))
+                plan['output_tokens']['single_call'] += p * (formatted_tokens + self.crm_output_tokens)
+                plan['seconds'] += self.single_call_latency + s.claude_delay
+                orders, crm_orders = p, 0.0
+            else:
+                snippet = smart_truncate(compact_text, 600)
+                plan['verification_requests'] += 1
+                plan['input_tokens']['verification'] += estimate_tokens(s.build_verification_prompt(snippet))
+                plan['output_tokens']['verification'] += self.verification_output_tokens
+                format_input = estimate_tokens(s.build_format_prompt(compact_text))
+                if (s.speculative_score_threshold is not None
+                        and s.prefilter_score(message_text) >= s.speculative_score_threshold):
+                    # Formateo especulativo: siempre se paga, en paralelo con la verificación
+                    plan['speculative'] += 1
+                    plan['format_requests'] += 1
+                    plan['input_tokens']['format'] += format_input
+                    plan['output_tokens']['format'] += formatted_tokens
+                    plan['seconds'] += max(self.verification_latency + self.verification_pause,
+                                           self.format_latency + s.claude_delay)
+                else:
+                    plan['format_requests'] += p
+                    plan['input_tokens']['format'] += p * format_input
+                    plan['output_tokens']['format'] += p * formatted_tokens
+                    plan['seconds'] += self.verification_latency + self.verification_pause
+                    plan['seconds'] += p * (self.format_latency + s.claude_delay)
+                orders, crm_orders = p, p
+
+            # Extracción CRM sobre el pedido formateado
+            plan['crm_requests'] += crm_orders / k
+            plan['input_tokens']['crm_extraction'] += crm_orders * (estimate_tokens(crm_header) / k + formatted_tokens)
+            plan['output_tokens']['crm_extraction'] += crm_orders * self.crm_output_tokens
+            plan['seconds'] += crm_orders * crm_seconds
+
+            plan['expected_orders'] += orders
+
+        # Delays de seguridad del perfil: checkpoint cada N pedidos, delay corto en el resto
+        checkpoints = int(plan['expected_orders'] // s.checkpoint_every)
+        plan['seconds'] += checkpoints * (s.checkpoint_delay + s.checkpoint_jitter / 2)
+        plan['seconds'] += max(plan['candidates'] - checkpoints, 0) * (s.message_delay_min + s.message_delay_max) / 2
+
+        input_total = sum(plan['input_tokens'].values())
+        output_total = sum(plan['output_tokens'].values())
+        plan['total_requests'] = (plan['verification_requests'] + plan['format_requests'] + plan['single_call_requests']
+                                  + plan['crm_requests'])
+        cost = s.request_cost(input_total, output_total, s.current_model())
+        plan['input_cost'] = cost['input_cost']
+        plan['output_cost'] = cost['output_cost']
+        plan['total_cost'] = plan['input_cost'] + plan['output_cost']
+        return plan
+
+    def print_plan(self, plan: Dict):
+        """Imprime la proyección de la corrida (dry-run)"""
+        s = self.scraper
+        input_total = sum(plan['input_tokens'].values())
+        output_total = sum(plan['output_tokens'].values())
+        hours, rest = divmod(int(plan['seconds']), 3600)
+        minutes = rest // 60
+
+        print("\n" + "🧮" * 60)
+        print("                      PROYECCIÓN DRY-RUN (SIN LLAMADAS A CLAUDE)")
+        print("🧮" * 60)
+        print(f"📊 MENSAJES:")
+        print(f"   📝 Total mensajes: {plan['total_messages']}")
+        print(f"   ⏭️ Muy cortos: {plan['skipped_short']}")
+        print(f"   ⚡ Pre-filtro rechazaría: {plan['prefilter_rejected']}")
+        print(f"   ✅ Candidatos: {plan['candidates']}")
+        print(f"   📐 Pedidos en plantilla (sin verificar ni formatear con Claude): {plan['local_orders']}")
+        if plan['speculative']:
+            print(f"   🚀 Con formateo especulativo: {plan['speculative']}")
+        print(f"   📦 Pedidos esperados: ~{plan['expected_orders']:.0f} (tasa verificación {self.verification_pass_rate:.0%})")
+        print()
+        print(f"🔢 REQUESTS PROYECTADOS: ~{plan['total_requests']:.0f}")
+        print(f"   🔍 Verificaciones: {plan['verification_requests']:.0f}")
+        print(f"   📝 Formateos: ~{plan['format_requests']:.0f}")
+        if plan['single_call_requests']:
+            print(f"   🎯 Llamada única: {plan['single_call_requests']:.0f}")
+        print(f"   🏷️  Extracciones CRM: ~{plan['crm_requests']:.0f}")
+        print()
+        print(f"📈 TOKENS ESTIMADOS (aprox. local):")
+        for stage in ('verification', 'format', 'single_call', 'crm_extraction'):
+            if stage == 'single_call' and not plan['single_call_requests']:
+                continue
+            print(f"   • {stage}: {plan['input_tokens'][stage]:,.0f} in + {plan['output_tokens'][stage]:,.0f} out")
+        print(f"   📊 Total: {input_total:,.0f} in + {output_total:,.0f} out")
+        print()
+        print(f"💵 COSTO PROYECTADO: ${plan['total_cost']:.4f}")
+        print(f"   📥 Input: ${plan['input_cost']:.4f}  📤 Output: ${plan['output_cost']:.4f}")
+        print()
+        print(f"⏱️  DURACIÓN PROYECTADA: ~{hours}h {minutes:02d}m")
+        print(f"   (perfil {s.pacing_profile}: WhatsApp {s.whatsapp_delay_min}-{s.whatsapp_delay_max}s, Claude {s.claude_delay}s, checkpoints {s.checkpoint_delay}s)")
+        print("🧮" * 60)
@@ -0,0 +1,122 @@
+import os
+import json
+from typing import Dict, Optional
+
+DEFAULT_CONFIG_FILE = 'walaky_config.json'
+
+# Perfiles de ritmo con nombre: lo que antes separaba scraper.py de scrapper_trial.py
+PACING_PROFILES: Dict[str, Dict] = {
+    # Prueba corta: delays bajos, modelo económico, pocos reintentos
+    'trial': {
+        'whatsapp_delay_min': 5, 'whatsapp_delay_max': 8,
+        'whatsapp_cooldown_min': 3, 'whatsapp_cooldown_max': 4,
+        'whatsapp_error_wait': 30,
+        'claude_delay': 1,
+        'claude_pause': 1,
+        'checkpoint_every': 3, 'checkpoint_delay': 5, 'checkpoint_jitter': 0,
+        'message_delay_min': 0, 'message_delay_max': 0,
+        'prefilter_delay': 0,
+        'claude_model': 'claude-3-5-haiku-20241022',
+        'claude_retries': 3,
+        'limit': 20,
+        'local_workers': 1,
+        'file_tag': 'prueba',
+        'priority_scheduling': False,
+        'progress_file': 'progreso_prueba.txt',
+    },
+    # Producción: máxima protección del número
+    'production': {
+        'whatsapp_delay_min': 15, 'whatsapp_delay_max': 25,
+        'whatsapp_cooldown_min': 10, 'whatsapp_cooldown_max': 15,
+        'whatsapp_error_wait': 120,
+        'claude_delay': 2,
+        'claude_pause': 1,
+        'checkpoint_every': 5, 'checkpoint_delay': 45, 'checkpoint_jitter': 20,
+        'message_delay_min': 4, 'message_delay_max': 8,
+        'prefilter_delay': 0.3,
+        'claude_model': 'claude-3-5-sonnet-20240620',
+        'claude_retries': 4,
+        'limit': 1000,
+        'local_workers': 1,
+        'file_tag': '',
+        'priority_scheduling': False,
+        'progress_file': 'progreso_produccion_final.txt',
+    },
+    # Reproceso de historial archivado (--replay): casi sin tráfico a WhatsApp, el ritmo lo pone Claude;
+    # los mensajes más recientes y con mejor pre-filtro van primero y los en vivo se cuelan (priority_scheduler)
+    'backfill': {
+        'whatsapp_delay_min': 15, 'whatsapp_delay_max': 25,
+        'whatsapp_cooldown_min': 10, 'whatsapp_cooldown_max': 15,
+        'whatsapp_error_wait': 120,
+        'claude_delay': 0.5,
+        'claude_pause': 1,
+        'checkpoint_every': 25, 'checkpoint_delay': 5, 'checkpoint_jitter': 5,
+        'message_delay_min': 0, 'message_delay_max': 0.5,
+        'prefilter_delay': 0,
+        'claude_model': 'claude-3-5-haiku-20241022',
+        'claude_retries': 4,
+        'limit': 100000,
+        'local_workers': 0,
+        'file_tag': 'backfill',
+        'priority_scheduling': True,
+        'progress_file': 'progreso_backfill.txt',
+    },
+}
+
+# Esperas de un perfil (segundos); claude_pause es la pausa corta tras cada verificación o extracción CRM
+DELAY_KEYS = ('whatsapp_delay_min', 'whatsapp_delay_max', 'whatsapp_cooldown_min', 'whatsapp_cooldown_max',
+              'whatsapp_error_wait', 'claude_delay', 'claude_pause', 'checkpoint_delay', 'checkpoint_jitter',
+              'message_delay_min', 'message_delay_max', 'prefilter_delay')
+
+# Variables de entorno que mandan sobre el archivo de configuración
+CREDENTIAL_ENV = {
+    'instance_id': 'ULTRAMSG_INSTANCE_ID',
+    'token': 'ULTRAMSG_TOKEN',
+    'chat_id': 'WALAKY_CHAT_ID',
+    'anthropic_api_key': 'ANTHROPIC_API_KEY',
+}
+
+
+def load_config(path: Optional[str] = None) -> Dict:
+    """Lee el config JSON (credenciales, perfil por defecto y perfiles propios); {} si no existe"""
+    path = path or os.environ.get('WALAKY_CONFIG', DEFAULT_CONFIG_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def resolve_pacing_profile(name: Optional[str] = None, config: Optional[Dict] = None) -> Dict:
+    """Perfil con nombre; los del config pueden heredar de otro con "base" y cambiar solo algunos valores"""
+    config = config or {}
+    name = name or os.environ.get('WALAKY_PACING_PROFILE') or config.get('pacing_profile') or 'production'
+    custom = config.get('profiles', {})
+
+    if name in custom:
+        overrides = dict(custom[name])
+        base = overrides.pop('base', name if name in PACING_PROFILES else 'production')
+        if base == name:
+            profile = dict(PACING_PROFILES[base])
+        else:
+            profile = resolve_pacing_profile(base, config)
+        profile.update(overrides)
+    elif name in PACING_PROFILES:
+        profile = dict(PACING_PROFILES[name])
+    else:
+        available = sorted(set(PACING_PROFILES) | set(custom))
+        raise ValueError(f"Perfil de ritmo desconocido: {name} (disponibles: {', '.join(available)})")
+
+    profile['name'] = name
+    return profile
+
+
+def without_delays(profile: Dict) -> Dict:
+    """Copia del perfil con todas las esperas en cero: se mide el pipeline, no el ritmo anti-bloqueo"""
+    return dict(profile, **{key: 0 for key in DELAY_KEYS})
+
+
+def load_credentials(config: Optional[Dict] = None) -> Dict[str, str]:
+    """Credenciales de UltraMsg/Claude y chat por defecto: entorno primero, luego el config"""
+    config = config or {}
+    return {key: os.environ.get(env) or config.get(key, '') for key, env in CREDENTIAL_ENV.items()}
@@ -0,0 +1,291 @@
+import re
+import csv
+import json
+import time
+import logging
+import argparse
+import unicodedata
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from scraper import WhatsAppScraperClaudeProduction
+from engine_config import load_config, load_credentials, resolve_pacing_profile, without_delays
+from structured_log import configure_logging, flush_logs, VERBOSITY
+from message_archive import load_messages_archive
+from order_records import load_pedidos_txt
+from birthday_index import load_crm_txt, parse_birthday
+
+GOLDEN_ORDERS = 'PEDIDOS_WALAKY_PRODUCCION_FINAL_20250716_223251.txt'
+GOLDEN_CRM = 'CRM_WALAKY_PRODUCCION_FINAL_20250716_231146.txt'
+
+CRM_FIELDS = ('nombre', 'cedula', 'email', 'fecha_cumpleanos')
+
+# Modos del pipeline a comparar: cada uno es solo una configuración distinta del mismo scraper
+MODES = {
+    # Verificación + formateo + CRM con Claude, un request por etapa
+    'three_stage': {'local_format_confidence': None, 'crm_batch_size': 1},
+    # Un solo request por candidato (verificación, formateo y CRM juntos)
+    'single_call': {'local_format_confidence': None, 'crm_batch_size': 1, 'single_call': True},
+    # Plantilla local primero; Claude solo para lo que no se reconoce con confianza
+    'cascade': {'local_format_confidence': 0.9, 'crm_batch_size': 1},
+    # Tres etapas con la extracción CRM en lotes
+    'batched': {'local_format_confidence': None, 'crm_batch_size': 20},
+    # Sin Claude: pre-filtro, plantilla local, formateo degradado y CRM por regex
+    'local_only': {'local_format_confidence': 0.9, 'crm_batch_size': 1, 'local_only': True},
+}
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize('NFD', (text or '').lower())
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+
+def _digits(text: str) -> str:
+    return re.sub(r'\D', '', text or '')
+
+
+def normalize_field(field: str, value: str):
+    """Forma comparable de un campo CRM (diferencias de formato no cuentan como error)"""
+    if field == 'nombre':
+        return _fold(re.sub(r'\([^)]*\)|\*', ' ', value or ''))
+    if field == 'cedula':
+        return _digits(value)
+    if field == 'email':
+        return (value or '').strip().lower()
+    birthday = parse_birthday((value or '').strip())
+    return (birthday['mes'], birthday['dia']) if birthday else _fold(value)
+
+
+def load_golden_labels(orders_file: str, crm_file: str) -> List[Tuple[str, Dict[str, str]]]:
+    """Pedidos del archivo PEDIDOS con su registro del CRM (mismo orden; el CRM omite los pedidos sin nombre)"""
+    orders = load_pedidos_txt(orders_file)
+    crm = load_crm_txt(crm_file)
+    labels, j = [], 0
+    for order in orders:
+        lines = order.split('\n')
+        cedula = _digits(next((l for l in lines if l.upper().startswith('CC')), ''))
+        name = _fold(lines[0])
+        # El registro correspondiente está en la misma posición o unas pocas más adelante
+        for k in range(j, min(j + 5, len(crm))):
+            record = crm[k]
+            if (record['cedula'] and record['cedula'] == cedula) or (record['nombre'] and _fold(record['nombre']) in name):
+                labels.append((order, record))
+                j = k + 1
+                break
+    return labels
+
+
+def align_messages(messages: List[Dict], labels: List[Tuple[str, Dict[str, str]]]) -> List[Optional[Dict[str, str]]]:
+    """Etiqueta dorada de cada mensaje crudo por la cédula que contiene (None = no es pedido etiquetado)"""
+    by_cedula: Dict[str, List[Dict[str, str]]] = {}
+    for _, record in labels:
+        if record['cedula']:
+            by_cedula.setdefault(record['cedula'], []).append(record)
+    aligned = []
+    for message in messages:
+        numbers = re.findall(r'\d[\d.,\s]{4,14}\d', message.get('body', '') or '')
+        found = None
+        for number in numbers:
+            candidates = by_cedula.get(_digits(number))
+            if candidates:
+                found = candidates.pop(0)
+                break
+        aligned.append(found)
+    return aligned
+
+
+def build_scraper(mode: str, credentials: Dict[str, str], profile: Dict) -> WhatsAppScraperClaudeProduction:
+    """Scraper nuevo por modo: contadores de costo y ledger propios"""
+    scraper = WhatsAppScraperClaudeProduction(credentials['instance_id'] or 'evaluacion', credentials['token'],
+                                              credentials['anthropic_api_key'])
+    scraper.configure_pacing(profile)
+    scraper.run_id = f"evaluacion_{mode}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    for attribute, value in MODES[mode].items():
+        setattr(scraper, attribute, value)
+    return scraper
+
+
+def run_mode(scraper: WhatsAppScraperClaudeProduction, messages: List[Dict]) -> Tuple[List[Optional[Dict[str, str]]], float]:
+    """Recorre los mensajes como el bucle de producción (sin progreso ni checkpoints) y extrae el CRM"""
+    started = time.time()
+    texts = [m.get('body', '') or '' for m in messages]
+    scraper.precompute_local_stages(texts)
+    formatted: List[Optional[str]] = []
+    for message, text in zip(messages, texts):
+        scraper.set_message_context(message.get('id'), 'evaluacion')
+        if len(text.strip()) < 20 or not scraper.quick_filter_message(text):
+            formatted.append(None)
+            continue
+        try:
+            is_order, formatted_message = scraper.process_candidate(text)
+        except Exception as e:
+            scraper.log('error_formato', "❌ Error en {message_id}: {error}", logging.WARNING, error=str(e)[:80])
+            is_order, formatted_message = False, None
+        formatted.append(formatted_message if is_order else None)
+
+    orders = [f for f in formatted if f]
+    crm = iter(scraper.extract_crm_for_messages(orders))
+    predictions = [next(crm) if f else None for f in formatted]
+    scraper.reset_local_results()
+    return predictions, time.time() - started
+
+
+def score_mode(predictions: List[Optional[Dict[str, str]]], golden: List[Optional[Dict[str, str]]]) -> Dict:
+    """Exactitud por campo sobre los pedidos etiquetados (un pedido no detectado cuenta como error en todo)"""
+    labeled = [(p, g) for p, g in zip(predictions, golden) if g is not None]
+    result = {
+        'pedidos_etiquetados': len(labeled),
+        'detectados': sum(1 for p, _ in labeled if p is not None),
+        'falsos_positivos': sum(1 for p, g in zip(predictions, golden) if g is None and p is not None),
+    }
+    for field in CRM_FIELDS:
+        hits = sum(1 for p, g in labeled
+                   if p is not None and normalize_field(field, p[field]) == normalize_field(field, g[field]))
+        result[field] = hits / len(labeled) if labeled else 0.0
+    result['recall'] = result['detectados'] / len(labeled) if labeled else 0.0
+    return result
+
+
+def fallback_summary(scraper: WhatsAppScraperClaudeProduction, mode: str) -> Dict:
+    """Cuánto de la corrida se resolvió sin Claude; en un modo con Claude cualquier fallback invalida la fila"""
+    fallbacks = scraper.claude_fallbacks
+    by_stage = {row['grupo']: row['requests'] for row in scraper.ledger.cost_by_stage(scraper.run_id)}
+    summary = {
+        'caidas_claude': fallbacks['outages'],
+        'fallback_verificacion': fallbacks['verification'],
+        'fallback_formateo': fallbacks['format'],
+        'fallback_crm': fallbacks['crm_extraction'],
+        'formateo_degradado': scraper.local_format_stats['degraded'],
+        'formateo_perdido': scraper.local_format_stats['lost'],
+        'requests_ledger': sum(by_stage.values()),
+    }
+    reasons = []
+    if not MODES[mode].get('local_only'):
+        if fallbacks['outages']:
+            reasons.append(f"caídas de Claude: {fallbacks['outages']}")
+        stages = [name for name, key in (('verificación', 'verification'), ('formateo', 'format'),
+                                         ('CRM', 'crm_extraction')) if fallbacks[key]]
+        if stages:
+            reasons.append(f"fallback local en {', '.join(stages)}")
+        if not summary['requests_ledger']:
+            reasons.append("ningún request llegó a Claude")
+    summary['valido'] = not reasons
+    summary['motivo'] = '; '.join(reasons)
+    return summary
+
+
+def evaluate(modes: List[str], messages: List[Dict], golden: List[Optional[Dict[str, str]]],
+             credentials: Dict[str, str], profile: Dict, skip_delays: bool = True) -> List[Dict]:
+    """Una fila por modo: exactitud, requests, tokens, dólares y mensajes/segundo"""
+    rows = []
+    for mode in modes:
+        if not MODES[mode].get('local_only') and not credentials['anthropic_api_key']:
+            print(f"⏭️  {mode}: sin ANTHROPIC_API_KEY, se omite")
+            continue
+        scraper = build_scraper(mode, credentials, without_delays(profile) if skip_delays else profile)
+        print(f"🔄 {mode}: {len(messages)} mensajes...")
+        predictions, seconds = run_mode(scraper, messages)
+        flush_logs()
+
+        row = {'modo': mode}
+        row.update(score_mode(predictions, golden))
+        tracking = scraper.cost_tracking
+        row.update({
+            'requests': tracking['total_requests'],
+            'input_tokens': tracking['input_tokens'],
+            'output_tokens': tracking['output_tokens'],
+            'costo': tracking['input_cost'] + tracking['output_cost'],
+            'segundos': seconds,
+            'mensajes_por_segundo': len(messages) / seconds if seconds else 0.0,
+            'run_id': scraper.run_id,
+        })
+        row.update(fallback_summary(scraper, mode))
+        if not row['valido']:
+            print(f"⚠️  {mode}: resultado INVÁLIDO - {row['motivo']}")
+        rows.append(row)
+    return rows
+
+
+def print_table(rows: List[Dict], format_only: bool = False):
+    """Tabla comparativa en consola (format_only: la entrada son los pedidos dorados, sin mensajes que no son pedido)"""
+    print("\n" + "📏" * 60)
+    print("                      EVALUACIÓN CONTRA EL CORPUS DORADO")
+    if format_only:
+        print("      PRUEBA DE HUMO SOLO DE FORMATO: entrada = pedidos dorados ya formateados; no compara modos")
+    print("📏" * 60)
+    header = f"{'modo':<12} {'recall':>7} {'nombre':>7} {'CC':>7} {'email':>7} {'FC':>7} {'FP':>4} " \
+             f"{'requests':>9} {'tokens':>10} {'costo $':>9} {'msg/s':>8}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        tokens = row['input_tokens'] + row['output_tokens']
+        false_positives = 'n/a' if format_only else row['falsos_positivos']
+        print(f"{row['modo']:<12} {row['recall']:>7.1%} {row['nombre']:>7.1%} {row['cedula']:>7.1%} "
+              f"{row['email']:>7.1%} {row['fecha_cumpleanos']:>7.1%} {false_positives:>4} "
+              f"{row['requests']:>9} {tokens:>10,} {row['costo']:>9.4f} {row['mensajes_por_segundo']:>8.1f}"
+              + ("" if row['valido'] else f"  ⚠️ INVÁLIDO: {row['motivo']}"))
+    if rows:
+        print(f"\n📝 {rows[0]['pedidos_etiquetados']} pedidos etiquetados; exactitud = campo correcto / pedidos etiquetados")
+    if any(not row['valido'] for row in rows):
+        print("⚠️  Las filas inválidas cayeron a modo local: sus números no miden el modo con Claude")
+    if format_only:
+        print("⚠️  Sin mensajes que no son pedido no hay falsos positivos que medir, y la plantilla local reconoce "
+              "los pedidos dorados por construcción; para comparar modos use --messages con un archivo crudo")
+    print("📏" * 60)
+
+
+def save_rows(rows: List[Dict], filename: str):
+    """Guarda la tabla en JSON o CSV según la extensión"""
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        if filename.endswith('.csv'):
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ['modo'])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara exactitud, costo y velocidad de los modos del pipeline contra el corpus dorado")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Modos separados por coma ({', '.join(MODES)})")
+    parser.add_argument('--messages', help="Mensajes crudos archivados (--archive del scraper) a etiquetar con el corpus dorado")
+    parser.add_argument('--format-smoke-test', action='store_true', help="Sin --messages: reprocesar los pedidos dorados como entrada (solo formato, no compara modos)")
+    parser.add_argument('--orders', default=GOLDEN_ORDERS, help="Archivo PEDIDOS dorado")
+    parser.add_argument('--crm', default=GOLDEN_CRM, help="Archivo CRM dorado")
+    parser.add_argument('--limit', type=int, default=100, help="Mensajes a evaluar por modo")
+    parser.add_argument('--config', default=None, help="Config JSON con credenciales y perfiles")
+    parser.add_argument('--pacing-profile', default='backfill', help="Perfil de modelo/reintentos/delays")
+    parser.add_argument('--respect-delays', action='store_true', help="Mantener los delays del perfil al medir mensajes/segundo")
+    parser.add_argument('--log-level', choices=sorted(VERBOSITY), default='silencioso')
+    parser.add_argument('--output', help="Guardar la tabla en .json o .csv")
+    args = parser.parse_args()
+
+    if not args.messages and not args.format_smoke_test:
+        parser.error("Falta --messages (mensajes crudos archivados con --archive); "
+                     "--format-smoke-test reprocesa los pedidos dorados solo como prueba de formato")
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"Modos desconocidos: {', '.join(unknown)}")
+
+    configure_logging(args.log_level)
+    config = load_config(args.config)
+    credentials = load_credentials(config)
+    profile = resolve_pacing_profile(args.pacing_profile, config)
+
+    labels = load_golden_labels(args.orders, args.crm)
+    if args.messages:
+        messages = load_messages_archive(args.messages)[:args.limit]
+        golden = align_messages(messages, labels)
+    else:
+        labels = labels[:args.limit]
+        messages = [{'id': f"dorado_{i}", 'body': order} for i, (order, _) in enumerate(labels, 1)]
+        golden = [record for _, record in labels]
+    print(f"📂 {len(messages)} mensajes, {sum(1 for g in golden if g)} con etiqueta dorada "
+          f"(perfil {profile['name']}, modelo {profile['claude_model']})")
+
+    rows = evaluate(modes, messages, golden, credentials, profile, skip_delays=not args.respect_delays)
+    print_table(rows, format_only=not args.messages)
+    if args.output:
+        save_rows(rows, args.output)
+        print(f"💾 Resultados guardados en: {args.output}")
@@ -0,0 +1,205 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from message_normalizer import ZERO_WIDTH_RE, EMOJI_RE, SPACES_RE
+
+# Orden canónico de las 10 líneas del pedido formateado
+FIELDS = ['nombre', 'cc', 'fc', 'direccion', 'barrio', 'ciudad', 'telefono', 'email', 'productos', 'pago']
+REQUIRED_FIELDS = ['nombre', 'cc', 'direccion', 'ciudad', 'telefono', 'productos', 'pago']
+
+# Etiquetas que algunos mensajes traen delante del dato ("Nombre: ...", "Cel: ...")
+LABEL_RE = re.compile(
+    r'^\s*(nombre( completo)?|direcci[oó]n|ciudad|municipio|tel[eé]fono|celular|cel|whatsapp|'
+    r'correo( electr[oó]nico)?|e-?mail|productos?|pedido|pago|forma de pago)\s*[:.\-]\s*',
+    re.IGNORECASE
+)
+
+CC_RE = re.compile(r'^\s*(?:cc|c\.\s*c\.?|c[ée]dula|documento|nit)\s*[:.#\-]?\s*(?:no\.?\s*)?([\d][\d\.\s]{4,})(.*)$', re.IGNORECASE)
+FC_RE = re.compile(r'^\s*(?:fc|f\.\s*c\.?|fecha de cumplea[ñn]os|cumplea[ñn]os)\s*[:.\-]?\s*(.+)$', re.IGNORECASE)
+BARRIO_RE = re.compile(r'^\s*barrio\s*[:.\-]?\s*(.+)$', re.IGNORECASE)
+EMAIL_RE = re.compile(r'[\w\.\-+]+@[\w\-]+(?:\.[\w\-]+)+')
+PHONE_RE = re.compile(r'^\s*(?:\+?57\s*)?(3\d{2}[\s\-\.]?\d{3}[\s\-\.]?\d{4}|\d{3}[\s\-\.]?\d{4}|6\d{2}[\s\-\.]?\d{3}[\s\-\.]?\d{4})\b')
+FOREIGN_PHONE_RE = re.compile(r'^\s*\+\d{1,3}[\s\-]?(\(?\d{1,4}\)?[\s\-]?){2,5}\d')
+NO_EMAIL_RE = re.compile(r'sin correo|no tiene correo|email no|correo no|no proporcion', re.IGNORECASE)
+NAME_RE = re.compile(r"[^\W\d_][^\W\d_'.]*(\s+[^\W\d_][^\W\d_'.]*){1,5}(\s*\(.*\))*")
+STREET_RE = re.compile(
+    r'^\s*(calle|cl|cll|carrera|cra|cr|kr|kra|diagonal|dg|transversal|tv|trans|avenida|av|circular|cq|'
+    r'autopista|manzana|mz|vereda|km|kil[oó]metro)\b\.?',
+    re.IGNORECASE
+)
+ADDRESS_NUMBER_RE = re.compile(r'#\s*\d|\d+[a-z]?\s*-\s*\d+', re.IGNORECASE)
+ADDRESS_DETAIL_RE = re.compile(r'^\s*(unidad|casa|apto|apartamento|torre|interior|int|conjunto|edificio|bloque|piso|local|urbanizaci[oó]n)\b', re.IGNORECASE)
+CITY_RE = re.compile(
+    r'\b(medell[ií]n|bogot[aá]|cali|barranquilla|cartagena|bucaramanga|pereira|manizales|armenia|ibagu[eé]|'
+    r'c[uú]cuta|villavicencio|santa marta|monter[ií]a|pasto|neiva|popay[aá]n|tunja|sincelejo|valledupar|'
+    r'itag[uü][ií]|envigado|bello|sabaneta|la estrella|caldas|copacabana|girardota|rionegro|la ceja|'
+    r'marinilla|guarne|el retiro|soacha|ch[ií]a|zipaquir[aá]|funza|mosquera|madrid|cajic[aá]|palmira|'
+    r'jamund[ií]|floridablanca|gir[oó]n|piedecuesta|dosquebradas|soledad|'
+    r'ant|antioquia|cundinamarca|valle( del cauca)?|santander|atl[aá]ntico|bol[ií]var|risaralda|caldas|'
+    r'quind[ií]o|tolima|huila|meta|nari[ñn]o|boyac[aá]|c[oó]rdoba|sucre|cesar|magdalena|cauca|d\.?\s?c\.?)\b',
+    re.IGNORECASE
+)
+PRODUCT_RE = re.compile(
+    r'shampoo|champ[uú]|kit|tratamiento|s[ée]rum|suero|styling|t[óo]nico|exfoliante|termoprotector|'
+    r'acondicionador|mascarilla|aceite|bolsas?\b',
+    re.IGNORECASE
+)
+PAYMENT_RE = re.compile(r'^\s*(no\s+)?paga\b|^\s*efectivo\b|\bpag[oó]\b|contra\s?entrega|contraentrega|transferencia|de contado', re.IGNORECASE)
+
+
+def clean_lines(message_text: str) -> List[str]:
+    """Líneas del mensaje sin emojis ni caracteres invisibles (conserva las notas con *)"""
+    text = ZERO_WIDTH_RE.sub('', message_text or '')
+    text = EMOJI_RE.sub('', text)
+    lines = []
+    for line in text.split('\n'):
+        line = SPACES_RE.sub(' ', line).strip()
+        # Negritas que envuelven la línea completa ("*Natalia Ramirez*")
+        if len(line) > 2 and line.startswith('*') and line.endswith('*') and line.count('*') == 2:
+            line = line[1:-1].strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def classify_line(line: str) -> Tuple[str, str]:
+    """Campo del pedido al que corresponde una línea y su valor normalizado"""
+    label_match = LABEL_RE.match(line)
+    label = label_match.group(1).lower() if label_match else ''
+    value = line[label_match.end():].strip() if label_match else line
+
+    cc_match = CC_RE.match(value)
+    if cc_match:
+        digits = re.sub(r'\D', '', cc_match.group(1))
+        return 'cc', f"CC {digits}{cc_match.group(2).rstrip()}"
+
+    fc_match = FC_RE.match(value)
+    if fc_match:
+        return 'fc', f"FC {fc_match.group(1).strip()}"
+
+    barrio_match = BARRIO_RE.match(value)
+    if barrio_match:
+        return 'barrio', f"Barrio {barrio_match.group(1).strip()}"
+
+    email_match = EMAIL_RE.search(value)
+    if (email_match and len(value) <= len(email_match.group(0)) + 25) or (len(value) < 40 and NO_EMAIL_RE.search(value)):
+        return 'email', value
+
+    if label.startswith(('tel', 'cel', 'whatsapp')) or PHONE_RE.match(value) or FOREIGN_PHONE_RE.match(value):
+        return 'telefono', value
+
+    if label.startswith(('pago', 'forma')) or PAYMENT_RE.search(value):
+        return 'pago', value
+
+    if label.startswith(('producto', 'pedido')) or PRODUCT_RE.search(value):
+        return 'productos', value
+
+    if label.startswith('direcci') or STREET_RE.match(value) or ADDRESS_NUMBER_RE.search(value):
+        return 'direccion', value
+
+    if label in ('ciudad', 'municipio') or (CITY_RE.search(value) and not re.search(r'\d{3,}\s*$', value)
+                                           and len(value.split()) <= 6):
+        return 'ciudad', value
+
+    if ADDRESS_DETAIL_RE.match(value):
+        return 'detalle_direccion', value
+
+    if label.startswith('nombre') or NAME_RE.fullmatch(value):
+        return 'nombre', value
+
+    return 'desconocido', value
+
+
+def parse_order_template(message_text: str) -> Dict:
+    """Reconoce un pedido casi canónico y devuelve sus campos, la confianza y los problemas encontrados"""
+    fields: Dict[str, List[str]] = {field: [] for field in FIELDS}
+    fields['notas'] = []
+    issues: List[str] = []
+    unknown = 0
+    last_field = None
+
+    for line in clean_lines(message_text):
+        field, value = classify_line(line)
+
+        if last_field is None and NAME_RE.fullmatch(value) and not LABEL_RE.match(line):
+            # La primera línea del pedido es el nombre aunque coincida con una ciudad (Mosquera, Caldas...)
+            field = 'nombre'
+        elif field == 'detalle_direccion' or (field in ('desconocido', 'nombre') and last_field == 'direccion'):
+            # Unidad, torre, apto... quedan como líneas extra de la dirección
+            field = 'direccion'
+        elif field == 'desconocido' and last_field == 'productos' and value.startswith('('):
+            # Notas sueltas del pedido ("(*20% dscto*)") van con los productos
+            field = 'productos'
+        elif field == 'nombre' and fields['nombre']:
+            # Un segundo "nombre" suele ser la ciudad o una nota: no se adivina
+            field = 'ciudad' if CITY_RE.search(value) and not fields['ciudad'] else 'desconocido'
+        elif field in ('cc', 'fc', 'barrio', 'ciudad', 'telefono', 'email') and fields[field]:
+            issues.append(f"{field} repetido")
+            field = 'desconocido'
+
+        if field == 'desconocido':
+            unknown += 1
+            issues.append(f"línea sin clasificar: {value[:40]}")
+            fields['notas'].append(value)
+        else:
+            fields[field].append(value)
+        last_field = field
+
+    # Validaciones de los datos que luego alimentan el CRM
+    if fields['cc']:
+        digits = re.sub(r'\D', '', fields['cc'][0].split(' ', 2)[1])
+        if not 5 <= len(digits) <= 11:
+            issues.append(f"cédula con {len(digits)} dígitos")
+            fields['cc'] = []
+    if fields['telefono']:
+        phone_match = PHONE_RE.match(fields['telefono'][0])
+        phone_digits = re.sub(r'\D', '', phone_match.group(1)) if phone_match else ''
+        if len(phone_digits) not in (7, 10) and not FOREIGN_PHONE_RE.match(fields['telefono'][0]):
+            issues.append("teléfono inválido")
+            fields['telefono'] = []
+    # "Sin correo" se conserva en el pedido pero no cuenta como email
+    has_email = bool(fields['email']) and bool(EMAIL_RE.search(fields['email'][0]))
+
+    missing = [field for field in REQUIRED_FIELDS if not fields[field]]
+    optional_found = sum([bool(fields['fc']), bool(fields['barrio']), has_email])
+    confidence = 0.8 * (len(REQUIRED_FIELDS) - len(missing)) / len(REQUIRED_FIELDS) + 0.2 * optional_found / 3
+    confidence = max(0.0, confidence - 0.1 * unknown)
+    issues.extend(f"falta {field}" for field in missing)
+
+    return {'fields': fields, 'confidence': round(confidence, 3), 'issues': issues}
+
+
+def render_order(fields: Dict[str, List[str]]) -> str:
+    """Pedido en el formato de 10 líneas que produce format_with_claude (las líneas sin clasificar, al final)"""
+    lines = []
+    for field in FIELDS + ['notas']:
+        lines.extend(fields.get(field) or [])
+    return '\n'.join(lines)
+
+
+def format_locally(message_text: str) -> Tuple[Optional[str], float, List[str]]:
+    """Formateo sin Claude: (pedido formateado o None, confianza 0-1, problemas)"""
+    parsed = parse_order_template(message_text)
+    if not parsed['fields']['nombre'] and not parsed['fields']['cc']:
+        return None, 0.0, parsed['issues']
+    return render_order(parsed['fields']), parsed['confidence'], parsed['issues']
+
+
+def extract_crm_locally(formatted_message: str) -> Dict[str, str]:
+    """Los 4 datos CRM de un pedido formateado con expresiones regulares (sin Claude)"""
+    lines = [l.strip() for l in formatted_message.split('\n') if l.strip()]
+
+    nombre = ''
+    if lines:
+        nombre = re.sub(r'\(.*?\)', '', lines[0]).replace('*', '').strip()
+
+    cedula_match = re.search(r'^\s*(?:CC|C\.C\.?|c[ée]dula)[:\s]*([\d\.\s]{5,})', formatted_message, re.IGNORECASE | re.MULTILINE)
+    email_match = EMAIL_RE.search(formatted_message)
+    fc_match = re.search(r'^\s*FC[:\s]+(.+)$', formatted_message, re.IGNORECASE | re.MULTILINE)
+
+    return {
+        'nombre': nombre,
+        'cedula': re.sub(r'\D', '', cedula_match.group(1)) if cedula_match else '',
+        'email': email_match.group(0) if email_match else '',
+        'fecha_cumpleanos': fc_match.group(1).strip() if fc_match else ''
+    }
@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import prefilter
+from local_formatter import format_locally, extract_crm_locally
+
+# Resultado compacto por mensaje: (puntaje pre-filtro, pedido en plantilla o None, confianza, problemas)
+LocalResult = Tuple[int, Optional[str], float, Tuple[str, ...]]
+
+# Estado por proceso worker (catálogo y gazetteer se cargan una vez, no se envían en cada lote)
+_worker_state: Dict = {}
+
+
+def analyze_message(message_text: str) -> LocalResult:
+    """Etapas locales de un mensaje: pre-filtro y, si pasa, parseo/validación de la plantilla"""
+    score = prefilter.prefilter_score(message_text)
+    if score == 0:
+        return 0, None, 0.0, ()
+    local_text, confidence, issues = format_locally(message_text)
+    return score, local_text, confidence, tuple(issues)
+
+
+def _analyze_chunk(texts: Sequence[str]) -> List[LocalResult]:
+    return [analyze_message(text) for text in texts]
+
+
+def _crm_chunk(texts: Sequence[str]) -> List[Tuple[str, str, str, str]]:
+    results = []
+    for text in texts:
+        record = extract_crm_locally(text)
+        results.append((record['nombre'], record['cedula'], record['email'], record['fecha_cumpleanos']))
+    return results
+
+
+def _init_records_worker(catalog_path: Optional[str], localities_path: Optional[str]):
+    from product_catalog import ProductCatalog
+    from address_normalizer import LocalityIndex
+    _worker_state['catalog'] = ProductCatalog.from_csv(catalog_path) if catalog_path else None
+    _worker_state['localities'] = LocalityIndex.from_csv(localities_path) if localities_path else None
+
+
+def _records_chunk(items: Sequence[Tuple[int, str]]) -> List[Dict]:
+    from order_records import build_order_record
+    return [build_order_record(index, text, _worker_state.get('catalog'), _worker_state.get('localities'))
+            for index, text in items]
+
+
+class LocalStagePool:
+    """Etapas locales (pre-filtro, plantilla, CRM, registros) en un pool de procesos, por lotes y en orden"""
+
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 256):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size)
+
+    def _map(self, func: Callable, items: Sequence, initializer: Optional[Callable] = None, initargs: tuple = ()) -> List:
+        """Aplica func a lotes de items; los resultados vuelven en el orden original"""
+        chunks = [items[i:i + self.chunk_size] for i in range(0, len(items), self.chunk_size)]
+        results: List = []
+        if self.workers <= 1 or len(chunks) <= 1:
+            # Un solo lote no compensa arrancar procesos
+            if initializer:
+                initializer(*initargs)
+            for chunk in chunks:
+                results.extend(func(chunk))
+            return results
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(chunks)),
+                                 initializer=initializer, initargs=initargs) as pool:
+            for chunk_result in pool.map(func, chunks):
+                results.extend(chunk_result)
+        return results
+
+    def analyze(self, texts: Sequence[str]) -> Dict[str, LocalResult]:
+        """Pre-filtro y plantilla de todos los textos; los cuerpos repetidos se analizan una sola vez"""
+        unique = list(dict.fromkeys(t for t in texts if t))
+        return dict(zip(unique, self._map(_analyze_chunk, unique)))
+
+    def extract_crm(self, formatted_messages: Sequence[str]) -> List[Dict[str, str]]:
+        """Extracción CRM local (regex) de muchos pedidos formateados"""
+        keys = ('nombre', 'cedula', 'email', 'fecha_cumpleanos')
+        return [dict(zip(keys, row)) for row in self._map(_crm_chunk, list(formatted_messages))]
+
+    def build_order_records(self, formatted_messages: Sequence[str], catalog_path: Optional[str] = None,
+                            localities_path: Optional[str] = None) -> List[Dict]:
+        """Registros estructurados (productos con código, dirección normalizada) en paralelo"""
+        items = list(enumerate(formatted_messages, 1))
+        return self._map(_records_chunk, items, _init_records_worker, (catalog_path, localities_path))
@@ -0,0 +1,26 @@
+import json
+from typing import List, Dict
+
+
+def save_messages_archive(messages: List[Dict], filename: str) -> str:
+    """Guarda los mensajes crudos de WhatsApp para poder reproducirlos sin la API"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(messages, f, ensure_ascii=False)
+    return filename
+
+
+def load_messages_archive(filename: str) -> List[Dict]:
+    """Carga mensajes archivados (JSON de chats/messages o JSONL, uno por línea)"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+
+    if not content:
+        return []
+
+    if content.startswith('['):
+        data = json.loads(content)
+    else:
+        data = [json.loads(line) for line in content.split('\n') if line.strip()]
+
+    # Aceptar también listas de textos sueltos
+    return [m if isinstance(m, dict) else {'body': str(m)} for m in data]
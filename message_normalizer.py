@@ -0,0 +1,113 @@
+import re
+import math
+import unicodedata
+from typing import List
+
+# Caracteres invisibles que WhatsApp suele colar en los mensajes reenviados
+ZERO_WIDTH_RE = re.compile('[\u200b-\u200f\u202a-\u202e\u2060-\u2064\ufeff\u00ad]')
+
+# Emojis y pictogramas (no aportan información al pedido)
+EMOJI_RE = re.compile(
+    '['
+    '\U0001F000-\U0001FAFF'
+    '\U00002600-\U000027BF'
+    '\U00002B00-\U00002BFF'
+    '\U0000FE00-\U0000FE0F'
+    '\U0001F1E6-\U0001F1FF'
+    '\u200d\u20e3'
+    ']+'
+)
+
+# Marcas de formato de WhatsApp: *negrita*, _cursiva_, ~tachado~, ```mono```
+MONO_RE = re.compile(r'```')
+ITALIC_RE = re.compile(r'(?<!\w)_([^_\n]+)_(?!\w)')
+STRIKE_RE = re.compile(r'(?<!\w)~([^~\n]+)~(?!\w)')
+EMPTY_PARENS_RE = re.compile(r'\(\s*\)')
+SPACES_RE = re.compile('[ \t\u00a0\u2000-\u200a\u3000]+')
+
+# Señales de las líneas que llevan la información del pedido
+SIGNAL_PATTERNS = [
+    re.compile(r'^\s*(cc|c\.c|fc|nit)\b', re.IGNORECASE),
+    re.compile(r'c[ée]dula|documento', re.IGNORECASE),
+    re.compile(r'\b(barrio|calle|cl|cll|carrera|cra|cr|kr|diagonal|dg|transversal|tv|avenida|av|apto|apartamento|casa|torre|interior|conjunto|edificio)\b', re.IGNORECASE),
+    re.compile(r'#\s*\d|\d+\s*-\s*\d+'),
+    re.compile(r'\b(medell[ií]n|bogot[aá]|cali|ant|antioquia|cundinamarca|d\.?c)\b', re.IGNORECASE),
+    re.compile(r'shampoo|kit|tratamiento|s[ée]rum|suero|styling|t[óo]nico|exfoliante|termoprotector', re.IGNORECASE),
+    re.compile(r'\bpaga|env[ií]o|efectivo|transferencia|contado|dcto|dscto', re.IGNORECASE),
+    re.compile(r'@'),
+    re.compile(r'\d[\d ]{6,}\d'),
+]
+
+# Aproximación de caracteres por token para texto en español
+CHARS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text: str) -> int:
+    """Estima localmente los tokens de un texto (sin llamar a la API)"""
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def normalize_message(message_text: str) -> str:
+    """Compacta el mensaje conservando toda la información del pedido"""
+    if not message_text:
+        return ''
+
+    text = unicodedata.normalize('NFC', message_text)
+    text = ZERO_WIDTH_RE.sub('', text)
+    text = EMOJI_RE.sub(' ', text)
+
+    # Quitar marcas de formato pero conservar el texto marcado
+    text = text.replace('*', '')
+    text = MONO_RE.sub('', text)
+    text = ITALIC_RE.sub(r'\1', text)
+    text = STRIKE_RE.sub(r'\1', text)
+
+    lines = []
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        # Paréntesis que quedaron vacíos al quitar emojis o asteriscos
+        line = EMPTY_PARENS_RE.sub('', line)
+        line = SPACES_RE.sub(' ', line).strip()
+        if line:
+            lines.append(line)
+
+    return '\n'.join(lines)
+
+
+def line_has_signal(line: str) -> bool:
+    """Indica si una línea contiene datos útiles del pedido (CC, dirección, productos...)"""
+    return any(pattern.search(line) for pattern in SIGNAL_PATTERNS)
+
+
+def smart_truncate(text: str, max_chars: int = 600) -> str:
+    """Recorta priorizando las líneas con señales de pedido en vez de cortar a ciegas"""
+    if len(text) <= max_chars:
+        return text
+
+    lines = text.split('\n')
+    selected: List[int] = []
+    used = 0
+
+    def try_add(index: int) -> bool:
+        nonlocal used
+        cost = len(lines[index]) + (1 if selected else 0)
+        if used + cost > max_chars:
+            return False
+        selected.append(index)
+        used += cost
+        return True
+
+    # Primera línea (normalmente el nombre), luego líneas con señales, luego el resto
+    try_add(0)
+    for i in range(1, len(lines)):
+        if line_has_signal(lines[i]):
+            try_add(i)
+    for i in range(1, len(lines)):
+        if i not in selected:
+            try_add(i)
+
+    if not selected:
+        return text[:max_chars]
+
+    return '\n'.join(lines[i] for i in sorted(selected))
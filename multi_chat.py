@@ -0,0 +1,197 @@
+import re
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Dict, Optional
+
+from budget_controller import BudgetController
+from structured_log import flush_logs, log_event
+
+SEPARATOR = '\n=== PEDIDO SEPARADOR ===\n'
+
+
+def chat_slug(chat_id: str) -> str:
+    """Nombre corto y seguro para archivos a partir del chat id"""
+    return re.sub(r'\W+', '_', chat_id.split('@')[0]).strip('_') or 'chat'
+
+
+class ChatState:
+    """Resultados, checkpoint y estadísticas de un chat (separados de los demás chats)"""
+
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self.slug = chat_slug(chat_id)
+        self.progress_file = f"progreso_produccion_final_{self.slug}.txt"
+        self.ids_file = f"progreso_produccion_final_{self.slug}.ids.json"
+        self.run_id: Optional[str] = None
+        self.lock = threading.Lock()
+
+        self.previous_orders: List[str] = []
+        self.new_orders: Dict[int, str] = {}
+        self.done_ids = set()
+        self.stats = {'messages': 0, 'prefilter_rejected': 0, 'skipped': 0, 'orders': 0, 'errors': 0}
+
+    def load(self):
+        """Carga el checkpoint previo de este chat"""
+        try:
+            with open(self.progress_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+                self.previous_orders = [m.strip() for m in content.split('=== PEDIDO SEPARADOR ===\n') if m.strip()]
+        except FileNotFoundError:
+            self.previous_orders = []
+        try:
+            with open(self.ids_file, 'r', encoding='utf-8') as f:
+                self.done_ids = set(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.done_ids = set()
+
+    def formatted_messages(self) -> List[str]:
+        """Pedidos previos + nuevos en el orden original de los mensajes"""
+        return self.previous_orders + [self.new_orders[i] for i in sorted(self.new_orders)]
+
+    def save(self):
+        """Guarda el checkpoint (llamar con el lock tomado)"""
+        try:
+            with open(self.progress_file, 'w', encoding='utf-8') as f:
+                f.write(SEPARATOR.join(self.formatted_messages()))
+            with open(self.ids_file, 'w', encoding='utf-8') as f:
+                json.dump(sorted(self.done_ids), f)
+        except Exception as e:
+            log_event('error_progreso', "⚠️ Error guardando progreso de {chat_id}: {error}", logging.WARNING,
+                      chat_id=self.chat_id, error=str(e))
+
+
+class MultiChatScheduler:
+    """Procesa varios grupos en un proceso: WhatsApp pausado por número, etapas LLM en un pool compartido"""
+
+    def __init__(self, scraper, chat_ids: List[str], limit: int = 1000, llm_workers: int = 4):
+        self.scraper = scraper
+        self.limit = limit
+        self.llm_workers = llm_workers
+        self.states = {chat_id: ChatState(chat_id) for chat_id in chat_ids}
+
+    def run(self) -> Dict[str, List[str]]:
+        """Obtiene todos los chats y procesa sus candidatos; devuelve pedidos por chat"""
+        s = self.scraper
+        print("🏭" * 30)
+        print(f"                    RUTINA MULTI-CHAT: {len(self.states)} grupos")
+        print("🏭" * 30)
+        print(f"🛡️  Pacing WhatsApp compartido por el número {s.instance_id}")
+        print(f"🧠 Pool LLM compartido: {self.llm_workers} workers\n")
+
+        for state in self.states.values():
+            state.load()
+            state.run_id = s.ledger.open_run(state.chat_id, state.progress_file)
+            if state.previous_orders:
+                log_event('progreso_cargado', "📥 {chat_id}: {pedidos} pedidos previos cargados",
+                          chat_id=state.chat_id, pedidos=len(state.previous_orders))
+
+        with ThreadPoolExecutor(max_workers=self.llm_workers, thread_name_prefix='llm') as llm_pool, \
+                ThreadPoolExecutor(max_workers=len(self.states), thread_name_prefix='fetch') as fetch_pool:
+            # Cada chat se obtiene en su hilo; el pacer serializa las llamadas al número
+            fetches = [fetch_pool.submit(self._fetch_and_dispatch, state, llm_pool)
+                       for state in self.states.values()]
+            llm_futures = []
+            for fetch in fetches:
+                llm_futures.extend(fetch.result())
+            wait(llm_futures)
+        s.close_speculation_pool()
+
+        flush_logs()
+        for state in self.states.values():
+            with state.lock:
+                state.save()
+            self._print_chat_stats(state)
+
+        return {chat_id: state.formatted_messages() for chat_id, state in self.states.items()}
+
+    def _fetch_and_dispatch(self, state: ChatState, llm_pool: ThreadPoolExecutor) -> list:
+        """Obtiene los mensajes de un chat y encola en el pool los que pasan el pre-filtro"""
+        s = self.scraper
+        messages = s.get_messages(state.chat_id, self.limit)
+        state.stats['messages'] = len(messages)
+        log_event('mensajes_obtenidos', "📊 {chat_id}: {mensajes} mensajes obtenidos",
+                  chat_id=state.chat_id, mensajes=len(messages))
+        s.precompute_local_stages([m.get('body', '') or '' for m in messages])
+
+        futures = []
+        for i, message in enumerate(messages):
+            message_id = message.get('id') or f"idx_{i}"
+            message_text = message.get('body', '') or ''
+
+            if message_id in state.done_ids:
+                continue
+            if len(message_text.strip()) < 20:
+                with state.lock:
+                    state.stats['skipped'] += 1
+                continue
+            if not s.quick_filter_message(message_text):
+                with state.lock:
+                    state.stats['prefilter_rejected'] += 1
+                continue
+
+            futures.append(llm_pool.submit(self._process, state, i, message_id, message_text))
+        return futures
+
+    def _process(self, state: ChatState, index: int, message_id: str, message_text: str):
+        """Unidad de trabajo del pool LLM"""
+        s = self.scraper
+        # Presupuesto agotado: no se marca como hecho para retomarlo al reanudar
+        if s.budget_level() == BudgetController.PAUSA:
+            return
+
+        s.set_message_context(message_id, state.chat_id, state.run_id)
+        try:
+            is_order, formatted_message = s.process_candidate(message_text)
+        except Exception as e:
+            s.log('error_mensaje', "❌ {chat} mensaje {indice}: {error}", logging.WARNING,
+                  chat=state.slug, indice=index + 1, error=str(e)[:60])
+            with state.lock:
+                state.stats['errors'] += 1
+            return
+
+        with state.lock:
+            if is_order and formatted_message:
+                state.new_orders[index] = formatted_message
+                state.stats['orders'] += 1
+                first_line = formatted_message.split('\n')[0]
+                s.log('pedido', "✅ {chat} PEDIDO {pedido}: {nombre}", chat=state.slug,
+                      pedido=len(state.previous_orders) + state.stats['orders'], nombre=first_line)
+            elif is_order:
+                state.stats['errors'] += 1
+                s.log('error_formato', "❌ {chat} ERROR AL FORMATEAR mensaje {indice}", logging.WARNING,
+                      chat=state.slug, indice=index + 1)
+                return
+            else:
+                state.stats['skipped'] += 1
+            state.done_ids.add(message_id)
+            state.save()
+
+    def save_outputs(self, results: Dict[str, List[str]]) -> Dict[str, tuple]:
+        """Genera PEDIDOS/CRM por chat, cada uno con su corrida en el ledger; cierra todas las corridas"""
+        s = self.scraper
+        files = {}
+        for chat_id, formatted_messages in results.items():
+            state = self.states[chat_id]
+            if not formatted_messages:
+                # Sin pedidos no hay archivos, pero la corrida igual termina
+                s.ledger.close_run(state.run_id)
+                continue
+            s.run_id = state.run_id
+            s.progress_file = state.progress_file
+            s.set_message_context(None, chat_id, state.run_id)
+            files[chat_id] = s.save_final_production_files(formatted_messages, file_tag=state.slug)
+        return files
+
+    def run_ids(self) -> List[str]:
+        """Corridas del ledger de todos los chats del lote"""
+        return [state.run_id for state in self.states.values() if state.run_id]
+
+    @staticmethod
+    def _print_chat_stats(state: ChatState):
+        st = state.stats
+        print(f"\n📊 {state.chat_id}")
+        print(f"   📝 Mensajes: {st['messages']}  ⚡ Pre-filtro rechazó: {st['prefilter_rejected']}")
+        print(f"   ✅ Pedidos nuevos: {st['orders']}  ⏭️ Saltados: {st['skipped']}  ❌ Errores: {st['errors']}")
+        print(f"   💾 Checkpoint: {state.progress_file}")
@@ -0,0 +1,87 @@
+import re
+import json
+import hashlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+from local_formatter import parse_order_template, EMAIL_RE
+from birthday_index import parse_birthday
+from address_normalizer import normalize_address_fields
+
+
+def build_order_record(index: int, formatted_message: str, catalog=None, localities=None) -> Dict:
+    """Pedido formateado → registro estructurado (productos con código si hay catálogo, dirección normalizada)"""
+    fields = parse_order_template(formatted_message)['fields']
+
+    def first(name: str) -> str:
+        return fields[name][0] if fields[name] else ''
+
+    email = EMAIL_RE.search(first('email'))
+    birthday = parse_birthday(first('fc')[3:].strip())
+
+    record = {
+        'pedido': index,
+        'nombre': first('nombre'),
+        'cedula': re.sub(r'\D', '', first('cc').split(' ')[1]) if fields['cc'] else '',
+        'fc': first('fc')[3:].strip(),
+        'fc_mes_dia': f"{birthday['mes']:02d}-{birthday['dia']:02d}" if birthday else '',
+        'fc_ambigua': bool(birthday and birthday['ambigua']),
+        'direccion': ' | '.join(fields['direccion']),
+        'barrio': first('barrio')[7:].strip(),
+        'ciudad': first('ciudad'),
+        'telefono': first('telefono'),
+        'email': email.group(0) if email else '',
+        'productos_texto': fields['productos'],
+        'pago': ' '.join(fields['pago']),
+        'notas': fields['notas'],
+        'productos': catalog.match_products(fields['productos']) if catalog else []
+    }
+    record.update(normalize_address_fields(fields['direccion'], first('ciudad'), localities))
+    return record
+
+
+def order_fingerprint(record: Dict, occurrence: int = 0) -> str:
+    """Huella de un pedido por su contenido: la misma venta reaparece en corridas posteriores.
+    occurrence distingue compras idénticas repetidas dentro de un mismo archivo (0 = primera)"""
+    key = [record.get('cedula'), record.get('nombre'), record.get('productos_texto'), record.get('pago')]
+    if occurrence:
+        key.append(occurrence)
+    return hashlib.md5(json.dumps(key, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def order_fingerprints(records: List[Dict], seen: Optional[Counter] = None) -> List[str]:
+    """Huellas de los pedidos de un archivo, en orden: la segunda compra idéntica del archivo es otra venta,
+    pero la misma en un archivo posterior (que repite las anteriores) recibe la misma huella.
+    seen = conteo de huellas base de las líneas del archivo ya leídas antes"""
+    seen = Counter(seen or {})
+    fingerprints = []
+    for record in records:
+        base = order_fingerprint(record)
+        fingerprints.append(order_fingerprint(record, seen[base]))
+        seen[base] += 1
+    return fingerprints
+
+
+def build_order_records(formatted_messages: List[str], catalog=None, localities=None) -> List[Dict]:
+    """Registros estructurados de todos los pedidos, en el mismo orden del archivo PEDIDOS"""
+    return [build_order_record(i, message, catalog, localities) for i, message in enumerate(formatted_messages, 1)]
+
+
+def save_order_records(records: List[Dict], filename: str):
+    """Guarda los pedidos estructurados en JSONL (una línea por pedido)"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def load_order_records(filename: str) -> List[Dict]:
+    """Carga pedidos estructurados desde JSONL"""
+    with open(filename, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_pedidos_txt(filename: str) -> List[str]:
+    """Lee los pedidos formateados de un archivo PEDIDOS_WALAKY_*.txt generado por el scraper"""
+    with open(filename, encoding='utf-8') as f:
+        blocks = re.split(r'=== PEDIDO \d+ ===\n', f.read())[1:]
+    return [block.split('\n====')[0].strip() for block in blocks]
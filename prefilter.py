@@ -0,0 +1,44 @@
+# Pre-filtro local: decide sin Claude qué mensajes merecen verificación
+
+STRONG_INDICATORS = ['cc ', 'fc ', 'cédula', 'cedula', 'paga', 'envío', 'entrega']
+PRODUCT_INDICATORS = ['shampoo', 'kit', 'tratamiento', 'sérum', 'serum', 'styling', 'tónico']
+LOCATION_INDICATORS = ['barrio', 'calle', 'carrera', 'medellín', 'bogotá', 'cali', 'ant']
+CONTACT_INDICATORS = ['@', 'gmail', 'hotmail', 'llamar', 'escribir']
+
+NEGATIVE_INDICATORS = [
+    'este pedido es diferente', 'no, es el mismo', 'hola', 'gracias',
+    'envíos nacionales', 'guía', '¿podrías ayudarme?', 'esperando',
+    'hola ana', 'espero estés bien', 'ayudarme con esta guía'
+]
+
+
+def prefilter_score(message_text: str) -> int:
+    """Puntaje del pre-filtro: 0 si se rechaza, si no el total de indicadores encontrados"""
+    if not message_text or len(message_text.strip()) < 30:
+        return 0
+
+    text_lower = message_text.lower()
+
+    if any(neg in text_lower for neg in NEGATIVE_INDICATORS):
+        return 0
+
+    strong_count = sum(1 for indicator in STRONG_INDICATORS if indicator in text_lower)
+    product_count = sum(1 for indicator in PRODUCT_INDICATORS if indicator in text_lower)
+    location_count = sum(1 for indicator in LOCATION_INDICATORS if indicator in text_lower)
+    contact_count = sum(1 for indicator in CONTACT_INDICATORS if indicator in text_lower)
+
+    indicator_types = sum([
+        strong_count > 0,
+        product_count > 0,
+        location_count > 0,
+        contact_count > 0
+    ])
+
+    if indicator_types < 2 or strong_count < 1:
+        return 0
+    return strong_count + product_count + location_count + contact_count
+
+
+def quick_filter_message(message_text: str) -> bool:
+    """Pre-filtro inteligente para reducir llamadas a Claude"""
+    return prefilter_score(message_text) > 0
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+# Prioridad de los mensajes en vivo frente al relleno por polling y al backlog
+LIVE_PRIORITY = 10
+GAP_FILL_PRIORITY = 0
+
+LIVE_LANE = 'vivo'
+BACKLOG_LANE = 'backlog'
+
+
+def message_timestamp(message: Dict) -> Optional[float]:
+    """Timestamp de WhatsApp del mensaje (segundos), si viene"""
+    value = message.get('time') or message.get('timestamp')
+    try:
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backlog_priority(score: int, base: int = GAP_FILL_PRIORITY) -> int:
+    """Prioridad entera para la cola persistente: el pre-filtro sube el backlog sin alcanzar al carril en vivo"""
+    return min(base + score // 3, LIVE_PRIORITY - 1)
+
+
+class PriorityScheduler:
+    """Orden de trabajo de las etapas LLM: carril rápido para mensajes en vivo y backlog por recencia + pre-filtro"""
+
+    def __init__(self, recency_weight: float = 4.0, recency_half_life_hours: float = 24.0,
+                 score_weight: float = 1.0, aging_per_minute: float = 0.5, live_burst: int = 5):
+        self.recency_weight = recency_weight
+        self.recency_half_life = recency_half_life_hours * 3600
+        self.score_weight = score_weight
+        self.aging_per_second = aging_per_minute / 60
+        # Tras live_burst mensajes en vivo seguidos pasa uno del backlog, para que nunca se detenga del todo
+        self.live_burst = live_burst
+        self._live = deque()
+        self._backlog = []
+        self._order = itertools.count()
+        self._live_streak = 0
+        self._condition = threading.Condition()
+        # Sin trabajo pendiente la corrida termina: desde ahí add_live rechaza y el mensaje va a la cola durable
+        self._draining = False
+        self.stats = {LIVE_LANE: 0, BACKLOG_LANE: 0, 'espera_vivo_max_s': 0.0}
+
+    def rank(self, score: int, timestamp: Optional[float], now: Optional[float] = None) -> float:
+        """Mayor = antes: puntaje del pre-filtro más un bono por recencia que se reduce a la mitad cada half-life"""
+        now = now or time.time()
+        recency = 0.5 ** (max(now - timestamp, 0) / self.recency_half_life) if timestamp else 0.0
+        return self.score_weight * score + self.recency_weight * recency
+
+    def add_backlog(self, key, message: Dict, score: int):
+        """Mensaje histórico; lo que lleva más tiempo esperando gana prioridad (envejecimiento)"""
+        now = time.time()
+        # rank + aging * (t - llegada) ordena igual en todo t que rank - aging * llegada
+        effective = self.rank(score, message_timestamp(message), now) - self.aging_per_second * now
+        with self._condition:
+            heapq.heappush(self._backlog, (-effective, next(self._order), key, message))
+
+    def add_live(self, key, message: Dict) -> bool:
+        """Mensaje en vivo (webhook): pasa delante del backlog y corta las pausas en curso.
+        False si la corrida ya está terminando y nadie lo leería"""
+        with self._condition:
+            if self._draining:
+                return False
+            self._live.append((time.time(), key, message))
+            self._condition.notify_all()
+            return True
+
+    def next(self) -> Optional[Tuple[object, Dict, str]]:
+        """Siguiente trabajo (clave, mensaje, carril) o None si no queda nada"""
+        with self._condition:
+            if self._live and (self._live_streak < self.live_burst or not self._backlog):
+                arrived, key, message = self._live.popleft()
+                self._live_streak += 1
+                self.stats[LIVE_LANE] += 1
+                self.stats['espera_vivo_max_s'] = max(self.stats['espera_vivo_max_s'], round(time.time() - arrived, 2))
+                return key, message, LIVE_LANE
+            if self._backlog:
+                _, _, key, message = heapq.heappop(self._backlog)
+                self._live_streak = 0
+                self.stats[BACKLOG_LANE] += 1
+                return key, message, BACKLOG_LANE
+            self._draining = True
+            return None
+
+    def drain(self) -> int:
+        """Cierra el carril en vivo (la corrida terminó antes de vaciarlo); devuelve los mensajes en vivo sin procesar"""
+        with self._condition:
+            self._draining = True
+            return len(self._live)
+
+    def wait_for_live(self, seconds: float) -> bool:
+        """Pausa de hasta `seconds`; termina antes (True) si llega un mensaje en vivo"""
+        with self._condition:
+            return self._condition.wait_for(lambda: bool(self._live), timeout=max(seconds, 0))
+
+    def live_pending(self) -> int:
+        with self._condition:
+            return len(self._live)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._live) + len(self._backlog)
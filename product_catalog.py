@@ -0,0 +1,187 @@
+import re
+import csv
+import os
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+# Palabras que no distinguen un producto de otro
+STOPWORDS = {'de', 'del', 'la', 'el', 'los', 'las', 'con', 'para', 'y', 'x', 'un', 'una', 'mini', 'und', 'unds', 'unidad', 'unidades'}
+
+NUMBER_WORDS = {'un': 1, 'una': 1, 'uno': 1, 'dos': 2, 'tres': 3, 'cuatro': 4, 'cinco': 5, 'seis': 6,
+                'siete': 7, 'ocho': 8, 'nueve': 9, 'diez': 10, 'doce': 12}
+
+# Notas entre paréntesis que no son cantidades: (*20% dcto*), (regalo), (*cambio*)
+NOTE_RE = re.compile(r'\((?!\s*x?\s*\d+\s*\))[^)]*\)')
+LEADING_QTY_RE = re.compile(r'^\s*(?:x\s*)?(\d{1,3})\s*(?:x\s+|und?s?\.?\s+|unidades\s+)?(?=\D)', re.IGNORECASE)
+TRAILING_QTY_RE = re.compile(r'(?:\(\s*x?\s*(\d{1,3})\s*\)|\bx\s*(\d{1,3}))\s*$', re.IGNORECASE)
+SPLIT_RE = re.compile(r'\s*(?:\+|,|;|\n)\s*')
+
+
+def fold(text: str) -> str:
+    """Minúsculas, sin tildes ni puntuación"""
+    text = unicodedata.normalize('NFD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'[^a-z0-9]+', ' ', text).strip()
+
+
+def singular(token: str) -> str:
+    """Singular aproximado en español (shampoos → shampoo, capilares → capilar)"""
+    if len(token) > 4 and token.endswith('es') and token[-3] in 'lrndz':
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokens(text: str) -> List[str]:
+    """Tokens normalizados sin palabras vacías"""
+    return [singular(t) for t in fold(text).split() if t not in STOPWORDS and not t.isdigit()]
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigramas de los tokens normalizados (con bordes) para la búsqueda difusa"""
+    grams = set()
+    for token in tokens(text):
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def load_catalog_csv(path: str = 'productos.csv') -> List[Dict]:
+    """Carga la exportación CSV de la hoja de productos (Código, Artículo, Impuesto, Precio)"""
+    products = []
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = list(csv.reader(f))
+    # Mismo formato que getProductsFromSheet del bot: columnas A:D con encabezado
+    for row in rows[1:]:
+        if len(row) < 2 or not row[0].strip() or not row[1].strip():
+            continue
+        price = re.sub(r'[$,\s]', '', row[3]) if len(row) > 3 else '0'
+        tax = row[2].replace('%', '').strip() if len(row) > 2 else '19'
+        # Precios en pesos con punto de miles ("$52.800")
+        if re.search(r'\.\d{3}$', price):
+            price = price.replace('.', '')
+        try:
+            price_value = float(price or 0)
+        except ValueError:
+            price_value = 0.0
+        try:
+            tax_value = float(tax or 19)
+        except ValueError:
+            tax_value = 19.0
+        products.append({'codigo': row[0].strip(), 'articulo': row[1].strip(), 'impuesto': tax_value, 'precio': price_value})
+    return products
+
+
+class ProductCatalog:
+    """Índice difuso en memoria (tokens + trigramas, sin tildes) sobre el catálogo de productos"""
+
+    def __init__(self, products: List[Dict], min_score: float = 0.45):
+        self.products = products
+        self.min_score = min_score
+        self._tokens = [set(tokens(p['articulo'])) for p in products]
+        self._trigrams = [trigrams(p['articulo']) for p in products]
+        self._index: Dict[str, Set[int]] = {}
+        for i, grams in enumerate(self._trigrams):
+            for gram in grams:
+                self._index.setdefault(gram, set()).add(i)
+        # Los textos de producto se repiten muchísimo entre pedidos
+        self.match = lru_cache(maxsize=8192)(self._match)
+        self.parse_line = lru_cache(maxsize=8192)(self._parse_line)
+
+    @classmethod
+    def from_csv(cls, path: str = 'productos.csv', **kwargs) -> 'ProductCatalog':
+        return cls(load_catalog_csv(path), **kwargs)
+
+    def _match(self, text: str) -> Tuple[Optional[Dict], float]:
+        """Producto del catálogo más parecido al texto y su puntaje (0-1)"""
+        query_grams = trigrams(text)
+        query_tokens = set(tokens(text))
+        if not query_grams:
+            return None, 0.0
+
+        # Candidatos: productos que comparten al menos un trigrama
+        shared: Dict[int, int] = {}
+        for gram in query_grams:
+            for i in self._index.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+
+        best, best_score = None, 0.0
+        for i, common in shared.items():
+            gram_score = common / len(query_grams | self._trigrams[i])
+            token_score = len(query_tokens & self._tokens[i]) / len(self._tokens[i]) if self._tokens[i] else 0.0
+            score = 0.6 * gram_score + 0.4 * token_score
+            if score > best_score:
+                best, best_score = i, score
+
+        if best is None or best_score < self.min_score:
+            return None, round(best_score, 3)
+        return self.products[best], round(best_score, 3)
+
+    def _parse_line(self, line: str) -> Tuple[Dict, ...]:
+        """Productos de una línea del pedido con cantidad y código"""
+        items = []
+        for part in SPLIT_RE.split(line):
+            text, quantity = parse_quantity(part)
+            if not text:
+                continue
+            item = self._item(text, quantity)
+            if ' y ' in text.lower():
+                # "Shampoo y Tratamiento" se separa; "Sérum de cejas y pestañas" no (ambas mitades dan el mismo producto)
+                sub_items = [self._item(*parse_quantity(sub)) for sub in re.split(r'\s+y\s+', text, flags=re.IGNORECASE)]
+                codes = {sub_item['codigo'] for sub_item in sub_items}
+                if all(sub_item['codigo'] for sub_item in sub_items) and len(codes) == len(sub_items):
+                    items.extend(sub_items)
+                    continue
+            items.append(item)
+        return tuple(items)
+
+    def _item(self, text: str, quantity: int) -> Dict:
+        product, score = self.match(text)
+        return {
+            'texto': text,
+            'cantidad': quantity,
+            'codigo': product['codigo'] if product else '',
+            'articulo': product['articulo'] if product else '',
+            'precio': product['precio'] if product else 0.0,
+            'impuesto': product['impuesto'] if product else 0.0,
+            'confianza': score
+        }
+
+    def match_products(self, product_lines: List[str]) -> List[Dict]:
+        """Normaliza todas las líneas de producto de un pedido"""
+        items = []
+        for line in product_lines:
+            items.extend(dict(item) for item in self.parse_line(line))
+        return items
+
+
+def parse_quantity(text: str) -> Tuple[str, int]:
+    """Separa la cantidad del texto del producto: "2 Sérums" → ("Sérums", 2), "Suero (3)" → ("Suero", 3)"""
+    quantity = 1
+    text = NOTE_RE.sub('', text).replace('*', '').strip()
+    trailing = TRAILING_QTY_RE.search(text)
+    if trailing:
+        quantity = int(trailing.group(1) or trailing.group(2))
+        text = text[:trailing.start()]
+    leading = LEADING_QTY_RE.match(text)
+    if leading:
+        quantity = int(leading.group(1))
+        text = text[leading.end():]
+    else:
+        first, _, rest = text.partition(' ')
+        if fold(first) in NUMBER_WORDS and rest:
+            quantity = NUMBER_WORDS[fold(first)]
+            text = rest
+    return text.strip(' .-'), max(quantity, 1)
+
+
+def load_catalog(path: str) -> Optional[ProductCatalog]:
+    """Catálogo si el archivo existe (la normalización de productos es opcional)"""
+    if not path or not os.path.exists(path):
+        print(f"⚠️ Catálogo de productos no encontrado ({path}): productos sin normalizar")
+        return None
+    catalog = ProductCatalog.from_csv(path)
+    print(f"📋 Catálogo cargado: {len(catalog.products)} productos desde {path}")
+    return catalog
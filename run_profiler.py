@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import signal
+import linecache
+import logging
+import argparse
+import functools
+import threading
+import traceback
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from structured_log import log_event
+
+DEFAULT_PROFILE_DIR = 'perfiles'
+# Hilos sin etapa marcada: solo se muestrea el principal (el escritor del log y similares solo esperan)
+NO_STAGE = 'otros'
+MAX_STACK_DEPTH = 64
+
+
+def profiled_stage(name: str):
+    """Decorador de métodos del scraper: marca la etapa si hay perfilador (self.profiler), si no no cuesta nada"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            with profiler.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Marco del decorador: no aporta nada en las pilas muestreadas
+_STAGE_WRAPPER_CODE = profiled_stage('')(lambda self: None).__code__
+
+
+class StageSampler:
+    """Perfilador por muestreo: cada `interval` segundos toma las pilas de todos los hilos (sys._current_frames)
+    y las suma a la etapa que cada hilo tiene marcada; tiempo de reloj, así que las esperas de red también cuentan"""
+
+    def __init__(self, stages: Dict[int, List[str]], interval: float = 0.01):
+        self.stages = stages
+        self.interval = interval
+        # {(etapa, pila plegada "f1;f2;f3"): segundos}
+        self.stacks: Counter = Counter()
+        self.samples: Counter = Counter()
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='perfil_cpu', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        main = threading.main_thread().ident
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            # Peso = tiempo real desde la muestra anterior (el GIL puede retrasar al muestreador)
+            weight, last = now - last, now
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                try:
+                    stage = self.stages[ident][-1]
+                except (KeyError, IndexError):
+                    if ident != main:
+                        continue
+                    stage = NO_STAGE
+                names = []
+                while frame is not None and len(names) < MAX_STACK_DEPTH:
+                    if frame.f_code is not _STAGE_WRAPPER_CODE:
+                        names.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[(stage, ';'.join(reversed(names)))] += weight
+                self.samples[stage] += 1
+
+    def summary(self, top: int = 10) -> Dict[str, Dict]:
+        """Por etapa: segundos, muestras, funciones con más tiempo propio (hoja) y acumulado (en la pila)"""
+        stages: Dict[str, Dict] = {}
+        own_time: Dict[str, Counter] = {}
+        cumulative: Dict[str, Counter] = {}
+        for (stage, stack), seconds in list(self.stacks.items()):
+            names = stack.split(';')
+            entry = stages.setdefault(stage, {'segundos': 0.0, 'muestras': self.samples[stage]})
+            entry['segundos'] += seconds
+            own_time.setdefault(stage, Counter())[names[-1]] += seconds
+            for name in set(names):
+                cumulative.setdefault(stage, Counter())[name] += seconds
+        for stage, entry in stages.items():
+            entry['segundos'] = round(entry['segundos'], 3)
+            entry['propio'] = [(name, round(s, 3)) for name, s in own_time[stage].most_common(top)]
+            entry['acumulado'] = [(name, round(s, 3)) for name, s in cumulative[stage].most_common(top)]
+        return dict(sorted(stages.items(), key=lambda item: -item[1]['segundos']))
+
+    def save_folded(self, path: str):
+        """Pilas plegadas (formato de flamegraph.pl / speedscope) con la etapa como raíz, en milisegundos"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for (stage, stack), seconds in sorted(list(self.stacks.items())):
+                f.write(f"{stage};{stack} {max(1, round(seconds * 1000))}\n")
+
+
+class MemoryTracker:
+    """Snapshots de tracemalloc en cada checkpoint: qué líneas cambiaron más desde el checkpoint anterior"""
+
+    def __init__(self, top: int = 10, frames: int = 1):
+        self.top = top
+        self.frames = frames
+        self.history: List[Dict] = []
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        # Solo se detiene el rastreo que inició este tracker (no el de PYTHONTRACEMALLOC u otro perfilador)
+        self._started_tracing = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        self.baseline = self.previous = self.snapshot()
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        # Sin las asignaciones del propio tracemalloc, del import, de este módulo ni de las pilas de los volcados
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, traceback.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            tracemalloc.Filter(False, __file__),
+        ])
+
+    @staticmethod
+    def diff_rows(current: tracemalloc.Snapshot, previous: tracemalloc.Snapshot, top: int) -> List[Dict]:
+        rows = []
+        for stat in current.compare_to(previous, 'lineno')[:top]:
+            frame = stat.traceback[0]
+            rows.append({
+                'lugar': f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                'delta_kb': round(stat.size_diff / 1024, 1),
+                'total_kb': round(stat.size / 1024, 1),
+                'delta_bloques': stat.count_diff,
+            })
+        return rows
+
+    def checkpoint(self, label: str) -> Dict:
+        """Snapshot y diff contra el anterior; queda en el historial y como evento estructurado"""
+        current = self.snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        entry = {
+            'etiqueta': label,
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'actual_mb': round(traced / 1024 / 1024, 2),
+            'pico_mb': round(peak / 1024 / 1024, 2),
+            'top': self.diff_rows(current, self.previous, self.top),
+        }
+        self.previous = current
+        self.history.append(entry)
+        biggest = entry['top'][0] if entry['top'] else {'lugar': '-', 'delta_kb': 0}
+        log_event('memoria', "🧠 Memoria ({etiqueta}): {actual_mb} MB, pico {pico_mb} MB - mayor cambio "
+                  "{lugar} {delta_kb:+} KB", logging.INFO, etiqueta=label, actual_mb=entry['actual_mb'],
+                  pico_mb=entry['pico_mb'], lugar=biggest['lugar'], delta_kb=biggest['delta_kb'], top=entry['top'])
+        return entry
+
+    def growth_since_start(self) -> List[Dict]:
+        return self.diff_rows(self.snapshot(), self.baseline, self.top)
+
+
+class RunProfiler:
+    """Perfilado opcional de una corrida: CPU por etapa, memoria por checkpoint y volcado por señal sin detenerla"""
+
+    def __init__(self, output_dir: str = DEFAULT_PROFILE_DIR, cpu: bool = False, memory: bool = False,
+                 interval: float = 0.01, memory_top: int = 10):
+        self.output_dir = output_dir
+        # Pila de etapas por hilo; la modifica solo su hilo, el muestreador solo la lee
+        self.stages: Dict[int, List[str]] = {}
+        self.sampler = StageSampler(self.stages, interval) if cpu else None
+        self.memory = MemoryTracker(memory_top) if memory else None
+        self.state_fn: Optional[Callable[[], Dict]] = None
+        self.started = time.time()
+        self._dump_lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self.stages.setdefault(threading.get_ident(), [])
+        stack.append(name)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.memory:
+            self.memory.start()
+        if self.sampler:
+            self.sampler.start()
+
+    def checkpoint(self, label: str):
+        if self.memory:
+            # El snapshot cuesta: que no se confunda con la etapa en curso
+            with self.stage('perfil_memoria'):
+                self.memory.checkpoint(label)
+
+    def install_signal(self, state_fn: Optional[Callable[[], Dict]] = None, signum: Optional[int] = None) -> bool:
+        """Volcado a disco al recibir la señal (SIGUSR1 por defecto); la corrida sigue. False si el sistema no la tiene"""
+        self.state_fn = state_fn
+        signum = signum or getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            return False
+        signal.signal(signum, self._on_signal)
+        return True
+
+    def _on_signal(self, signum, frame):
+        # El manejador corre en el hilo principal a mitad del bucle: el volcado va en otro hilo
+        threading.Thread(target=self.dump, args=(f"señal {signum}",), name='perfil_volcado', daemon=True).start()
+
+    def current_stages(self) -> Dict[str, str]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        return {names.get(ident, str(ident)): stack[-1] for ident, stack in list(self.stages.items()) if stack}
+
+    def thread_stacks(self) -> Dict[str, List[str]]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own = threading.get_ident()
+        return {names.get(ident, str(ident)): [line.rstrip() for line in traceback.format_stack(frame)]
+                for ident, frame in sys._current_frames().items() if ident != own}
+
+    def report(self, reason: str) -> Dict:
+        report = {
+            'motivo': reason,
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'pid': os.getpid(),
+            'duracion_s': round(time.time() - self.started, 1),
+            'etapas_actuales': self.current_stages(),
+        }
+        if self.state_fn:
+            try:
+                report['estado'] = self.state_fn()
+            except Exception as e:
+                report['estado'] = {'error': str(e)}
+        if self.sampler:
+            report['cpu'] = self.sampler.summary()
+        if self.memory:
+            traced, peak = tracemalloc.get_traced_memory()
+            report['memoria'] = {
+                'actual_mb': round(traced / 1024 / 1024, 2),
+                'pico_mb': round(peak / 1024 / 1024, 2),
+                'crecimiento_desde_inicio': self.memory.growth_since_start(),
+                'checkpoints': self.memory.history,
+            }
+        report['pilas'] = self.thread_stacks()
+        return report
+
+    def dump(self, reason: str = 'manual', final: bool = False) -> str:
+        """Escribe perfil_<pid>_<hora>.json (y .folded con las pilas de CPU); devuelve la ruta del JSON"""
+        with self._dump_lock:
+            report = self.report(reason)
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            base = os.path.join(self.output_dir, f"perfil_{'final' if final else os.getpid()}_{stamp}")
+            with open(base + '.json', 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+            if self.sampler:
+                self.sampler.save_folded(base + '.folded')
+            log_event('perfil_volcado', "📸 Perfil volcado ({motivo}): {archivo}", motivo=reason, archivo=base + '.json')
+            return base + '.json'
+
+    def close(self) -> Optional[str]:
+        """Detiene el muestreo, último checkpoint de memoria e informe final"""
+        if self._closed:
+            return None
+        self._closed = True
+        if self.sampler:
+            self.sampler.stop()
+        self.checkpoint('final')
+        path = self.dump('fin de la corrida', final=True)
+        if self.memory:
+            self.memory.stop()
+        return path
+
+
+def print_report(report: Dict, top: int = 5):
+    print(f"📸 Perfil ({report['motivo']}, {report['ts']}, pid {report['pid']}, {report['duracion_s']}s)")
+    for name, value in report.get('estado', {}).items():
+        print(f"   • {name}: {value}")
+    for stage, entry in report.get('cpu', {}).items():
+        print(f"⏱️  {stage}: {entry['segundos']}s ({entry['muestras']} muestras)")
+        for name, seconds in entry['propio'][:top]:
+            print(f"      {seconds:>8.3f}s  {name}")
+    memory = report.get('memoria')
+    if memory:
+        print(f"🧠 Memoria: {memory['actual_mb']} MB (pico {memory['pico_mb']} MB)")
+        for row in memory['crecimiento_desde_inicio'][:top]:
+            print(f"      {row['delta_kb']:>+10.1f} KB  {row['lugar']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resume un volcado de perfil (scraper.py --profile-cpu/--profile-memory)")
+    parser.add_argument('file', help="JSON escrito por el perfilador (perfiles/perfil_*.json)")
+    parser.add_argument('--top', type=int, default=5, help="Funciones/líneas a mostrar por etapa")
+    args = parser.parse_args()
+
+    with open(args.file, encoding='utf-8') as f:
+        print_report(json.load(f), args.top)
@@ -0,0 +1,247 @@
+import os
+import re
+import glob
+import json
+import argparse
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from order_records import order_fingerprint, order_fingerprints
+
+try:
+    import numpy as np
+    import pandas as pd
+except ImportError:  # la analítica es opcional: el scraper no depende de numpy/pandas
+    np = None
+    pd = None
+
+# Modos de pago en el orden en que se evalúan (el primero que coincide gana)
+PAYMENT_MODES = [
+    ('NO PAGA', r'^\s*no\s+paga'),
+    ('PAGA ENVÍO ALLÁ', r'env[ií]?o\s+all[aá]'),
+    ('PAGA ENVÍO ACÁ', r'env[ií]?o\s+ac[aá]'),
+    ('CONTADO', r'contado|transfiri'),
+    ('EFECTIVO', r'^\s*efectivo'),
+    ('PAGA VALOR', r'^\s*paga\s*\$'),
+]
+DISCOUNT_RE = r'dcto|dscto|descuento|\d+\s*%'
+DISTRIBUTOR_RE = r'distribuidor'
+FILE_DATE_RE = re.compile(r'(\d{8})_\d{6}')
+
+
+def require_pandas():
+    if pd is None:
+        raise RuntimeError("La analítica necesita numpy y pandas: pip install numpy pandas")
+
+
+class OrderStore:
+    """Columnas de pedidos y productos cargadas de los JSONL ORDENES_*, con caché incremental en disco"""
+
+    def __init__(self, cache_dir: str = 'analitica_cache'):
+        require_pandas()
+        self.cache_dir = cache_dir
+        self.manifest_file = os.path.join(cache_dir, 'manifiesto.json')
+        self.orders_file = os.path.join(cache_dir, 'pedidos.pkl')
+        self.items_file = os.path.join(cache_dir, 'productos.pkl')
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # manifiesto: archivo → bytes ya leídos y conteo de huellas base vistas (los JSONL solo crecen o son nuevos)
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.manifest = {}
+        self.orders = pd.read_pickle(self.orders_file) if os.path.exists(self.orders_file) else self._empty_orders()
+        self.items = pd.read_pickle(self.items_file) if os.path.exists(self.items_file) else self._empty_items()
+
+    @staticmethod
+    def _empty_orders():
+        return pd.DataFrame(columns=['huella', 'archivo', 'fecha', 'pedido', 'nombre', 'cedula', 'ciudad',
+                                     'municipio', 'departamento', 'pago', 'productos_texto'])
+
+    @staticmethod
+    def _empty_items():
+        return pd.DataFrame(columns=['huella', 'codigo', 'articulo', 'cantidad', 'precio'])
+
+    @staticmethod
+    def _parse_lines(data: bytes) -> List[Dict]:
+        return [json.loads(line) for line in data.decode('utf-8').splitlines() if line.strip()]
+
+    def _file_state(self, path: str) -> Tuple[int, Counter]:
+        """Bytes ya leídos del archivo y conteo de huellas base de esas líneas"""
+        entry = self.manifest.get(path)
+        if entry is None:
+            return 0, Counter()
+        if isinstance(entry, int):
+            # Manifiesto anterior (solo bytes): se reconstruye el conteo una única vez
+            with open(path, 'rb') as f:
+                previous = f.read(entry)
+            return entry, Counter(order_fingerprint(record) for record in self._parse_lines(previous))
+        return entry['bytes'], Counter(entry['huellas'])
+
+    def _read_new_records(self, path: str) -> List[Tuple[str, Dict]]:
+        """Solo las líneas agregadas desde la última carga, con su huella dentro del archivo"""
+        offset, seen = self._file_state(path)
+        size = os.path.getsize(path)
+        if size < offset:
+            offset, seen = 0, Counter()  # archivo reescrito
+        if size == offset:
+            return []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        # Una línea incompleta al final (archivo escribiéndose) se deja para la próxima carga
+        complete = data[:data.rfind(b'\n') + 1]
+        if not complete:
+            return []
+        records = self._parse_lines(complete)
+        # Las compras repetidas se numeran desde el inicio del archivo, también lo ya leído
+        fingerprints = order_fingerprints(records, seen)
+        seen.update(order_fingerprint(record) for record in records)
+        self.manifest[path] = {'bytes': offset + len(complete), 'huellas': dict(seen)}
+        return list(zip(fingerprints, records))
+
+    def load(self, paths: List[str]) -> int:
+        """Agrega los pedidos nuevos de los archivos dados; devuelve cuántos se agregaron"""
+        order_rows, item_rows = [], []
+        known = set(self.orders['huella'])
+        for path in sorted(paths):
+            date_match = FILE_DATE_RE.search(os.path.basename(path))
+            file_date = pd.to_datetime(date_match.group(1), format='%Y%m%d') if date_match else pd.NaT
+            for fingerprint, record in self._read_new_records(path):
+                # La misma venta reaparece en corridas posteriores: se identifica por su contenido y su repetición
+                if fingerprint in known:
+                    continue
+                known.add(fingerprint)
+                order_rows.append({
+                    'huella': fingerprint,
+                    'archivo': os.path.basename(path),
+                    'fecha': file_date,
+                    'pedido': record.get('pedido'),
+                    'nombre': record.get('nombre', ''),
+                    'cedula': record.get('cedula', ''),
+                    'ciudad': record.get('ciudad', ''),
+                    'municipio': record.get('municipio', ''),
+                    'departamento': record.get('departamento', ''),
+                    'pago': record.get('pago', ''),
+                    'productos_texto': ' + '.join(record.get('productos_texto', [])),
+                })
+                for item in record.get('productos', []):
+                    item_rows.append({
+                        'huella': fingerprint,
+                        'codigo': item.get('codigo') or 'SIN_CODIGO',
+                        'articulo': item.get('articulo') or item.get('texto', ''),
+                        'cantidad': item.get('cantidad', 1),
+                        'precio': item.get('precio', 0.0),
+                    })
+
+        if order_rows:
+            self.orders = pd.concat([self.orders, pd.DataFrame(order_rows)], ignore_index=True)
+            self.items = pd.concat([self.items, pd.DataFrame(item_rows, columns=self.items.columns)], ignore_index=True)
+        self._save()
+        return len(order_rows)
+
+    def _save(self):
+        self.orders.to_pickle(self.orders_file)
+        self.items.to_pickle(self.items_file)
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.manifest_file)
+
+
+class SalesAnalytics:
+    """Agregados vectorizados sobre las columnas de pedidos"""
+
+    def __init__(self, orders, items):
+        require_pandas()
+        self.orders = orders.copy()
+        self.items = items.copy()
+        self._derive_columns()
+
+    def _derive_columns(self):
+        orders = self.orders
+        city = orders['ciudad'].fillna('').astype(str)
+        # "Medellín, ANT" / "Itagui ANT" / "Bogotá D.C" → ciudad y departamento
+        parts = city.str.rsplit(',', n=1, expand=True).reindex(columns=[0, 1])
+        no_comma = parts[1].isna()
+        suffix = city.str.extract(r'^(.*?)\s+(ANT|ANTIOQUIA|D\.?\s?C\.?)$', flags=re.IGNORECASE)
+        orders['ciudad_nombre'] = np.where(no_comma & suffix[0].notna(), suffix[0], parts[0]).astype(str)
+        orders['departamento_nombre'] = np.where(no_comma, suffix[1].fillna(''), parts[1].fillna('')).astype(str)
+        # Los registros con municipio del gazetteer (address_normalizer) no necesitan heurística
+        for column, resolved in (('ciudad_nombre', 'municipio'), ('departamento_nombre', 'departamento')):
+            known = orders.get(resolved, pd.Series('', index=orders.index)).fillna('').astype(str)
+            orders[column] = np.where(known != '', known, orders[column])
+        for column in ('ciudad_nombre', 'departamento_nombre'):
+            orders[column] = (orders[column].str.replace(r'^\d{5,6}\s+', '', regex=True).str.strip()
+                              .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.upper())
+        orders['departamento_nombre'] = orders['departamento_nombre'].replace({'ANT': 'ANTIOQUIA', 'D.C': 'BOGOTA D.C.', 'D.C.': 'BOGOTA D.C.', 'DC': 'BOGOTA D.C.'})
+        orders.loc[orders['ciudad_nombre'].str.startswith('BOGOTA'), 'departamento_nombre'] = 'BOGOTA D.C.'
+
+        payment = orders['pago'].fillna('').astype(str)
+        conditions = [payment.str.contains(pattern, case=False, regex=True) for _, pattern in PAYMENT_MODES]
+        orders['modo_pago'] = np.select(conditions, [mode for mode, _ in PAYMENT_MODES], default='OTRO')
+
+        # Los descuentos se anotan en el nombre, los productos o el pago: "(*20% dscto*)"
+        full_text = orders['nombre'].fillna('') + ' ' + orders['productos_texto'].fillna('') + ' ' + payment
+        orders['descuento'] = full_text.str.contains(DISCOUNT_RE, case=False, regex=True)
+        orders['distribuidor'] = orders['nombre'].fillna('').str.contains(DISTRIBUTOR_RE, case=False, regex=True)
+
+        if len(self.items):
+            self.items['cantidad'] = pd.to_numeric(self.items['cantidad'], errors='coerce').fillna(1).astype(int)
+            self.items['precio'] = pd.to_numeric(self.items['precio'], errors='coerce').fillna(0.0)
+            self.items['valor'] = self.items['cantidad'] * self.items['precio']
+
+    def orders_by_city(self, top: int = 15):
+        return self.orders.groupby('ciudad_nombre').size().sort_values(ascending=False).head(top)
+
+    def orders_by_department(self):
+        return self.orders.groupby('departamento_nombre').size().sort_values(ascending=False)
+
+    def units_by_product(self):
+        if not len(self.items):
+            return pd.DataFrame(columns=['pedidos', 'unidades', 'valor'])
+        return (self.items.groupby(['codigo', 'articulo'])
+                .agg(pedidos=('huella', 'nunique'), unidades=('cantidad', 'sum'), valor=('valor', 'sum'))
+                .sort_values('unidades', ascending=False))
+
+    def payment_modes(self):
+        counts = self.orders['modo_pago'].value_counts()
+        return pd.DataFrame({'pedidos': counts, 'porcentaje': (counts / max(len(self.orders), 1) * 100).round(1)})
+
+    def discount_usage(self) -> float:
+        return float(self.orders['descuento'].mean()) if len(self.orders) else 0.0
+
+    def distributor_share(self) -> float:
+        return float(self.orders['distribuidor'].mean()) if len(self.orders) else 0.0
+
+    def orders_by_month(self):
+        dated = self.orders.dropna(subset=['fecha'])
+        return dated.groupby(pd.to_datetime(dated['fecha']).dt.to_period('M')).size()
+
+    def print_report(self):
+        """Reporte en consola de todos los agregados"""
+        print("\n" + "📊" * 30)
+        print(f"📦 Pedidos únicos: {len(self.orders)} | líneas de producto: {len(self.items)}")
+        print(f"\n🏙️  PEDIDOS POR CIUDAD:\n{self.orders_by_city().to_string()}")
+        print(f"\n🗺️  PEDIDOS POR DEPARTAMENTO:\n{self.orders_by_department().to_string()}")
+        print(f"\n🏷️  PRODUCTOS (SKU):\n{self.units_by_product().head(20).to_string()}")
+        print(f"\n💳 MODO DE PAGO:\n{self.payment_modes().to_string()}")
+        print(f"\n🎟️  Pedidos con descuento: {self.discount_usage():.1%}")
+        print(f"🤝 Pedidos de distribuidores: {self.distributor_share():.1%}")
+        by_month = self.orders_by_month()
+        if len(by_month):
+            print(f"\n📅 PEDIDOS POR MES:\n{by_month.to_string()}")
+        print("📊" * 30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analítica de ventas sobre los pedidos estructurados (ORDENES_*.jsonl)")
+    parser.add_argument('files', nargs='*', help="Archivos JSONL (por defecto ORDENES_WALAKY_*.jsonl)")
+    parser.add_argument('--cache', default='analitica_cache', help="Directorio de la caché incremental")
+    args = parser.parse_args()
+
+    store = OrderStore(args.cache)
+    added = store.load(args.files or glob.glob('ORDENES_WALAKY_*.jsonl'))
+    print(f"📥 {added} pedidos nuevos cargados ({len(store.orders)} en total)")
+    SalesAnalytics(store.orders, store.items).print_report()
@@ -1,12 +1,40 @@
+import os
 import http.client
 import ssl
 import json
 import anthropic
 import time
 import random
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from contextlib import nullcontext
 import re
+import argparse
+import atexit
+import logging
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import prefilter
+from message_normalizer import normalize_message, smart_truncate, estimate_tokens
+from message_archive import save_messages_archive, load_messages_archive
+from cost_estimator import DryRunPlanner
+from budget_controller import BudgetController
+from usage_ledger import UsageLedger
+from whatsapp_pacer import WhatsAppPacer
+from multi_chat import MultiChatScheduler
+from work_queue import WorkQueue
+from webhook_receiver import WebhookReceiver
+from local_formatter import format_locally, extract_crm_locally
+from product_catalog import load_catalog
+from order_records import build_order_records, save_order_records
+from birthday_index import parse_birthday
+from address_normalizer import load_localities, DEFAULT_GAZETTEER
+from local_pipeline import LocalStagePool
+from priority_scheduler import PriorityScheduler, BACKLOG_LANE, LIVE_LANE
+from run_profiler import RunProfiler, profiled_stage, DEFAULT_PROFILE_DIR
+from structured_log import configure_logging, flush_logs, log_event, VERBOSITY
+from engine_config import load_config, load_credentials, resolve_pacing_profile
 
 class WhatsAppScraperClaudeProduction:
     def __init__(self, instance_id: str, token: str, claude_api_key: str):
@@ -17,11 +45,7 @@ class WhatsAppScraperClaudeProduction:
         # Configurar Claude
         self.claude_client = anthropic.Anthropic(api_key=claude_api_key)
         
-        # Configuración de seguridad MÁXIMA para producción
-        self.whatsapp_delay_min = 15
-        self.whatsapp_delay_max = 25
-        self.claude_delay = 2
-        self.checkpoint_delay = 45
+        self.whatsapp_pacer = WhatsAppPacer.for_instance(instance_id)
         
         # CONTADOR DE COSTOS CLAUDE
         self.cost_tracking = {
@@ -30,7 +54,11 @@ class WhatsAppScraperClaudeProduction:
             'total_requests': 0,
             'verification_requests': 0,
             'format_requests': 0,
-            'crm_extraction_requests': 0
+            'crm_extraction_requests': 0,
+            'single_call_requests': 0,
+            'input_tokens_saved': 0,
+            'input_cost': 0.0,
+            'output_cost': 0.0
         }
         
         # Precios Claude 3.5 Haiku (por 1M tokens)
@@ -38,61 +66,295 @@ class WhatsAppScraperClaudeProduction:
             'input_price_per_1m': 0.80,   # $0.25 por 1M input tokens
             'output_price_per_1m': 4.00  # $1.25 por 1M output tokens
         }
+        
+        # Modelos: principal (según el perfil) y económico (degradación por presupuesto)
+        self.claude_model = "claude-3-5-sonnet-20240620"
+        self.claude_cheap_model = "claude-3-5-haiku-20241022"
+        self.model_prices = {
+            "claude-3-5-sonnet-20240620": {'input_price_per_1m': 3.00, 'output_price_per_1m': 15.00},
+            "claude-3-5-haiku-20241022": self.claude_prices
+        }
+        
+        # Control de presupuesto (opcional, ver configure_budget)
+        self.budget: Optional[BudgetController] = None
+        self.budget_follows_run = False
+        
+        # Ledger persistente de uso: una fila por llamada, sobrevive a reinicios
+        self.ledger = UsageLedger()
+        self.run_id = f"sesion_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.progress_file = 'progreso_produccion_final.txt'
+        
+        # Delays, modelo y reintentos: perfil de producción salvo que se configure otro (ver engine_config)
+        self.configure_pacing(resolve_pacing_profile('production'))
+        self._context = threading.local()
+        self._tracking_lock = threading.Lock()
+        
+        # Extracción CRM por lotes: K pedidos por request, K se ajusta solo según los límites de tokens
+        self.crm_batch_size = 20
+        self.crm_batch_max_size = 40
+        self.crm_batch_max_input_tokens = 12000
+        self.crm_batch_output_tokens_per_item = 70
+        self.crm_batch_max_output_tokens = 4096
+        
+        # Catálogo de productos para normalizar las líneas de producto (opcional, ver configure_catalog)
+        self.catalog = None
+        self.catalog_path: Optional[str] = None
+        # Gazetteer de municipios para normalizar ciudad/departamento de envío
+        self.localities = load_localities()
+        
+        # Formateo local por plantilla: se usa sin Claude si la confianza es alta, y como degradado si Claude cae
+        self.local_format_confidence: Optional[float] = 0.9
+        self.degraded_format_confidence = 0.5
+        self.claude_outage_cooldown = 300
+        self.claude_outage_until = 0.0
+        self.local_format_stats = {'local': 0, 'degraded': 0, 'lost': 0}
+        # Etapas de Claude resueltas sin Claude (caída o presupuesto); la evaluación de modos las reporta
+        self.claude_fallbacks = {'outages': 0, 'verification': 0, 'format': 0, 'crm_extraction': 0}
+        # Solo local: ninguna etapa llama a Claude (evaluación de la línea base sin costo)
+        self.local_only = False
+        
+        # Llamada única: verificación + formateo + CRM en un solo request por candidato
+        self.single_call = False
+        self._single_call_crm: Dict[str, Dict[str, str]] = {}
+        
+        # Etapas locales en procesos para backfills grandes (1 = en el mismo proceso, 0 = todos los núcleos)
+        self.local_workers = 1
+        self.local_chunk_size = 256
+        self._local_results: Dict[str, Tuple] = {}
+        
+        # Orden por prioridad durante la corrida (ver work_items); None = orden original de los mensajes
+        self.scheduler: Optional[PriorityScheduler] = None
+        self._live_indices = itertools.count()
+        
+        # Perfilado opcional (--profile-cpu/--profile-memory); run_state es lo que muestra un volcado a mitad de corrida
+        self.profiler: Optional[RunProfiler] = None
+        self.run_state: Dict = {}
+        
+        # Formateo especulativo: con pre-filtro >= umbral, verificar y formatear en paralelo
+        self.speculative_score_threshold: Optional[int] = None
+        self._speculation_pool: Optional[ThreadPoolExecutor] = None
+        self.speculation_stats = {
+            'attempts': 0,
+            'hits': 0,
+            'misses': 0,
+            'format_failed': 0,
+            'wasted_input_tokens': 0,
+            'wasted_output_tokens': 0,
+            'wasted_cost': 0.0
+        }
+    
+    def speculation_pool(self) -> ThreadPoolExecutor:
+        """Pool del formateo especulativo, creado una sola vez aunque varios hilos de chat especulen a la vez"""
+        with self._tracking_lock:
+            if self._speculation_pool is None:
+                self._speculation_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='especulativo')
+            return self._speculation_pool
+    
+    def close_speculation_pool(self):
+        """Cierra el pool especulativo al final de la corrida (se vuelve a crear si hace falta)"""
+        with self._tracking_lock:
+            pool, self._speculation_pool = self._speculation_pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+    
+    def profile_stage(self, name: str):
+        """Marca una etapa del perfil de CPU (sin perfilador no hace nada)"""
+        return self.profiler.stage(name) if self.profiler is not None else nullcontext()
+    
+    def pipeline_state(self) -> Dict:
+        """Estado de la corrida para los volcados del perfilador"""
+        state = dict(self.run_state)
+        state.update(
+            run_id=self.run_id,
+            perfil=self.pacing_profile,
+            progreso=self.progress_file,
+            costo=round(self.calculate_total_cost()['total_cost'], 4),
+            requests=self.cost_tracking['total_requests'],
+            formateo_local=dict(self.local_format_stats),
+            cache_etapas_locales=len(self._local_results),
+        )
+        if self.scheduler is not None:
+            state.update(cola_prioridad=len(self.scheduler), en_vivo_pendientes=self.scheduler.live_pending())
+        return state
+    
+    def set_message_context(self, message_id: Optional[str] = None, chat_id: Optional[str] = None,
+                            run_id: Optional[str] = None):
+        """Asocia las llamadas siguientes (de este hilo) a un mensaje/chat/corrida en el ledger"""
+        self._context.message_id = message_id
+        self._context.chat_id = chat_id
+        self._context.run_id = run_id
     
-    def track_claude_usage(self, response, request_type: str):
+    def log(self, event: str, template: Optional[str] = None, level: int = logging.INFO, **fields):
+        """Evento estructurado asociado al mensaje en curso de este hilo (ver structured_log)"""
+        log_event(event, template, level, message_id=getattr(self._context, 'message_id', None), **fields)
+    
+    def configure_pacing(self, profile: Dict, auto_tune: bool = False):
+        """Aplica un perfil de ritmo (delays, checkpoints, modelo, reintentos, archivo de progreso)"""
+        self.pacing_profile = profile.get('name', 'production')
+        self.whatsapp_delay_min = profile['whatsapp_delay_min']
+        self.whatsapp_delay_max = profile['whatsapp_delay_max']
+        self.whatsapp_cooldown_min = profile['whatsapp_cooldown_min']
+        self.whatsapp_cooldown_max = profile['whatsapp_cooldown_max']
+        self.whatsapp_error_wait = profile['whatsapp_error_wait']
+        self.claude_delay = profile['claude_delay']
+        self.claude_pause = profile.get('claude_pause', 1)
+        self.checkpoint_every = max(1, profile['checkpoint_every'])
+        self.checkpoint_delay = profile['checkpoint_delay']
+        self.checkpoint_jitter = profile['checkpoint_jitter']
+        self.message_delay_min = profile['message_delay_min']
+        self.message_delay_max = profile['message_delay_max']
+        self.prefilter_delay = profile['prefilter_delay']
+        self.claude_model = profile['claude_model']
+        self.claude_retries = max(1, profile['claude_retries'])
+        self.progress_file = profile['progress_file']
+        self.local_workers = profile.get('local_workers', 1)
+        self.priority_scheduling = profile.get('priority_scheduling', False)
+        if auto_tune:
+            # Los delays del perfil pasan a ser el punto de partida; UltraMsg sano los reduce, errores los suben
+            self.whatsapp_pacer.enable_auto_tune()
+    
+    def configure_catalog(self, path: str = 'productos.csv'):
+        """Carga el catálogo (CSV exportado de la hoja de productos) para mapear productos a códigos"""
+        self.catalog = load_catalog(path)
+        self.catalog_path = path if self.catalog else None
+    
+    def configure_budget(self, run_id: Optional[str] = None, **limits):
+        """Activa límites de costo/tokens por corrida y por día. Sin run_id, la corrida del presupuesto es la del
+        ledger (la misma al reanudar el mismo archivo de progreso, una nueva en cada corrida nueva)"""
+        self.budget_follows_run = run_id is None
+        self.budget = BudgetController(run_id or self.run_id, **limits)
+        self.budget.print_status()
+    
+    def budget_level(self) -> str:
+        """Nivel de degradación actual (normal si no hay presupuesto configurado)"""
+        return self.budget.level() if self.budget else BudgetController.NORMAL
+    
+    def claude_unavailable(self) -> bool:
+        """True si no se debe llamar a Claude: modo solo local, presupuesto en modo local o caída reciente de la API"""
+        if self.local_only:
+            return True
+        if self.budget_level() in (BudgetController.LOCAL, BudgetController.PAUSA):
+            return True
+        return time.time() < self.claude_outage_until
+    
+    def mark_claude_outage(self, stage: str):
+        """Tras agotar los reintentos, las etapas pasan a modo local durante el enfriamiento"""
+        self.claude_outage_until = time.time() + self.claude_outage_cooldown
+        self.count_fallback('outages')
+        self.log('claude_caido', "🔌 Claude no responde ({stage}): modo local por {segundos}s", logging.WARNING,
+                 stage=stage, segundos=self.claude_outage_cooldown)
+    
+    def count_fallback(self, stage: str, count: int = 1):
+        with self._tracking_lock:
+            self.claude_fallbacks[stage] += count
+    
+    def current_model(self) -> str:
+        """Modelo a usar según el presupuesto consumido"""
+        if self.budget_level() == BudgetController.NORMAL:
+            return self.claude_model
+        return self.claude_cheap_model
+    
+    def request_cost(self, input_tokens: int, output_tokens: int, model: Optional[str] = None) -> Dict[str, float]:
+        """Costo de un request según los precios del modelo usado"""
+        prices = self.model_prices.get(model, self.claude_prices)
+        return {
+            'input_cost': (input_tokens / 1_000_000) * prices['input_price_per_1m'],
+            'output_cost': (output_tokens / 1_000_000) * prices['output_price_per_1m']
+        }
+    
+    def track_claude_usage(self, response, request_type: str, saved_tokens: int = 0, latency: Optional[float] = None):
         """Rastrea el uso de tokens y costos de Claude"""
         try:
             usage = response.usage
             input_tokens = usage.input_tokens
             output_tokens = usage.output_tokens
+            model = getattr(response, 'model', None)
+            
+            cost = self.request_cost(input_tokens, output_tokens, model)
             
-            self.cost_tracking['input_tokens'] += input_tokens
-            self.cost_tracking['output_tokens'] += output_tokens
-            self.cost_tracking['total_requests'] += 1
-            self.cost_tracking[f'{request_type}_requests'] += 1
+            with self._tracking_lock:
+                self.cost_tracking['input_tokens'] += input_tokens
+                self.cost_tracking['output_tokens'] += output_tokens
+                self.cost_tracking['total_requests'] += 1
+                self.cost_tracking[f'{request_type}_requests'] += 1
+                self.cost_tracking['input_tokens_saved'] += max(saved_tokens, 0)
+                self.cost_tracking['input_cost'] += cost['input_cost']
+                self.cost_tracking['output_cost'] += cost['output_cost']
+            
+            self.ledger.record(
+                getattr(self._context, 'run_id', None) or self.run_id, request_type, model, input_tokens, output_tokens,
+                cost['input_cost'], cost['output_cost'],
+                cache_creation_tokens=getattr(usage, 'cache_creation_input_tokens', 0) or 0,
+                cache_read_tokens=getattr(usage, 'cache_read_input_tokens', 0) or 0,
+                saved_tokens=max(saved_tokens, 0),
+                latency=latency,
+                chat_id=getattr(self._context, 'chat_id', None),
+                message_id=getattr(self._context, 'message_id', None)
+            )
             
-            print(f"💰 {request_type}: {input_tokens} in + {output_tokens} out tokens")
+            if self.budget:
+                self.budget.record(input_tokens, output_tokens, cost['input_cost'] + cost['output_cost'])
+            
+            usage_sink = getattr(self._context, 'usage_sink', None)
+            if usage_sink is not None:
+                usage_sink['input_tokens'] += input_tokens
+                usage_sink['output_tokens'] += output_tokens
+                usage_sink['cost'] += cost['input_cost'] + cost['output_cost']
+            
+            self.log('claude_uso', "💰 {stage}: {input_tokens} in + {output_tokens} out tokens ({latency_ms} ms)",
+                     logging.DEBUG, stage=request_type, model=model, input_tokens=input_tokens,
+                     output_tokens=output_tokens, saved_tokens=max(saved_tokens, 0),
+                     latency_ms=round(latency * 1000) if latency is not None else None)
             
         except Exception as e:
-            print(f"⚠️ Error tracking usage: {e}")
+            self.log('error_tracking', "⚠️ Error tracking usage: {error}", logging.WARNING, error=str(e))
     
-    def calculate_total_cost(self) -> Dict[str, float]:
-        """Calcula el costo total de la sesión"""
-        input_cost = (self.cost_tracking['input_tokens'] / 1_000_000) * self.claude_prices['input_price_per_1m']
-        output_cost = (self.cost_tracking['output_tokens'] / 1_000_000) * self.claude_prices['output_price_per_1m']
-        total_cost = input_cost + output_cost
+    def calculate_total_cost(self, run_ids: Optional[List[str]] = None) -> Dict[str, float]:
+        """Calcula el costo total de la corrida (o de las corridas dadas) desde el ledger (incluye lo gastado antes de reanudar)"""
+        totals = self.ledger.totals(run_ids=run_ids) if run_ids is not None else self.ledger.totals(run_id=self.run_id)
         
         return {
-            'input_cost': input_cost,
-            'output_cost': output_cost,
-            'total_cost': total_cost,
-            'input_tokens': self.cost_tracking['input_tokens'],
-            'output_tokens': self.cost_tracking['output_tokens'],
-            'total_requests': self.cost_tracking['total_requests']
+            'input_cost': totals['input_cost'],
+            'output_cost': totals['output_cost'],
+            'total_cost': totals['total_cost'],
+            'input_tokens': totals['input_tokens'],
+            'output_tokens': totals['output_tokens'],
+            'total_requests': totals['total_requests'],
+            'input_tokens_saved': totals['input_tokens_saved'],
+            'saved_cost': (totals['input_tokens_saved'] / 1_000_000) * self.claude_prices['input_price_per_1m']
         }
     
-    def print_cost_summary(self):
-        """Imprime resumen detallado de costos"""
-        costs = self.calculate_total_cost()
+    def print_cost_summary(self, run_ids: Optional[List[str]] = None):
+        """Imprime resumen detallado de costos (de la corrida actual o de todas las corridas dadas)"""
+        flush_logs()
+        costs = self.calculate_total_cost(run_ids)
+        stages = self.ledger.cost_by_stage(run_ids=run_ids) if run_ids is not None else self.ledger.cost_by_stage(self.run_id)
+        by_stage = {row['grupo']: row['requests'] for row in stages}
         
         print("\n" + "💰" * 60)
         print("                      RESUMEN DE COSTOS CLAUDE API - PRODUCCIÓN")
         print("💰" * 60)
+        if run_ids is not None:
+            print(f"🗂️  Corridas incluidas: {len(run_ids)}")
         print(f"📊 ESTADÍSTICAS DE USO:")
         print(f"   🔢 Total requests: {costs['total_requests']}")
-        print(f"   🔍 Verificaciones: {self.cost_tracking['verification_requests']}")
-        print(f"   📝 Formateos: {self.cost_tracking['format_requests']}")
-        print(f"   🏷️  Extracciones CRM: {self.cost_tracking['crm_extraction_requests']}")
+        print(f"   🔍 Verificaciones: {by_stage.get('verification', 0)}")
+        print(f"   📝 Formateos: {by_stage.get('format', 0)}")
+        print(f"   🏷️  Extracciones CRM: {by_stage.get('crm_extraction', 0)}")
+        if by_stage.get('single_call'):
+            print(f"   🎯 Llamada única: {by_stage['single_call']}")
         print()
         print(f"📈 TOKENS UTILIZADOS:")
         print(f"   📥 Input tokens: {costs['input_tokens']:,}")
         print(f"   📤 Output tokens: {costs['output_tokens']:,}")
         print(f"   📊 Total tokens: {costs['input_tokens'] + costs['output_tokens']:,}")
+        print(f"   ✂️  Input ahorrados (normalización): ~{costs['input_tokens_saved']:,}")
         print()
         print(f"💵 COSTOS DETALLADOS:")
         print(f"   📥 Input cost: ${costs['input_cost']:.4f}")
         print(f"   📤 Output cost: ${costs['output_cost']:.4f}")
         print(f"   💰 COSTO TOTAL SESIÓN: ${costs['total_cost']:.4f}")
+        print(f"   ✂️  Ahorro estimado normalización: ${costs['saved_cost']:.4f}")
         print()
         if costs['total_requests'] > 0:
             cost_per_message = costs['total_cost'] / costs['total_requests']
@@ -100,89 +362,160 @@ class WhatsAppScraperClaudeProduction:
             print(f"   💡 Costo por mensaje procesado: ${cost_per_message:.4f}")
             print(f"   📈 Costo estimado 100 mensajes: ${cost_per_message * 100:.2f}")
             print(f"   📈 Costo estimado 1000 mensajes: ${cost_per_message * 1000:.2f}")
+        self.print_speculation_summary()
+        self.print_local_format_summary()
         print("💰" * 60)
         
-    def safe_delay(self, min_seconds: int, max_seconds: int, message: str = ""):
-        """Implementa un delay aleatorio para parecer más humano"""
+    def print_speculation_summary(self):
+        """Tasa de acierto del formateo especulativo y tokens desperdiciados"""
+        stats = self.speculation_stats
+        if not stats['attempts']:
+            return
+        print(f"🚀 ESPECULACIÓN (pre-filtro >= {self.speculative_score_threshold}):")
+        print(f"   🎯 Aciertos: {stats['hits']}/{stats['attempts']} ({stats['hits'] / stats['attempts']:.1%})")
+        if stats['format_failed']:
+            print(f"   ❌ Pedidos sin formateo: {stats['format_failed']}")
+        print(f"   🗑️  Desperdiciado: {stats['wasted_input_tokens']:,} in + {stats['wasted_output_tokens']:,} out (${stats['wasted_cost']:.4f})")
+        
+    def print_local_format_summary(self):
+        """Pedidos resueltos por el parser local en vez de Claude"""
+        stats = self.local_format_stats
+        if not any(stats.values()):
+            return
+        print(f"📐 FORMATEO LOCAL:")
+        print(f"   ✅ Por plantilla (sin Claude): {stats['local']}")
+        print(f"   🛟 Degradado (Claude caído / presupuesto): {stats['degraded']}")
+        print(f"   ❌ No recuperables sin Claude: {stats['lost']}")
+        
+    @profiled_stage('pausa')
+    def safe_delay(self, min_seconds: int, max_seconds: int, message: str = "", interruptible: bool = False):
+        """Implementa un delay aleatorio para parecer más humano (interruptible: lo corta un mensaje en vivo)"""
         delay = random.uniform(min_seconds, max_seconds)
         if message:
-            print(f"🛡️  {message} - Esperando {delay:.1f}s...")
+            self.log('espera', "🛡️  {motivo} - Esperando {segundos}s...", logging.DEBUG,
+                     motivo=message, segundos=round(delay, 1))
+        if interruptible and self.scheduler is not None:
+            if self.scheduler.wait_for_live(delay):
+                self.log('carril_rapido', "⚡ Mensaje en vivo: se corta la pausa", logging.DEBUG)
+            return
         time.sleep(delay)
         
+    def paced_delay(self, min_seconds: float, max_seconds: float, message: str = "", interruptible: bool = False):
+        """Delay de protección escalado por el autoajuste del número (sin autoajuste = delay del perfil)"""
+        scale = self.whatsapp_pacer.delay_scale()
+        self.safe_delay(min_seconds * scale, max_seconds * scale, message, interruptible)
+    
+    def check_instance_health(self) -> bool:
+        """Consulta liviana del estado de la instancia UltraMsg para alimentar el autoajuste"""
+        with self.whatsapp_pacer.turn():
+            started = time.time()
+            try:
+                conn = http.client.HTTPSConnection(self.base_url, context=ssl._create_unverified_context(), timeout=15)
+                conn.request("GET", f"/{self.instance_id}/instance/status?token={self.token}")
+                res = conn.getresponse()
+                data = json.loads(res.read().decode("utf-8"))
+                conn.close()
+                account = data.get('status', {}).get('accountStatus', {}) if isinstance(data, dict) else {}
+                healthy = res.status == 200 and account.get('status') == 'authenticated'
+                self.whatsapp_pacer.observe(healthy, time.time() - started, res.status)
+            except Exception as e:
+                healthy = False
+                self.whatsapp_pacer.observe(False, time.time() - started)
+                self.log('whatsapp_estado_error', "⚠️ Estado de la instancia no disponible: {error}", logging.WARNING,
+                         error=str(e)[:60])
+            self.log('whatsapp_estado', "🩺 Instancia {estado} - escala de delays x{escala}", logging.DEBUG,
+                     estado='sana' if healthy else 'con problemas', escala=round(self.whatsapp_pacer.delay_scale(), 2),
+                     latency_ms=round((time.time() - started) * 1000))
+            return healthy
+    
+    @profiled_stage('whatsapp')
     def get_messages(self, chat_id: str, limit: int = 1000) -> List[Dict]:
         """Obtiene mensajes del grupo de WhatsApp con protección anti-bloqueo MÁXIMA"""
-        try:
-            print(f"📥 Obteniendo {limit} mensajes de WhatsApp...")
+        # Turno exclusivo sobre el número: los delays aplican al teléfono, no al chat
+        with self.whatsapp_pacer.turn():
+            started = time.time()
+            try:
+                self.log('whatsapp_solicitud', "📥 Obteniendo {limite} mensajes de WhatsApp...", chat_id=chat_id, limite=limit)
             
-            self.safe_delay(
-                self.whatsapp_delay_min, 
-                self.whatsapp_delay_max,
-                "Protección anti-bloqueo WhatsApp MÁXIMA"
-            )
+                self.paced_delay(
+                    self.whatsapp_delay_min, 
+                    self.whatsapp_delay_max,
+                    "Protección anti-bloqueo WhatsApp"
+                )
             
-            conn = http.client.HTTPSConnection(self.base_url, context=ssl._create_unverified_context())
-            headers = {'content-type': "application/x-www-form-urlencoded"}
+                started = time.time()
+                conn = http.client.HTTPSConnection(self.base_url, context=ssl._create_unverified_context())
+                headers = {'content-type': "application/x-www-form-urlencoded"}
             
-            endpoint = f"/{self.instance_id}/chats/messages?token={self.token}&chatId={chat_id}&limit={limit}"
-            conn.request("GET", endpoint, headers=headers)
+                endpoint = f"/{self.instance_id}/chats/messages?token={self.token}&chatId={chat_id}&limit={limit}"
+                conn.request("GET", endpoint, headers=headers)
             
-            res = conn.getresponse()
-            data = res.read()
-            messages_data = json.loads(data.decode("utf-8"))
-            conn.close()
+                res = conn.getresponse()
+                data = res.read()
+                messages_data = json.loads(data.decode("utf-8"))
+                conn.close()
+                self.whatsapp_pacer.observe(isinstance(messages_data, list), time.time() - started, res.status)
             
-            print(f"✅ {len(messages_data) if isinstance(messages_data, list) else 0} mensajes obtenidos")
+                self.log('whatsapp_respuesta', "✅ {mensajes} mensajes obtenidos ({latency_ms} ms)", chat_id=chat_id,
+                         mensajes=len(messages_data) if isinstance(messages_data, list) else 0,
+                         latency_ms=round((time.time() - started) * 1000))
             
-            self.safe_delay(10, 15, "Cooldown post-WhatsApp EXTENDIDO")
+                self.paced_delay(self.whatsapp_cooldown_min, self.whatsapp_cooldown_max, "Cooldown post-WhatsApp")
             
-            return messages_data if isinstance(messages_data, list) else []
-        except Exception as e:
-            print(f"❌ Error WhatsApp: {e}")
-            print("🛡️  Esperando 120 segundos antes de reintentar...")
-            time.sleep(120)
-            return []
+                return messages_data if isinstance(messages_data, list) else []
+            except Exception as e:
+                self.whatsapp_pacer.observe(False, time.time() - started)
+                wait = self.whatsapp_error_wait * self.whatsapp_pacer.delay_scale()
+                self.log('whatsapp_error', "❌ Error WhatsApp: {error}\n🛡️  Esperando {segundos} segundos antes de reintentar...",
+                         logging.WARNING, chat_id=chat_id, error=str(e), segundos=round(wait))
+                time.sleep(wait)
+                return []
     
+    @profiled_stage('prefilter')
     def quick_filter_message(self, message_text: str) -> bool:
         """Pre-filtro inteligente para reducir llamadas a Claude"""
-        if not message_text or len(message_text.strip()) < 30:
-            return False
-            
-        strong_indicators = ['cc ', 'fc ', 'cédula', 'cedula', 'paga', 'envío', 'entrega']
-        product_indicators = ['shampoo', 'kit', 'tratamiento', 'sérum', 'serum', 'styling', 'tónico']
-        location_indicators = ['barrio', 'calle', 'carrera', 'medellín', 'bogotá', 'cali', 'ant']
-        contact_indicators = ['@', 'gmail', 'hotmail', 'llamar', 'escribir']
-        
-        negative_indicators = [
-            'este pedido es diferente', 'no, es el mismo', 'hola', 'gracias',
-            'envíos nacionales', 'guía', '¿podrías ayudarme?', 'esperando',
-            'hola ana', 'espero estés bien', 'ayudarme con esta guía'
-        ]
-        
-        text_lower = message_text.lower()
-        
-        if any(neg in text_lower for neg in negative_indicators):
-            return False
-            
-        strong_count = sum(1 for indicator in strong_indicators if indicator in text_lower)
-        product_count = sum(1 for indicator in product_indicators if indicator in text_lower)
-        location_count = sum(1 for indicator in location_indicators if indicator in text_lower)
-        contact_count = sum(1 for indicator in contact_indicators if indicator in text_lower)
-        
-        indicator_types = sum([
-            strong_count > 0,
-            product_count > 0, 
-            location_count > 0,
-            contact_count > 0
-        ])
-        
-        return indicator_types >= 2 and strong_count >= 1
+        cached = self._local_results.get(message_text)
+        if cached is not None:
+            return cached[0] > 0
+        return prefilter.quick_filter_message(message_text)
     
-    def is_order_message(self, message_text: str) -> bool:
-        """Determina si un mensaje es un pedido con máxima robustez"""
-        if not self.quick_filter_message(message_text):
-            return False
-            
-        prompt = f"""Analiza si este mensaje de WhatsApp es un PEDIDO DE PRODUCTOS válido.
+    def prefilter_score(self, message_text: str) -> int:
+        cached = self._local_results.get(message_text)
+        return cached[0] if cached is not None else prefilter.prefilter_score(message_text)
+    
+    def local_format(self, message_text: str) -> Tuple[Optional[str], float, List[str]]:
+        """Formateo por plantilla, ya calculado en el pool si el mensaje pasó por precompute_local_stages"""
+        cached = self._local_results.get(message_text)
+        if cached is not None and cached[0] > 0:
+            return cached[1], cached[2], list(cached[3])
+        return format_locally(message_text)
+    
+    def use_local_pool(self, items: int) -> bool:
+        """El pool de procesos solo compensa con varios workers y más de un lote"""
+        return self.local_workers != 1 and items > self.local_chunk_size
+    
+    def reset_local_results(self):
+        """Descarta las etapas locales precalculadas (al terminar una corrida o entre evaluaciones)"""
+        self._local_results.clear()
+    
+    def local_pool(self) -> LocalStagePool:
+        return LocalStagePool(self.local_workers or None, self.local_chunk_size)
+    
+    @profiled_stage('local')
+    def precompute_local_stages(self, message_texts: List[str]):
+        """Pre-filtro y parseo de plantilla de todo el lote en el pool; el bucle luego solo consulta"""
+        if not self.use_local_pool(len(message_texts)):
+            return
+        started = time.time()
+        pool = self.local_pool()
+        self._local_results.update(pool.analyze(message_texts))
+        self.log('etapas_locales', "⚙️  Etapas locales de {mensajes} mensajes en {workers} procesos: {segundos}s",
+                 stage='local', mensajes=len(message_texts), workers=pool.workers,
+                 segundos=round(time.time() - started, 1))
+    
+    def build_verification_prompt(self, snippet: str) -> str:
+        """Prompt de verificación (pedido SI/NO)"""
+        return f"""Analiza si este mensaje de WhatsApp es un PEDIDO DE PRODUCTOS válido.
 
 PEDIDO VÁLIDO debe tener:
 - Nombre de persona
@@ -197,30 +530,199 @@ NO SON PEDIDOS:
 - Mensajes sobre envíos nacionales
 - Respuestas cortas
 
-Mensaje: "{message_text[:600]}"
+Mensaje: "{snippet}"
 
 Responde SOLO: "SI" o "NO" """
+    
+    def build_format_prompt(self, compact_text: str) -> str:
+        """Prompt de formateo del pedido en 10 líneas"""
+        return f"""Extrae información de este pedido de WhatsApp en formato exacto:
+
+[Nombre completo de la persona]
+CC [número completo de cédula]
+FC [fecha completa]
+[dirección completa con número y apartamento]
+Barrio [nombre del barrio]
+[ciudad completa con departamento]
+[teléfono completo con notas]
+[email completo]
+[productos completos con cantidades]
+[estado de pago completo con detalles]
+
+REGLAS:
+- Mantén TODOS los detalles originales
+- Copia direcciones exactas
+- Incluye notas de teléfono
+- Conserva información de pago completa
+
+Mensaje original:
+{compact_text}
+
+Formatea manteniendo TODOS los detalles:"""
+    
+    def build_crm_prompt(self, formatted_message: str) -> str:
+        """Prompt de extracción de los 4 datos CRM"""
+        return f"""Del siguiente pedido formateado, extrae ÚNICAMENTE estos 4 datos específicos:
+
+Pedido:
+{formatted_message}
+
+Extrae y responde SOLO en este formato JSON:
+{{
+    "nombre": "nombre completo de la persona (solo el nombre, sin títulos ni anotaciones)",
+    "cedula": "número de cédula sin CC (solo números)",
+    "email": "dirección de email completa",
+    "fecha_cumpleanos": "fecha de cumpleaños (FC) tal como aparece"
+}}
+
+REGLAS:
+- Si no encuentras algún dato, pon ""
+- Para nombre: solo el nombre de la persona, sin (*Inter*), (*Distribuidora*), etc.
+- Para cédula: solo los números, sin "CC"
+- Para fecha: tal como aparece después de FC
+- Responde SOLO el JSON, nada más"""
+    
+    def build_crm_batch_prompt(self, formatted_messages: List[str]) -> str:
+        """Prompt de extracción CRM para varios pedidos en un solo request"""
+        pedidos = "\n\n".join(
+            f"### PEDIDO {i}\n{message}" for i, message in enumerate(formatted_messages, 1)
+        )
+        return f"""De cada uno de los siguientes {len(formatted_messages)} pedidos formateados, extrae ÚNICAMENTE estos 4 datos específicos:
+
+{pedidos}
+
+Responde SOLO con un arreglo JSON, un objeto por pedido, en este formato:
+[
+    {{"indice": 1, "nombre": "...", "cedula": "...", "email": "...", "fecha_cumpleanos": "..."}}
+]
+
+REGLAS:
+- "indice" es el número del PEDIDO
+- Si no encuentras algún dato, pon ""
+- Para nombre: solo el nombre de la persona, sin (*Inter*), (*Distribuidora*), etc.
+- Para cédula: solo los números, sin "CC"
+- Para fecha: tal como aparece después de FC
+- Responde SOLO el JSON, nada más"""
+    
+    def build_single_call_prompt(self, compact_text: str) -> str:
+        """Prompt único: decide si es pedido y, si lo es, devuelve el pedido formateado y los 4 datos CRM"""
+        return f"""Analiza este mensaje de WhatsApp. Si NO es un PEDIDO DE PRODUCTOS válido (conversaciones, preguntas,
+confirmaciones administrativas, mensajes sobre envíos nacionales, respuestas cortas), responde SOLO:
+{{"es_pedido": false}}
+
+Si ES un pedido (nombre, CC, dirección, productos, pago), responde SOLO este JSON:
+{{
+    "es_pedido": true,
+    "pedido": "las 10 líneas del pedido separadas por \\n: [Nombre completo], CC [cédula], FC [fecha], [dirección completa], Barrio [barrio], [ciudad con departamento], [teléfono con notas], [email], [productos con cantidades], [estado de pago con detalles]",
+    "nombre": "solo el nombre de la persona, sin (*Inter*), (*Distribuidora*), etc.",
+    "cedula": "solo números, sin CC",
+    "email": "email completo",
+    "fecha_cumpleanos": "tal como aparece después de FC"
+}}
+
+REGLAS:
+- Mantén TODOS los detalles originales en "pedido" (direcciones exactas, notas de teléfono, pago completo)
+- Si no encuentras algún dato, pon ""
+
+Mensaje original:
+{compact_text}"""
+    
+    @profiled_stage('single_call')
+    def process_candidate_single_call(self, message_text: str) -> Tuple[bool, Optional[str]]:
+        """Verificación, formateo y CRM en un request; el registro CRM queda guardado para extract_crm_records"""
+        if self.claude_unavailable():
+            if not self.is_order_message_locally(message_text):
+                return False, None
+            return True, self.format_with_claude(message_text)
+        
+        compact_text = normalize_message(message_text)
+        saved_tokens = estimate_tokens(message_text) - estimate_tokens(compact_text)
+        prompt = self.build_single_call_prompt(compact_text)
+        expected_keys = ['nombre', 'cedula', 'email', 'fecha_cumpleanos']
+        
+        retries = self.claude_retries
+        for attempt in range(retries):
+            try:
+                started = time.time()
+                response = self.claude_client.messages.create(
+                    model=self.current_model(),
+                    max_tokens=1200,
+                    messages=[{"role": "user", "content": prompt}],
+                    timeout=30.0
+                )
+                
+                self.track_claude_usage(response, 'single_call', saved_tokens, latency=time.time() - started)
+                
+                result = response.content[0].text.strip()
+                if "```json" in result:
+                    result = result.split("```json")[1].split("```")[0]
+                elif "```" in result:
+                    result = result.split("```")[1].split("```")[0]
+                data = json.loads(result)
+                
+                if not data.get('es_pedido'):
+                    time.sleep(self.claude_delay)
+                    return False, None
+                formatted_message = str(data.get('pedido') or '').strip()
+                if formatted_message:
+                    self._single_call_crm[formatted_message] = {key: str(data.get(key) or '') for key in expected_keys}
+                    time.sleep(self.claude_delay)
+                    return True, formatted_message
+                self.log('reintento', "⚠️ Llamada única sin pedido formateado (intento {intento})", logging.WARNING,
+                         stage='single_call', intento=attempt + 1)
+                
+            except json.JSONDecodeError:
+                self.log('reintento', "⚠️ Error JSON en llamada única (intento {intento})", logging.WARNING,
+                         stage='single_call', intento=attempt + 1)
+            except Exception as e:
+                self.log('reintento', "⚠️ Llamada única intento {intento}/{reintentos}: {error}...", logging.WARNING,
+                         stage='single_call', intento=attempt + 1, reintentos=retries, error=str(e)[:40])
+                if attempt < retries - 1:
+                    time.sleep(5 + attempt * 4)
+        
+        # Sin respuesta usable: el camino de tres etapas decide (y cae a local si Claude sigue caído)
+        if not self.is_order_message(message_text):
+            return False, None
+        return True, self.format_with_claude(message_text)
+    
+    @profiled_stage('verification')
+    def is_order_message(self, message_text: str) -> bool:
+        """Determina si un mensaje es un pedido con máxima robustez"""
+        if not self.quick_filter_message(message_text):
+            return False
+        
+        # Compactar y recortar conservando las líneas con CC/dirección/productos
+        snippet = smart_truncate(normalize_message(message_text), 600)
+        saved_tokens = estimate_tokens(message_text[:600]) - estimate_tokens(snippet)
+            
+        prompt = self.build_verification_prompt(snippet)
+        
+        if self.claude_unavailable():
+            return self.is_order_message_locally(message_text)
 
-        for attempt in range(4):
+        retries = self.claude_retries
+        for attempt in range(retries):
             try:
+                started = time.time()
                 response = self.claude_client.messages.create(
-                    model="claude-3-5-sonnet-20240620",
+                    model=self.current_model(),
                     max_tokens=5,
                     messages=[{"role": "user", "content": prompt}],
                     timeout=20.0
                 )
                 
-                self.track_claude_usage(response, 'verification')
+                self.track_claude_usage(response, 'verification', saved_tokens, latency=time.time() - started)
                 
                 result = response.content[0].text.strip().upper()
-                time.sleep(1)
+                time.sleep(self.claude_pause)
                 return result == "SI"
                 
             except Exception as e:
                 error_msg = str(e).lower()
-                print(f"⚠️ Verificación intento {attempt+1}/4: {str(e)[:50]}...")
+                self.log('reintento', "⚠️ Verificación intento {intento}/{reintentos}: {error}...", logging.WARNING,
+                         stage='verification', intento=attempt + 1, reintentos=retries, error=str(e)[:50])
                 
-                if attempt < 3:
+                if attempt < retries - 1:
                     if "timeout" in error_msg:
                         wait_time = 8 + (attempt * 4)
                     elif "rate" in error_msg:
@@ -231,56 +733,63 @@ Responde SOLO: "SI" o "NO" """
                     time.sleep(wait_time)
                     continue
                 else:
-                    print(f"🔄 Usando pre-filtro como fallback final")
-                    return (self.quick_filter_message(message_text) and 
-                            len(message_text.split('\n')) >= 5 and
-                            'cc ' in message_text.lower())
+                    self.log('fallback', "🔄 Usando pre-filtro como fallback final", logging.WARNING, stage='verification')
+                    self.mark_claude_outage('verificación')
+                    return self.is_order_message_locally(message_text)
+    
+    def is_order_message_locally(self, message_text: str) -> bool:
+        """Verificación heurística sin Claude (fallback y modo local)"""
+        self.count_fallback('verification')
+        if not self.quick_filter_message(message_text):
+            return False
+        if len(message_text.split('\n')) >= 5 and 'cc ' in message_text.lower():
+            return True
+        # Pedidos en plantilla reconocibles aunque la cédula venga como "Cédula:" o "C.C."
+        return self.local_format(message_text)[1] >= self.degraded_format_confidence
     
+    @profiled_stage('format')
     def format_with_claude(self, message_text: str) -> str:
         """Formatear pedido con máxima robustez"""
-        prompt = f"""Extrae información de este pedido de WhatsApp en formato exacto:
-
-[Nombre completo de la persona]
-CC [número completo de cédula]
-FC [fecha completa]
-[dirección completa con número y apartamento]
-Barrio [nombre del barrio]
-[ciudad completa con departamento]
-[teléfono completo con notas]
-[email completo]
-[productos completos con cantidades]
-[estado de pago completo con detalles]
-
-REGLAS:
-- Mantén TODOS los detalles originales
-- Copia direcciones exactas
-- Incluye notas de teléfono
-- Conserva información de pago completa
-
-Mensaje original:
-{message_text}
-
-Formatea manteniendo TODOS los detalles:"""
+        compact_text = normalize_message(message_text)
+        saved_tokens = estimate_tokens(message_text) - estimate_tokens(compact_text)
+        
+        prompt = self.build_format_prompt(compact_text)
+        
+        local_text, confidence, issues = self.local_format(message_text)
+        if self.local_format_confidence is not None and local_text and confidence >= self.local_format_confidence:
+            with self._tracking_lock:
+                self.local_format_stats['local'] += 1
+            self.log('formato_local', "📐 Formateado localmente por plantilla (confianza {confianza})", logging.DEBUG,
+                     stage='format', confianza=round(confidence, 2))
+            return local_text
+        
+        # Presupuesto en modo local o API caída: el parser local o el pedido se cuenta como perdido,
+        # nunca el mensaje crudo como si estuviera formateado
+        if self.claude_unavailable():
+            return self.format_degraded(local_text, confidence, issues)
         
-        for attempt in range(4):
+        retries = self.claude_retries
+        for attempt in range(retries):
             try:
+                started = time.time()
                 response = self.claude_client.messages.create(
-                    model="claude-3-5-sonnet-20240620",
+                    model=self.current_model(),
                     max_tokens=1000,
                     messages=[{"role": "user", "content": prompt}],
                     timeout=25.0
                 )
                 
-                self.track_claude_usage(response, 'format')
+                self.track_claude_usage(response, 'format', saved_tokens, latency=time.time() - started)
                 
                 time.sleep(self.claude_delay)
                 return response.content[0].text.strip()
                 
             except Exception as e:
                 error_msg = str(e).lower()
-                print(f"⚠️ Formateo intento {attempt+1}/4: {str(e)[:40]}...")
+                self.log('reintento', "⚠️ Formateo intento {intento}/{reintentos}: {error}...", logging.WARNING,
+                         stage='format', intento=attempt + 1, reintentos=retries, error=str(e)[:40])
                 
-                if attempt < 3:
+                if attempt < retries - 1:
                     if "timeout" in error_msg:
                         wait_time = 10 + (attempt * 5)
                     elif "rate" in error_msg:
@@ -288,46 +797,52 @@ Formatea manteniendo TODOS los detalles:"""
                     else:
                         wait_time = 7 + (attempt * 4)
                     
-                    print(f"⏳ Esperando {wait_time}s antes del siguiente intento...")
+                    self.log('espera', "⏳ Esperando {segundos}s antes del siguiente intento...", logging.DEBUG,
+                             stage='format', segundos=wait_time)
                     time.sleep(wait_time)
                     continue
                 else:
-                    print(f"❌ Formateo falló después de 4 intentos")
-                    return None
+                    self.log('fallo', "❌ Formateo falló después de {reintentos} intentos", logging.WARNING,
+                             stage='format', reintentos=retries)
+                    self.mark_claude_outage('formateo')
+                    return self.format_degraded(local_text, confidence, issues)
+        return None
+    
+    def format_degraded(self, local_text: Optional[str], confidence: float, issues: List[str]) -> Optional[str]:
+        """Formateo de respaldo sin Claude: el parser local si alcanza la confianza mínima"""
+        self.count_fallback('format')
+        if local_text and confidence >= self.degraded_format_confidence:
+            with self._tracking_lock:
+                self.local_format_stats['degraded'] += 1
+            self.log('formato_degradado', "🛟 Formateo degradado local (confianza {confianza}): {problemas}",
+                     logging.WARNING, stage='format', confianza=round(confidence, 2),
+                     problemas=', '.join(issues[:3]) or 'sin problemas')
+            return local_text
+        with self._tracking_lock:
+            self.local_format_stats['lost'] += 1
+        self.log('formato_perdido', "❌ Sin Claude y el parser local no reconoce el pedido (confianza {confianza})",
+                 logging.WARNING, stage='format', confianza=round(confidence, 2))
         return None
     
     def extract_crm_data_with_ai(self, formatted_message: str) -> Dict[str, str]:
         """Extrae datos CRM usando Claude AI con máxima robustez"""
-        prompt = f"""Del siguiente pedido formateado, extrae ÚNICAMENTE estos 4 datos específicos:
-
-Pedido:
-{formatted_message}
-
-Extrae y responde SOLO en este formato JSON:
-{{
-    "nombre": "nombre completo de la persona (solo el nombre, sin títulos ni anotaciones)",
-    "cedula": "número de cédula sin CC (solo números)",
-    "email": "dirección de email completa",
-    "fecha_cumpleanos": "fecha de cumpleaños (FC) tal como aparece"
-}}
-
-REGLAS:
-- Si no encuentras algún dato, pon ""
-- Para nombre: solo el nombre de la persona, sin (*Inter*), (*Distribuidora*), etc.
-- Para cédula: solo los números, sin "CC"
-- Para fecha: tal como aparece después de FC
-- Responde SOLO el JSON, nada más"""
+        prompt = self.build_crm_prompt(formatted_message)
+        
+        if self.claude_unavailable():
+            return self.extract_crm_data_locally(formatted_message)
 
-        for attempt in range(4):
+        retries = self.claude_retries
+        for attempt in range(retries):
             try:
+                started = time.time()
                 response = self.claude_client.messages.create(
-                    model="claude-3-5-sonnet-20240620",
+                    model=self.current_model(),
                     max_tokens=200,
                     messages=[{"role": "user", "content": prompt}],
                     timeout=20.0
                 )
                 
-                self.track_claude_usage(response, 'crm_extraction')
+                self.track_claude_usage(response, 'crm_extraction', latency=time.time() - started)
                 
                 result = response.content[0].text.strip()
                 
@@ -341,184 +856,561 @@ REGLAS:
                     
                     expected_keys = ['nombre', 'cedula', 'email', 'fecha_cumpleanos']
                     if all(key in crm_data for key in expected_keys):
-                        time.sleep(0.5)
+                        time.sleep(self.claude_pause / 2)
                         return crm_data
                     else:
-                        print(f"⚠️ JSON incompleto en intento {attempt+1}")
+                        self.log('reintento', "⚠️ JSON incompleto en intento {intento}", logging.WARNING,
+                                 stage='crm_extraction', intento=attempt + 1)
                         
                 except json.JSONDecodeError:
-                    print(f"⚠️ Error JSON en intento {attempt+1}: {result[:50]}...")
+                    self.log('reintento', "⚠️ Error JSON en intento {intento}: {respuesta}...", logging.WARNING,
+                             stage='crm_extraction', intento=attempt + 1, respuesta=result[:50])
                 
-                if attempt < 3:
+                if attempt < retries - 1:
                     time.sleep(2 + attempt)
                     continue
                     
             except Exception as e:
-                print(f"⚠️ Error extracción CRM intento {attempt+1}/4: {str(e)[:30]}...")
-                if attempt < 3:
+                self.log('reintento', "⚠️ Error extracción CRM intento {intento}/{reintentos}: {error}...", logging.WARNING,
+                         stage='crm_extraction', intento=attempt + 1, reintentos=retries, error=str(e)[:30])
+                if attempt < retries - 1:
                     time.sleep(3 + attempt)
                     continue
         
-        print(f"❌ Extracción CRM falló - usando datos vacíos")
-        return {
-            'nombre': '',
-            'cedula': '',
-            'email': '',
-            'fecha_cumpleanos': ''
-        }
+        self.log('fallback', "❌ Extracción CRM falló - usando extracción local", logging.WARNING, stage='crm_extraction')
+        self.mark_claude_outage('CRM')
+        return self.extract_crm_data_locally(formatted_message)
+    
+    def extract_crm_batch_with_ai(self, formatted_messages: List[str]) -> Tuple[Optional[List[Optional[Dict[str, str]]]], bool]:
+        """Extrae K registros CRM en un request: (registros por posición o None, respuesta_truncada)"""
+        prompt = self.build_crm_batch_prompt(formatted_messages)
+        max_tokens = min(
+            self.crm_batch_max_output_tokens,
+            self.crm_batch_output_tokens_per_item * len(formatted_messages) + 100
+        )
+        expected_keys = ['nombre', 'cedula', 'email', 'fecha_cumpleanos']
+        
+        for attempt in range(3):
+            try:
+                started = time.time()
+                response = self.claude_client.messages.create(
+                    model=self.current_model(),
+                    max_tokens=max_tokens,
+                    messages=[{"role": "user", "content": prompt}],
+                    timeout=60.0
+                )
+                
+                self.track_claude_usage(response, 'crm_extraction', latency=time.time() - started)
+                
+                if getattr(response, 'stop_reason', None) == 'max_tokens':
+                    self.log('lote_truncado', "⚠️ Lote CRM de {k} truncado por max_tokens", logging.WARNING,
+                             stage='crm_extraction', k=len(formatted_messages))
+                    return None, True
+                
+                result = response.content[0].text.strip()
+                if "```json" in result:
+                    result = result.split("```json")[1].split("```")[0]
+                elif "```" in result:
+                    result = result.split("```")[1].split("```")[0]
+                
+                items = json.loads(result)
+                if not isinstance(items, list):
+                    raise json.JSONDecodeError("no es un arreglo", result, 0)
+                
+                records: List[Optional[Dict[str, str]]] = [None] * len(formatted_messages)
+                for item in items:
+                    if not isinstance(item, dict):
+                        continue
+                    try:
+                        index = int(item.get('indice', 0)) - 1
+                    except (TypeError, ValueError):
+                        continue
+                    if 0 <= index < len(records) and all(key in item for key in expected_keys):
+                        records[index] = {key: str(item[key] or '') for key in expected_keys}
+                return records, False
+                
+            except json.JSONDecodeError:
+                self.log('lote_json_invalido', "⚠️ Error JSON en lote CRM ({k} pedidos)", logging.WARNING,
+                         stage='crm_extraction', k=len(formatted_messages))
+                return None, False
+            except Exception as e:
+                self.log('reintento', "⚠️ Error lote CRM intento {intento}/3: {error}...", logging.WARNING,
+                         stage='crm_extraction', intento=attempt + 1, error=str(e)[:30])
+                if attempt < 2:
+                    time.sleep(5 + attempt * 5)
+        
+        self.mark_claude_outage('CRM por lotes')
+        return None, False
     
-    def scrape_and_format_messages_production(self, chat_id: str, limit: int = 1000, start_from: int = 0) -> List[str]:
+    @profiled_stage('crm_extraction')
+    def extract_crm_records_batched(self, formatted_messages: List[str]) -> List[Dict[str, str]]:
+        """Extracción CRM por lotes con K autoajustable; los pedidos fallidos se reintentan uno a uno"""
+        if self.claude_unavailable():
+            if self.use_local_pool(len(formatted_messages)):
+                self.count_fallback('crm_extraction', len(formatted_messages))
+                return self.local_pool().extract_crm(formatted_messages)
+            return [self.extract_crm_data_locally(m) for m in formatted_messages]
+        
+        total = len(formatted_messages)
+        results: List[Optional[Dict[str, str]]] = [None] * total
+        failed: List[int] = []
+        header_tokens = estimate_tokens(self.build_crm_batch_prompt([]))
+        batch_limit = min(self.crm_batch_max_size,
+                          (self.crm_batch_max_output_tokens - 100) // self.crm_batch_output_tokens_per_item)
+        position = 0
+        batches = 0
+        # K ajustado solo para esta extracción: crm_batch_size sigue siendo el configurado (--crm-batch-size)
+        batch_size = self.crm_batch_size
+        # Tamaño de un único reintento del mismo tramo tras un JSON inválido (no cambia K)
+        retry_size = None
+        
+        while position < total:
+            if self.claude_unavailable():
+                # Caída de la API (o presupuesto agotado) a mitad de la extracción: el resto en local, sin partir lotes
+                self.log('fallback', "🔄 Claude no disponible: {pedidos} pedidos restantes con extracción local",
+                         logging.WARNING, stage='crm_extraction', pedidos=total - position)
+                for i in range(position, total):
+                    results[i] = self.extract_crm_data_locally(formatted_messages[i])
+                break
+            k = max(1, min(retry_size or batch_size, batch_limit))
+            retry_size = None
+            batch = []
+            tokens = header_tokens
+            while position + len(batch) < total and len(batch) < k:
+                item_tokens = estimate_tokens(formatted_messages[position + len(batch)]) + 10
+                if batch and tokens + item_tokens > self.crm_batch_max_input_tokens:
+                    break
+                batch.append(position + len(batch))
+                tokens += item_tokens
+            
+            self.log('lote_crm', "🔄 Lote CRM {desde}-{hasta}/{total} (K={k})...", stage='crm_extraction',
+                     desde=position + 1, hasta=position + len(batch), total=total, k=len(batch))
+            records, truncated = self.extract_crm_batch_with_ai([formatted_messages[i] for i in batch])
+            batches += 1
+            
+            if records is None:
+                if truncated and len(batch) > 1:
+                    # La salida no alcanzó para K registros: K baja y no vuelve a crecer hasta ese tamaño
+                    batch_limit = len(batch) - 1
+                    batch_size = max(1, len(batch) // 2)
+                    self.log('lote_k', "📉 K reducido a {k} por respuesta truncada (máximo {maximo})",
+                             stage='crm_extraction', k=batch_size, maximo=batch_limit)
+                    continue
+                if len(batch) > 1 and not truncated and not self.claude_unavailable():
+                    # JSON inválido: reintentar el mismo tramo partido en dos; K sigue igual (no si la API está caída)
+                    retry_size = max(1, len(batch) // 2)
+                    continue
+                failed.extend(batch)
+            else:
+                for i, record in zip(batch, records):
+                    if record is None:
+                        failed.append(i)
+                    else:
+                        results[i] = record
+                if len(batch) == k and all(record is not None for record in records):
+                    batch_size = min(k + 5, batch_limit)
+            
+            position += len(batch)
+            self.log('costo_parcial', "💰 Costo parcial CRM: ${costo:.4f}", logging.DEBUG, stage='crm_extraction',
+                     costo=self.calculate_total_cost()['total_cost'])
+            time.sleep(self.claude_delay)
+        
+        if failed:
+            self.log('lote_reintento', "🔁 Reintentando individualmente {pedidos} pedidos del lote",
+                     stage='crm_extraction', pedidos=len(failed))
+            for i in failed:
+                results[i] = self.extract_crm_data_with_ai(formatted_messages[i])
+                time.sleep(self.claude_pause)
+        
+        self.log('crm_resumen', "📦 CRM: {total} pedidos en {lotes} lotes + {individuales} individuales",
+                 stage='crm_extraction', total=total, lotes=batches, individuales=len(failed))
+        return results
+    
+    def extract_crm_data_locally(self, formatted_message: str) -> Dict[str, str]:
+        """Extrae los 4 datos CRM con expresiones regulares (sin Claude)"""
+        self.count_fallback('crm_extraction')
+        return extract_crm_locally(formatted_message)
+    
+    @profiled_stage('candidate')
+    def process_candidate(self, message_text: str) -> Tuple[bool, Optional[str]]:
+        """Etapas LLM de un mensaje que pasó el pre-filtro: (es_pedido, pedido_formateado)"""
+        if self.local_format_confidence is not None:
+            # Un pedido que ya viene en plantilla completa no necesita ni verificación ni formateo
+            local_text, confidence, _ = self.local_format(message_text)
+            if local_text and confidence >= self.local_format_confidence:
+                with self._tracking_lock:
+                    self.local_format_stats['local'] += 1
+                self.log('plantilla_local', "📐 Pedido en plantilla reconocido localmente (confianza {confianza})",
+                         logging.DEBUG, stage='local', confianza=round(confidence, 2))
+                return True, local_text
+        
+        if self.single_call:
+            return self.process_candidate_single_call(message_text)
+        
+        if (self.speculative_score_threshold is not None
+                and self.prefilter_score(message_text) >= self.speculative_score_threshold):
+            return self.process_candidate_speculative(message_text)
+        
+        if not self.is_order_message(message_text):
+            return False, None
+        return True, self.format_with_claude(message_text)
+    
+    def process_candidate_speculative(self, message_text: str) -> Tuple[bool, Optional[str]]:
+        """Verificación y formateo simultáneos; el formateo se descarta si Claude dice NO"""
+        context = (getattr(self._context, 'message_id', None),
+                   getattr(self._context, 'chat_id', None),
+                   getattr(self._context, 'run_id', None))
+        format_usage = {'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+        
+        def speculative_format():
+            self.set_message_context(*context)
+            self._context.usage_sink = format_usage
+            try:
+                return self.format_with_claude(message_text)
+            finally:
+                self._context.usage_sink = None
+        
+        self.log('especulacion', "🚀 Pre-filtro alto: verificación + formateo especulativo en paralelo", logging.DEBUG,
+                 stage='speculative')
+        format_future = self.speculation_pool().submit(speculative_format)
+        is_order = self.is_order_message(message_text)
+        formatted_message = format_future.result()
+        # Los tokens del formateo especulativo también cuentan para el mensaje en curso
+        usage_sink = getattr(self._context, 'usage_sink', None)
+        if usage_sink is not None:
+            for key in usage_sink:
+                usage_sink[key] += format_usage[key]
+        
+        with self._tracking_lock:
+            self.speculation_stats['attempts'] += 1
+            if is_order and formatted_message:
+                self.speculation_stats['hits'] += 1
+            elif is_order:
+                # Era pedido pero el formateo especulativo no devolvió nada: no cuenta como acierto
+                self.speculation_stats['format_failed'] += 1
+            else:
+                self.speculation_stats['misses'] += 1
+                self.speculation_stats['wasted_input_tokens'] += format_usage['input_tokens']
+                self.speculation_stats['wasted_output_tokens'] += format_usage['output_tokens']
+                self.speculation_stats['wasted_cost'] += format_usage['cost']
+        
+        if not is_order:
+            self.log('especulacion_descartada', "🗑️  Especulación descartada ({input_tokens} in + {output_tokens} out desperdiciados)",
+                     logging.DEBUG, stage='speculative', input_tokens=format_usage['input_tokens'],
+                     output_tokens=format_usage['output_tokens'])
+            return False, None
+        return True, formatted_message
+    
+    def submit_live(self, message: Dict) -> bool:
+        """Mensaje en vivo (webhook) para la corrida en curso: entra por el carril rápido del scheduler"""
+        scheduler = self.scheduler
+        if scheduler is None:
+            return False
+        # False cuando el scheduler ya se vació: el receptor lo deja en la cola durable
+        return scheduler.add_live(next(self._live_indices), message)
+    
+    def done_ids_file(self) -> str:
+        return os.path.splitext(self.progress_file)[0] + '.ids.json'
+    
+    def load_done_ids(self) -> set:
+        """Mensajes ya procesados en esta corrida (con orden por prioridad el índice no sirve para reanudar)"""
+        try:
+            with open(self.done_ids_file(), 'r', encoding='utf-8') as f:
+                return set(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return set()
+    
+    @profiled_stage('progreso')
+    def save_done_ids(self, done_ids: set):
+        try:
+            with open(self.done_ids_file(), 'w', encoding='utf-8') as f:
+                json.dump(sorted(done_ids), f)
+        except Exception as e:
+            self.log('error_progreso', "⚠️ Error guardando progreso: {error}", logging.WARNING, error=str(e))
+    
+    def work_items(self, messages: List[Dict], start_from: int, processed_count: int, done_ids: Optional[set]):
+        """Orden de proceso: (índice, mensaje, carril). Sin scheduler, el orden original; con scheduler, los
+        mensajes en vivo primero y el backlog por recencia + pre-filtro con envejecimiento"""
+        if self.scheduler is None:
+            for i, message in enumerate(messages[start_from:], start_from):
+                if i >= processed_count:
+                    yield i, message, BACKLOG_LANE
+            return
+        
+        for i, message in enumerate(messages[start_from:], start_from):
+            if str(message.get('id') or f"idx_{i}") in done_ids:
+                continue
+            self.scheduler.add_backlog(i, message, self.prefilter_score(message.get('body', '') or ''))
+        while True:
+            item = self.scheduler.next()
+            if item is None:
+                return
+            yield item
+    
+    def scrape_and_format_messages_production(self, chat_id: str, limit: int = 1000, start_from: int = 0,
+                                              messages: Optional[List[Dict]] = None,
+                                              progress_file: Optional[str] = None) -> List[str]:
         """RUTINA OFICIAL DE PRODUCCIÓN - Máxima seguridad, robustez y tracking"""
-        print("🏭" * 30)
-        print("                           RUTINA OFICIAL DE PRODUCCIÓN WALAKY")
-        print("🏭" * 30)
-        print(f"🚀 Iniciando scraping ULTRA-SEGURO del chat {chat_id}")
-        print(f"🛡️  Configuración de seguridad MÁXIMA:")
-        print(f"   - Delay WhatsApp: {self.whatsapp_delay_min}-{self.whatsapp_delay_max}s")
-        print(f"   - Delay Claude: {self.claude_delay}s")
-        print(f"   - Checkpoints: {self.checkpoint_delay}s")
-        print(f"🧠 Pre-filtro + Claude con 4 reintentos c/u + Extracción AI")
-        print(f"💰 Tracking de costos completo activado")
-        print(f"📊 Procesando hasta {limit} mensajes")
-        print()
+        self.log('inicio_corrida',
+                 "🏭 Rutina Walaky (perfil {perfil}{autoajuste}) - chat {chat_id}\n"
+                 "🛡️  Delay WhatsApp: {whatsapp_delay}s | Delay Claude: {claude_delay}s | Checkpoints: {checkpoint_delay}s\n"
+                 "📊 Procesando hasta {limite} mensajes\n",
+                 perfil=self.pacing_profile, autoajuste=', autoajuste' if self.whatsapp_pacer.tuner else '',
+                 chat_id=chat_id, whatsapp_delay=f"{self.whatsapp_delay_min}-{self.whatsapp_delay_max}",
+                 claude_delay=self.claude_delay, checkpoint_delay=self.checkpoint_delay, limite=limit)
         
-        # UNA SOLA llamada a WhatsApp
-        messages = self.get_messages(chat_id, limit)
+        # UNA SOLA llamada a WhatsApp (o mensajes ya archivados)
+        if messages is None:
+            messages = self.get_messages(chat_id, limit)
         
         if not messages:
-            print("❌ No se pudieron obtener mensajes.")
+            self.log('sin_mensajes', "❌ No se pudieron obtener mensajes.", logging.WARNING, chat_id=chat_id)
             return []
         
-        print(f"📊 {len(messages)} mensajes obtenidos de WhatsApp")
-        print(f"🔄 Comenzando análisis inteligente de producción...\n")
+        self.log('mensajes', "📊 {mensajes} mensajes obtenidos de WhatsApp\n🔄 Comenzando análisis inteligente de producción...\n",
+                 chat_id=chat_id, mensajes=len(messages))
+        
+        # Corrida en el ledger: se reutiliza la abierta si se reanuda el mismo progreso
+        if progress_file:
+            self.progress_file = progress_file
+        self.run_id = self.ledger.open_run(chat_id, self.progress_file)
+        if self.budget is not None and self.budget_follows_run:
+            self.budget.run_id = self.run_id
         
         formatted_messages = []
+        new_orders: Dict[int, str] = {}
         processed_count = 0
         skipped_count = 0
         error_count = 0
         prefilter_rejected = 0
+        run_started = time.time()
         
         # Cargar progreso previo
         try:
-            with open('progreso_produccion_final.txt', 'r', encoding='utf-8') as f:
+            with open(self.progress_file, 'r', encoding='utf-8') as f:
                 content = f.read()
                 if content.strip():
                     formatted_messages = content.split('=== PEDIDO SEPARADOR ===\n')
                     formatted_messages = [m.strip() for m in formatted_messages if m.strip()]
                     processed_count = len(formatted_messages)
-                    print(f"📥 Cargados {processed_count} pedidos previamente procesados")
-                    print()
+                    self.log('progreso_cargado',
+                             "📥 Cargados {pedidos} pedidos previamente procesados\n💰 Costo ya registrado en esta corrida: ${costo:.4f}\n",
+                             pedidos=processed_count, costo=self.calculate_total_cost()['total_cost'])
         except FileNotFoundError:
-            print("📝 Iniciando procesamiento de producción desde cero\n")
+            self.log('progreso_nuevo', "📝 Iniciando procesamiento de producción desde cero\n")
+        
+        previous_orders = list(formatted_messages)
+        self.run_state = {'chat_id': chat_id, 'mensajes': len(messages), 'inicio': datetime.now().isoformat(timespec='seconds')}
+        
+        # Orden por prioridad: se reanuda por ids procesados, no por índice
+        done_ids = None
+        if self.priority_scheduling:
+            done_ids = self.load_done_ids()
+            self.scheduler = PriorityScheduler()
+            self._live_indices = itertools.count(len(messages))
+            self.log('orden_prioridad', "🚦 Orden por prioridad: recientes y con mejor pre-filtro primero, "
+                     "mensajes en vivo por carril rápido ({hechos} ya procesados)", hechos=len(done_ids))
+        
+        # Backfill: pre-filtro y plantilla de todos los pendientes en paralelo antes del bucle
+        first_pending = start_from if done_ids is not None else max(start_from, processed_count)
+        self.precompute_local_stages([m.get('body', '') or '' for m in messages[first_pending:]])
         
         # Procesar cada mensaje
-        for i, message in enumerate(messages[start_from:], start_from):
-            if i < processed_count:
-                continue
-                
+        for i, message, lane in self.work_items(messages, start_from, processed_count, done_ids):
             message_text = message.get('body', '')
+            self.set_message_context(message.get('id'), chat_id)
+            self.run_state.update(indice=i + 1, message_id=message.get('id'), carril=lane, pedidos=processed_count,
+                                  pedidos_en_memoria=len(formatted_messages), saltados=skipped_count,
+                                  errores=error_count, prefiltro_rechazados=prefilter_rejected)
             
             if not message_text or len(message_text.strip()) < 20:
                 skipped_count += 1
                 continue
             
-            print(f"🔍 Mensaje {i+1}/{len(messages)}")
-            print(f"📄 {message_text[:80]}...")
+            self.log('mensaje', "🔍 Mensaje {indice}/{total}: {vista_previa}...", logging.DEBUG,
+                     indice=i + 1, total=len(messages), vista_previa=message_text[:80])
             
             # PASO 1: Pre-filtro rápido
             if not self.quick_filter_message(message_text):
-                print(f"⚡ Pre-filtro: RECHAZADO")
+                self.log('prefiltro', "⚡ Pre-filtro: RECHAZADO", logging.DEBUG, stage='prefilter', aprobado=False)
                 prefilter_rejected += 1
-                time.sleep(0.3)
-                print()
+                time.sleep(self.prefilter_delay)
                 continue
             
-            print(f"⚡ Pre-filtro: APROBADO → Verificando con Claude...")
+            # Presupuesto agotado: pausar (el progreso ya está guardado para reanudar)
+            if self.budget_level() == BudgetController.PAUSA:
+                self.log('pausa_presupuesto', "⏸️  PRESUPUESTO AGOTADO - Pausando en el mensaje {indice}",
+                         logging.WARNING, indice=i + 1)
+                flush_logs()
+                self.budget.print_status()
+                break
             
-            # PASO 2: Verificación con Claude
-            if self.is_order_message(message_text):
-                print(f"🧠 Claude: ES PEDIDO → Formateando...")
-                
-                # PASO 3: Formatear
-                formatted_message = self.format_with_claude(message_text)
-                
+            # PASO 2 y 3: Verificación con Claude y formateo (en paralelo si el pre-filtro es alto)
+            message_usage = {'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0}
+            self._context.usage_sink = message_usage
+            started = time.time()
+            try:
+                is_order, formatted_message = self.process_candidate(message_text)
+            finally:
+                self._context.usage_sink = None
+            outcome = {
+                'indice': i + 1,
+                'total': len(messages),
+                'carril': lane,
+                'stage': 'candidate',
+                'latency_ms': round((time.time() - started) * 1000),
+                'input_tokens': message_usage['input_tokens'],
+                'output_tokens': message_usage['output_tokens'],
+                'costo': round(message_usage['cost'], 6),
+            }
+            
+            if done_ids is not None:
+                done_ids.add(str(message.get('id') or f"idx_{i}"))
+            
+            if is_order:
                 if formatted_message:
-                    formatted_messages.append(formatted_message)
+                    # Pedidos en el orden original de los mensajes aunque se procesen por prioridad
+                    new_orders[i] = formatted_message
+                    formatted_messages = previous_orders + [new_orders[k] for k in sorted(new_orders)]
                     processed_count += 1
                     
                     # Guardar progreso inmediatamente
                     try:
-                        with open('progreso_produccion_final.txt', 'w', encoding='utf-8') as f:
+                        with self.profile_stage('progreso'), open(self.progress_file, 'w', encoding='utf-8') as f:
                             f.write('\n=== PEDIDO SEPARADOR ===\n'.join(formatted_messages))
+                        if done_ids is not None:
+                            self.save_done_ids(done_ids)
                     except Exception as e:
-                        print(f"⚠️ Error guardando progreso: {e}")
+                        self.log('error_progreso', "⚠️ Error guardando progreso: {error}", logging.WARNING, error=str(e))
                     
                     first_line = formatted_message.split('\n')[0] if formatted_message else 'N/A'
-                    print(f"✅ PEDIDO {processed_count}: {first_line}")
+                    self.log('pedido', "✅ PEDIDO {pedido} (mensaje {indice}/{total}, {latency_ms} ms, "
+                             "{input_tokens}+{output_tokens} tokens): {nombre}",
+                             resultado='pedido', pedido=processed_count, nombre=first_line, **outcome)
                     
-                    # Checkpoint cada 5 pedidos
-                    if processed_count % 5 == 0:
-                        partial_cost = self.calculate_total_cost()
-                        print(f"\n🔄 CHECKPOINT: {processed_count} pedidos procesados")
-                        print(f"💰 Costo parcial: ${partial_cost['total_cost']:.4f}")
-                        self.safe_delay(
+                    # Checkpoint cada N pedidos (según el perfil)
+                    if processed_count % self.checkpoint_every == 0:
+                        self.log('checkpoint', "🔄 CHECKPOINT: {pedidos} pedidos procesados - costo parcial ${costo:.4f}",
+                                 pedidos=processed_count, costo=self.calculate_total_cost()['total_cost'])
+                        if self.whatsapp_pacer.tuner:
+                            self.check_instance_health()
+                        if self.profiler is not None:
+                            self.profiler.checkpoint(f"checkpoint {processed_count} pedidos")
+                        self.paced_delay(
                             self.checkpoint_delay, 
-                            self.checkpoint_delay + 20,
-                            f"Pausa estratégica checkpoint"
+                            self.checkpoint_delay + self.checkpoint_jitter,
+                            f"Pausa estratégica checkpoint",
+                            interruptible=True
                         )
-                        print()
                 else:
                     error_count += 1
-                    print(f"❌ ERROR AL FORMATEAR - Continuando...")
+                    self.log('error_formato', "❌ ERROR AL FORMATEAR mensaje {indice}/{total} - Continuando...",
+                             logging.WARNING, resultado='error', **outcome)
             else:
-                print(f"🧠 Claude: NO ES PEDIDO")
+                self.log('no_pedido', "🧠 Mensaje {indice}/{total}: NO ES PEDIDO ({latency_ms} ms)",
+                         resultado='no_pedido', **outcome)
                 skipped_count += 1
+                if done_ids is not None:
+                    self.save_done_ids(done_ids)
             
             # Delay entre mensajes
-            if processed_count % 5 != 0:
-                self.safe_delay(4, 8, "Delay seguridad producción")
-            
-            print()
+            if processed_count % self.checkpoint_every != 0 and self.message_delay_max > 0:
+                self.safe_delay(self.message_delay_min, self.message_delay_max, "Delay seguridad producción",
+                                interruptible=True)
         
-        # Estadísticas finales
+        # Estadísticas finales: evento para el JSONL y resumen legible aparte
         total_analyzed = len(messages)
-        efficiency = (processed_count / total_analyzed * 100) if total_analyzed > 0 else 0
+        stats = {
+            'total_mensajes': total_analyzed,
+            'prefiltro_rechazados': prefilter_rejected,
+            'pedidos': processed_count,
+            'saltados': skipped_count,
+            'errores': error_count,
+            'eficiencia': round(processed_count / total_analyzed * 100, 1) if total_analyzed > 0 else 0.0,
+            'duracion_s': round(time.time() - run_started, 1),
+        }
+        if self.scheduler is not None:
+            unprocessed_live = self.scheduler.drain()
+            if unprocessed_live:
+                self.log('vivo_sin_procesar', "⚠️ {mensajes} mensajes en vivo quedaron sin procesar", logging.WARNING,
+                         mensajes=unprocessed_live)
+            stats.update(en_vivo=self.scheduler.stats[LIVE_LANE],
+                         espera_vivo_max_s=self.scheduler.stats['espera_vivo_max_s'])
+            self.scheduler = None
+        self.close_speculation_pool()
+        self.set_message_context(None, chat_id)
+        self.reset_local_results()
+        self.run_state.update(stats)
+        self.log('fin_corrida', '', chat_id=chat_id, **stats)
+        self.print_run_summary(stats)
         
+        return formatted_messages
+    
+    def print_run_summary(self, stats: Dict):
+        """Resumen legible de la corrida en consola (los eventos por mensaje van al log estructurado)"""
+        flush_logs()
         print("🎉" * 30)
         print("                         PROCESAMIENTO DE PRODUCCIÓN COMPLETADO")
         print("🎉" * 30)
         print(f"📊 ESTADÍSTICAS FINALES:")
-        print(f"   📝 Total mensajes: {total_analyzed}")
-        print(f"   ⚡ Pre-filtro rechazó: {prefilter_rejected}")
-        print(f"   ✅ Pedidos procesados: {processed_count}")
-        print(f"   ⏭️ Mensajes saltados: {skipped_count}")
-        print(f"   ❌ Errores: {error_count}")
-        print(f"   📈 Eficiencia: {efficiency:.1f}%")
+        print(f"   📝 Total mensajes: {stats['total_mensajes']}")
+        print(f"   ⚡ Pre-filtro rechazó: {stats['prefiltro_rechazados']}")
+        print(f"   ✅ Pedidos procesados: {stats['pedidos']}")
+        print(f"   ⏭️ Mensajes saltados: {stats['saltados']}")
+        print(f"   ❌ Errores: {stats['errores']}")
+        print(f"   📈 Eficiencia: {stats['eficiencia']:.1f}%")
+        print(f"   ⏱️  Duración: {stats['duracion_s']:.0f}s")
+        if 'en_vivo' in stats:
+            print(f"   ⚡ En vivo por carril rápido: {stats['en_vivo']} (espera máxima {stats['espera_vivo_max_s']:.1f}s)")
         print(f"🛡️ Número WhatsApp PROTEGIDO con delays de seguridad")
-        
-        return formatted_messages
     
-    def generate_final_crm_file(self, formatted_messages: List[str]):
-        """Genera CRM final de producción con extracción AI"""
-        print(f"\n🧠 Extrayendo datos CRM con Claude AI para {len(formatted_messages)} pedidos...")
-        crm_records = []
+    def extract_crm_records(self, formatted_messages: List[str]) -> List[Dict[str, str]]:
+        """Extrae los registros CRM de todos los pedidos formateados"""
+        return [r for r in self.extract_crm_for_messages(formatted_messages) if r['nombre']]
+    
+    @profiled_stage('crm_extraction')
+    def extract_crm_for_messages(self, formatted_messages: List[str]) -> List[Dict[str, str]]:
+        """Un registro CRM por pedido formateado, en el mismo orden (incluye los que quedan sin nombre)"""
+        # Los pedidos de la llamada única ya traen su registro CRM
+        pending = [m for m in dict.fromkeys(formatted_messages) if m not in self._single_call_crm]
+        self.log('crm_inicio', "\n🧠 Extrayendo datos CRM con Claude AI para {pedidos} pedidos...",
+                 stage='crm_extraction', pedidos=len(pending))
+        self.set_message_context(None, getattr(self._context, 'chat_id', None))
         
-        for i, msg in enumerate(formatted_messages, 1):
-            print(f"🔄 Extrayendo CRM {i}/{len(formatted_messages)}...")
-            crm_data = self.extract_crm_data_with_ai(msg)
-            if crm_data['nombre']:
-                crm_records.append(crm_data)
-            
-            # Delay entre extracciones para no saturar
-            if i % 10 == 0:
-                print(f"💰 Costo parcial CRM: ${self.calculate_total_cost()['total_cost']:.4f}")
-                time.sleep(3)
-            else:
-                time.sleep(1)
+        if self.crm_batch_size > 1:
+            extracted = self.extract_crm_records_batched(pending)
+        else:
+            extracted = []
+            for i, msg in enumerate(pending, 1):
+                self.log('crm_pedido', "🔄 Extrayendo CRM {indice}/{total}...", logging.DEBUG,
+                         stage='crm_extraction', indice=i, total=len(pending))
+                extracted.append(self.extract_crm_data_with_ai(msg))
+                
+                # Delay entre extracciones para no saturar
+                if i % 10 == 0:
+                    self.log('costo_parcial', "💰 Costo parcial CRM: ${costo:.4f}", logging.DEBUG, stage='crm_extraction',
+                             costo=self.calculate_total_cost()['total_cost'])
+                    time.sleep(3 * self.claude_pause)
+                else:
+                    time.sleep(self.claude_pause)
+        
+        by_message = dict(self._single_call_crm)
+        by_message.update(zip(pending, extracted))
+        return [dict(by_message[m]) for m in formatted_messages]
+    
+    def generate_final_crm_file(self, formatted_messages: List[str], file_tag: str = '',
+                                crm_records: Optional[List[Dict[str, str]]] = None):
+        """Genera CRM final de producción con extracción AI (o con registros ya extraídos)"""
+        if crm_records is None:
+            crm_records = self.extract_crm_records(formatted_messages)
+        flush_logs()
         
         # Guardar CRM final con información completa
         costs = self.calculate_total_cost()
-        filename = f"CRM_WALAKY_PRODUCCION_FINAL_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if file_tag:
+            timestamp = f"{file_tag}_{timestamp}"
+        filename = f"CRM_WALAKY_PRODUCCION_FINAL_{timestamp}.txt"
         
         with open(filename, 'w', encoding='utf-8') as f:
             f.write("=" * 80 + "\n")
@@ -553,12 +1445,42 @@ REGLAS:
             print(f"📧 Emails válidos: {emails_validos} ({emails_validos/len(crm_records)*100:.1f}%)")
             print(f"🆔 Cédulas válidas: {cedulas_validas} ({cedulas_validas/len(crm_records)*100:.1f}%)")
             print(f"🎂 Fechas cumpleaños: {fechas_validas} ({fechas_validas/len(crm_records)*100:.1f}%)")
+            fechas = [parse_birthday(r.get('fecha_cumpleanos', '')) for r in crm_records]
+            normalizadas = len([f for f in fechas if f])
+            ambiguas = len([f for f in fechas if f and f['ambigua']])
+            print(f"📅 Fechas normalizadas (mes/día): {normalizadas} ({normalizadas/len(crm_records)*100:.1f}%), {ambiguas} ambiguas dd/mm")
         
         return filename
     
-    def save_final_production_files(self, formatted_messages: List[str]):
-        """Guarda archivos finales de producción"""
+    def generate_orders_file(self, formatted_messages: List[str], timestamp: str) -> str:
+        """Genera el JSONL de pedidos estructurados (productos con código si hay catálogo)"""
+        if self.use_local_pool(len(formatted_messages)):
+            records = self.local_pool().build_order_records(
+                formatted_messages, self.catalog_path, DEFAULT_GAZETTEER if self.localities else None)
+        else:
+            records = build_order_records(formatted_messages, self.catalog, self.localities)
+        filename = f"ORDENES_WALAKY_PRODUCCION_FINAL_{timestamp}.jsonl"
+        save_order_records(records, filename)
+        
+        print(f"📁 PEDIDOS ESTRUCTURADOS guardados: {filename}")
+        if self.catalog:
+            items = [item for record in records for item in record['productos']]
+            matched = len([item for item in items if item['codigo']])
+            if items:
+                print(f"🏷️  Productos con código: {matched}/{len(items)} ({matched/len(items)*100:.1f}%)")
+        if records and self.localities:
+            located = len([r for r in records if r['municipio']])
+            print(f"🗺️  Ciudades normalizadas: {located}/{len(records)} ({located/len(records)*100:.1f}%)")
+        return filename
+    
+    @profiled_stage('archivos_finales')
+    def save_final_production_files(self, formatted_messages: List[str], file_tag: str = '',
+                                    crm_records: Optional[List[Dict[str, str]]] = None):
+        """Guarda archivos finales de producción (file_tag separa las salidas por chat)"""
+        flush_logs()
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if file_tag:
+            timestamp = f"{file_tag}_{timestamp}"
         
         # Pedidos completos
         pedidos_filename = f"PEDIDOS_WALAKY_PRODUCCION_FINAL_{timestamp}.txt"
@@ -578,41 +1500,185 @@ REGLAS:
         
         print(f"📁 PEDIDOS FINALES guardados: {pedidos_filename}")
         
+        # Pedidos estructurados con productos normalizados
+        self.generate_orders_file(formatted_messages, timestamp)
+        
         # Generar CRM con AI
-        crm_filename = self.generate_final_crm_file(formatted_messages)
+        crm_filename = self.generate_final_crm_file(formatted_messages, file_tag, crm_records)
+        
+        # Corrida terminada: la próxima empieza su propio conteo en el ledger
+        self.ledger.close_run(self.run_id)
         
         return pedidos_filename, crm_filename
 
-# EJECUCIÓN OFICIAL DE PRODUCCIÓN
-if __name__ == "__main__":
-    # Configuración OFICIAL DE PRODUCCIÓN
-    INSTANCE_ID = "instance106153"
-    TOKEN = "b4azkwiyillsz4dr5ggg"
-    CHAT_ID = "573217003970-1604414717@g.us"
-    CLAUDE_API_KEY = "sk-ant-REDACTED"
+# EJECUCIÓN OFICIAL (producción, prueba o backfill según el perfil de ritmo)
+def main(argv: Optional[List[str]] = None):
+    """Punto de entrada único: perfiles de ritmo, credenciales por entorno/config y modos de ejecución"""
+    parser = argparse.ArgumentParser(description="Walaky WhatsApp Scraper")
+    parser.add_argument('--config', default=None, help="Config JSON con credenciales y perfiles (por defecto walaky_config.json o $WALAKY_CONFIG)")
+    parser.add_argument('--pacing-profile', help="Perfil de ritmo: trial, production, backfill o uno definido en el config")
+    parser.add_argument('--auto-tune', action='store_true', help="Ajustar los delays de WhatsApp/checkpoints según la salud observada de UltraMsg")
+    parser.add_argument('--chat-id', help="Chat a procesar (por defecto $WALAKY_CHAT_ID o chat_id del config)")
+    parser.add_argument('--dry-run', action='store_true', help="Proyecta costo y duración sin llamar a Claude")
+    parser.add_argument('--replay', help="Usa mensajes archivados (JSON) en vez de consultar WhatsApp")
+    parser.add_argument('--archive', help="Guarda los mensajes obtenidos de WhatsApp en este archivo")
+    parser.add_argument('--limit', type=int, help="Mensajes a obtener (por defecto, el del perfil)")
+    parser.add_argument('--queue', metavar='DB', help="Encolar los mensajes en la cola SQLite para worker.py en vez de procesarlos aquí")
+    parser.add_argument('--crm-batch-size', type=int, default=20, help="Pedidos por request en la extracción CRM (1 = uno por request)")
+    parser.add_argument('--local-format-confidence', type=float, default=0.9, help="Confianza mínima para formatear localmente sin Claude (>1 = desactivado)")
+    parser.add_argument('--local-workers', type=int, help="Procesos para las etapas locales (0 = todos los núcleos; por defecto, el del perfil)")
+    parser.add_argument('--catalog', default='productos.csv', help="CSV exportado de la hoja de productos (Código, Artículo, Impuesto, Precio)")
+    parser.add_argument('--priority-order', action='store_true', help="Procesar por prioridad (recientes y mejor pre-filtro primero) aunque el perfil no lo active")
+    parser.add_argument('--webhook-port', type=int, help="Recibir webhooks de UltraMsg durante la corrida: los mensajes en vivo entran por el carril rápido (activa --priority-order)")
+    parser.add_argument('--webhook-host', default='0.0.0.0', help="Interfaz del receptor de webhooks")
+    parser.add_argument('--webhook-db', default='cola_trabajo.db', help="Cola para los webhooks que llegan sin corrida en curso (worker.py --live-workers)")
+    parser.add_argument('--single-call', action='store_true', help="Verificación + formateo + CRM en un solo request por candidato")
+    parser.add_argument('--speculate-above', type=int, help="Puntaje de pre-filtro a partir del cual se formatea en paralelo con la verificación")
+    parser.add_argument('--chats', help="Lista de chat ids separados por coma (modo multi-chat)")
+    parser.add_argument('--llm-workers', type=int, default=4, help="Workers del pool LLM compartido (multi-chat)")
+    parser.add_argument('--verification-rate', type=float, default=0.95, help="Tasa esperada de pedidos entre candidatos (dry-run)")
+    parser.add_argument('--dry-run-latency', action='append', default=[], metavar='NOMBRE=SEG',
+                        help=f"Latencia o pausa del dry-run (repetible): {', '.join(DryRunPlanner.LATENCIES)}")
+    parser.add_argument('--max-run-cost', type=float, help="Límite en dólares para esta corrida")
+    parser.add_argument('--max-daily-cost', type=float, help="Límite en dólares por día")
+    parser.add_argument('--max-run-tokens', type=int, help="Límite de tokens para esta corrida")
+    parser.add_argument('--max-daily-tokens', type=int, help="Límite de tokens por día")
+    parser.add_argument('--budget-run-id', default=None, help="Identificador de corrida para el presupuesto (por defecto la corrida del ledger, que se conserva al reanudar)")
+    parser.add_argument('--log-level', choices=list(VERBOSITY), default='normal', help="Verbosidad de la consola")
+    parser.add_argument('--log-json', default='eventos_walaky.jsonl', help="Archivo JSONL de eventos estructurados ('' = sin archivo)")
+    parser.add_argument('--profile-cpu', action='store_true', help="Perfilador de CPU por muestreo, desglosado por etapa")
+    parser.add_argument('--profile-interval', type=float, default=10, help="Milisegundos entre muestras del perfilador de CPU")
+    parser.add_argument('--profile-memory', action='store_true', help="Snapshots de tracemalloc en cada checkpoint con las líneas que más crecieron")
+    parser.add_argument('--profile-signal', action='store_true', help="Volcar perfil y estado de la corrida a disco con SIGUSR1 (kill -USR1 <pid>) sin detenerla")
+    parser.add_argument('--profile-dir', default=DEFAULT_PROFILE_DIR, help="Carpeta de los volcados de perfil")
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level, args.log_json or None)
+    
+    # Credenciales y perfil: CLI > entorno > config (nada queda escrito en el código)
+    config = load_config(args.config)
+    try:
+        profile = resolve_pacing_profile(args.pacing_profile, config)
+    except ValueError as e:
+        parser.error(str(e))
+    credentials = load_credentials(config)
+    INSTANCE_ID = credentials['instance_id']
+    TOKEN = credentials['token']
+    CHAT_ID = args.chat_id or credentials['chat_id']
+    CLAUDE_API_KEY = credentials['anthropic_api_key']
+    limit = args.limit or profile['limit']
+    
+    if not args.replay and not (INSTANCE_ID and TOKEN):
+        parser.error("Faltan credenciales de UltraMsg: ULTRAMSG_INSTANCE_ID/ULTRAMSG_TOKEN o instance_id/token en el config")
+    if not args.dry_run and not CLAUDE_API_KEY:
+        parser.error("Falta la API key de Claude: ANTHROPIC_API_KEY o anthropic_api_key en el config")
+    if not CHAT_ID and not args.chats and not (args.dry_run and args.replay):
+        parser.error("Falta el chat: --chat-id, WALAKY_CHAT_ID o chat_id en el config")
     
     print("🏭" * 40)
     print("                              WALAKY WHATSAPP SCRAPER")
-    print("                                   PRODUCCIÓN OFICIAL")
+    print(f"                               PERFIL: {profile['name'].upper()}")
     print("🏭" * 40)
     print()
     print("🛡️ MÁXIMA SEGURIDAD - Protección anti-bloqueo WhatsApp")
     print("🧠 INTELIGENCIA ARTIFICIAL - Pre-filtro + Claude + Extracción AI")
     print("💾 GUARDADO AUTOMÁTICO - Progreso protegido en tiempo real")
     print("💰 TRACKING COMPLETO - Costos detallados de toda la operación")
-    print("🔄 SISTEMA DE RETRY - 4 intentos por operación con backoff inteligente")
+    print(f"🔄 SISTEMA DE RETRY - {profile['claude_retries']} intentos por operación con backoff inteligente")
     print()
     
     # Crear scraper de producción
     scraper = WhatsAppScraperClaudeProduction(INSTANCE_ID, TOKEN, CLAUDE_API_KEY)
+    scraper.configure_pacing(profile, auto_tune=args.auto_tune or config.get('auto_tune', False))
+    if args.local_workers is not None:
+        scraper.local_workers = args.local_workers
+    scraper.speculative_score_threshold = args.speculate_above
+    scraper.single_call = args.single_call
+    if args.priority_order or args.webhook_port:
+        scraper.priority_scheduling = True
+    scraper.crm_batch_size = args.crm_batch_size
+    scraper.configure_catalog(args.catalog)
+    scraper.local_format_confidence = args.local_format_confidence if args.local_format_confidence <= 1 else None
+    
+    # Perfilado opcional: el informe final se escribe al salir, también si la corrida se corta
+    if args.profile_cpu or args.profile_memory or args.profile_signal:
+        scraper.profiler = RunProfiler(args.profile_dir, cpu=args.profile_cpu, memory=args.profile_memory,
+                                       interval=args.profile_interval / 1000)
+        scraper.profiler.start()
+        atexit.register(scraper.profiler.close)
+        if args.profile_signal and scraper.profiler.install_signal(scraper.pipeline_state):
+            print(f"📸 Volcado de perfil: kill -USR1 {os.getpid()} → {args.profile_dir}/")
+        elif args.profile_signal:
+            print("⚠️ Este sistema no tiene SIGUSR1: sin volcado por señal")
+    
+    if any([args.max_run_cost, args.max_daily_cost, args.max_run_tokens, args.max_daily_tokens]):
+        scraper.configure_budget(
+            args.budget_run_id,
+            max_run_cost=args.max_run_cost,
+            max_daily_cost=args.max_daily_cost,
+            max_run_tokens=args.max_run_tokens,
+            max_daily_tokens=args.max_daily_tokens
+        )
+    
+    if args.dry_run:
+        if args.replay:
+            messages = load_messages_archive(args.replay)
+            print(f"📂 {len(messages)} mensajes cargados de {args.replay}")
+        else:
+            messages = scraper.get_messages(CHAT_ID, limit)
+            if args.archive:
+                save_messages_archive(messages, args.archive)
+                print(f"💾 Mensajes archivados en: {args.archive}")
+        try:
+            latencies = {name: float(seconds) for name, seconds in (item.split('=', 1) for item in args.dry_run_latency)}
+            planner = DryRunPlanner(scraper, verification_pass_rate=args.verification_rate, latencies=latencies)
+        except ValueError as e:
+            parser.error(f"--dry-run-latency: {e}")
+        planner.print_plan(planner.plan(messages[:limit], fetch_from_whatsapp=not args.replay))
+        raise SystemExit(0)
+    
+    if args.queue:
+        queue = WorkQueue(args.queue)
+        for chat_id in [c.strip() for c in (args.chats or CHAT_ID).split(',') if c.strip()]:
+            if args.replay:
+                messages = load_messages_archive(args.replay)[:limit]
+            else:
+                messages = scraper.get_messages(chat_id, limit)
+            queued = queue.enqueue_messages(chat_id, messages)
+            print(f"📋 {chat_id}: {queued} mensajes nuevos encolados para verificación")
+        print(f"👷 Ejecutar: python worker.py --db {args.queue} --processes N")
+        raise SystemExit(0)
+    
+    if args.chats:
+        chat_ids = [c.strip() for c in args.chats.split(',') if c.strip()]
+        scheduler = MultiChatScheduler(scraper, chat_ids, limit=limit, llm_workers=args.llm_workers)
+        results = scheduler.run()
+        files = scheduler.save_outputs(results)
+        print(f"\n🎯 RESUMEN MULTI-CHAT:")
+        for chat_id, chat_files in files.items():
+            print(f"   • {chat_id}: {len(results[chat_id])} pedidos → {', '.join(chat_files)}")
+        scraper.print_cost_summary(run_ids=scheduler.run_ids())
+        raise SystemExit(0)
+    
+    # Receptor de webhooks en el mismo proceso: lo que llega durante la corrida va a submit_live, el resto a la cola
+    if args.webhook_port:
+        receiver = WebhookReceiver(WorkQueue(args.webhook_db), [CHAT_ID], secret=os.environ.get('WEBHOOK_SECRET'),
+                                   instance_id=INSTANCE_ID, live_sink=scraper.submit_live)
+        receiver.serve_in_background(args.webhook_host, args.webhook_port)
     
     # Ejecutar rutina oficial de producción
-    formatted_messages = scraper.scrape_and_format_messages_production(CHAT_ID, limit=1000)
+    replay_messages = None
+    if args.replay:
+        replay_messages = load_messages_archive(args.replay)[:limit]
+    elif args.archive:
+        replay_messages = scraper.get_messages(CHAT_ID, limit)
+        save_messages_archive(replay_messages, args.archive)
+        print(f"💾 Mensajes archivados en: {args.archive}")
+    formatted_messages = scraper.scrape_and_format_messages_production(CHAT_ID, limit=limit, messages=replay_messages)
     
     # Generar archivos oficiales finales
     if formatted_messages:
         print(f"\n🔄 Generando archivos finales de producción...")
-        pedidos_file, crm_file = scraper.save_final_production_files(formatted_messages)
+        pedidos_file, crm_file = scraper.save_final_production_files(formatted_messages, file_tag=profile['file_tag'])
         
         # MOSTRAR RESUMEN COMPLETO DE COSTOS
         scraper.print_cost_summary()
@@ -622,7 +1688,7 @@ if __name__ == "__main__":
         print(f"📁 Archivos generados:")
         print(f"   • {pedidos_file}")
         print(f"   • {crm_file}")
-        print(f"💾 Progreso guardado en: progreso_produccion_final.txt")
+        print(f"💾 Progreso guardado en: {scraper.progress_file}")
         print(f"\n🚀 ¡MISIÓN DE PRODUCCIÓN COMPLETADA EXITOSAMENTE!")
         print(f"🏆 Sistema ejecutado con máxima seguridad y precisión")
         print(f"💼 Datos listos para uso empresarial")
@@ -646,4 +1712,8 @@ if __name__ == "__main__":
         
     print("\n" + "🏭" * 40)
     print("                              FIN DE EJECUCIÓN DE PRODUCCIÓN")
-    print("🏭" * 40)
\ No newline at end of file
+    print("🏭" * 40)
+
+
+if __name__ == "__main__":
+    main()
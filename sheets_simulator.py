@@ -0,0 +1,165 @@
+import re
+import json
+import time
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+RANGE_RE = re.compile(r"^(?:'?(?P<sheet>[^'!]+)'?!)?(?P<c1>[A-Z]+)(?P<r1>\d*)(?::(?P<c2>[A-Z]+)(?P<r2>\d*))?$")
+
+
+def column_index(letters: str) -> int:
+    """'A' → 0, 'J' → 9, 'AA' → 26"""
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+
+def column_letters(index: int) -> str:
+    """0 → 'A', 9 → 'J', 26 → 'AA'"""
+    letters = ''
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(65 + rest) + letters
+    return letters
+
+
+def parse_range(a1: str) -> Tuple[str, int, Optional[int], int, Optional[int]]:
+    """Rango A1 → (hoja, columna inicial, fila inicial, columna final, fila final); filas 1-based o None"""
+    match = RANGE_RE.match(a1.strip())
+    if not match:
+        raise ValueError(f"Rango no soportado: {a1}")
+    start_col = column_index(match['c1'])
+    end_col = column_index(match['c2'] or match['c1'])
+    start_row = int(match['r1']) if match['r1'] else None
+    end_row = int(match['r2']) if match['r2'] else (start_row if not match['c2'] else None)
+    return match['sheet'] or 'Hoja 1', start_col, start_row, end_col, end_row
+
+
+class FakeHttpError(Exception):
+    """Imita googleapiclient.errors.HttpError (resp.status) para probar reintentos y cuota"""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"<HttpError {status}: {reason}>")
+        self.resp = type('Resp', (), {'status': status, 'reason': reason})()
+
+
+class _FakeRequest:
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def execute(self):
+        return self.func(*self.args)
+
+
+class _FakeValues:
+    def __init__(self, service: 'FakeSheetsService'):
+        self.service = service
+
+    def get(self, spreadsheetId: str, range: str, **kwargs):
+        return _FakeRequest(self.service._get, spreadsheetId, range)
+
+    def append(self, spreadsheetId: str, range: str, body: Dict, valueInputOption: str = 'RAW', **kwargs):
+        return _FakeRequest(self.service._append, spreadsheetId, range, body['values'])
+
+    def batchUpdate(self, spreadsheetId: str, body: Dict):
+        return _FakeRequest(self.service._batch_update, spreadsheetId, body['data'])
+
+
+class FakeSheetsService:
+    """API de Google Sheets en memoria (spreadsheets().values(): get/append/batchUpdate) con cuota por minuto"""
+
+    def __init__(self, path: Optional[str] = None, quota_per_minute: Optional[int] = None):
+        self.path = path
+        self.quota_per_minute = quota_per_minute
+        self.calls = {'get': 0, 'append': 0, 'batchUpdate': 0, 'rechazadas': 0}
+        self._recent: List[float] = []
+        # {spreadsheetId: {hoja: [filas]}}
+        self.data: Dict[str, Dict[str, List[List]]] = {}
+        if path:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.data = json.load(f)
+            except FileNotFoundError:
+                pass
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return _FakeValues(self)
+
+    def rows(self, spreadsheet_id: str, sheet: str = 'Hoja 1') -> List[List]:
+        return self.data.setdefault(spreadsheet_id, {}).setdefault(sheet, [])
+
+    def _check_quota(self, call: str):
+        now = time.monotonic()
+        if self.quota_per_minute:
+            self._recent = [t for t in self._recent if now - t < 60]
+            if len(self._recent) >= self.quota_per_minute:
+                self.calls['rechazadas'] += 1
+                raise FakeHttpError(429, 'Quota exceeded for quota metric Write requests per minute per user')
+            self._recent.append(now)
+        self.calls[call] += 1
+
+    def _save(self):
+        if self.path:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False)
+
+    def _get(self, spreadsheet_id: str, a1: str) -> Dict:
+        self._check_quota('get')
+        sheet, start_col, start_row, end_col, end_row = parse_range(a1)
+        rows = self.rows(spreadsheet_id, sheet)
+        first = (start_row or 1) - 1
+        last = end_row if end_row else len(rows)
+        values = [row[start_col:end_col + 1] for row in rows[first:last]]
+        # Como la API: sin celdas vacías al final de cada fila ni filas vacías al final
+        values = [row[:max([i + 1 for i, v in enumerate(row) if v not in ('', None)], default=0)] for row in values]
+        while values and not values[-1]:
+            values.pop()
+        return {'range': a1, 'values': values} if values else {'range': a1}
+
+    def _append(self, spreadsheet_id: str, a1: str, values: List[List]) -> Dict:
+        self._check_quota('append')
+        sheet, start_col, _, end_col, _ = parse_range(a1)
+        rows = self.rows(spreadsheet_id, sheet)
+        first_row = len(rows) + 1
+        for row in values:
+            rows.append([''] * start_col + list(row))
+        self._save()
+        last_col = column_letters(start_col + max((len(r) for r in values), default=1) - 1)
+        updated = f"'{sheet}'!{column_letters(start_col)}{first_row}:{last_col}{first_row + len(values) - 1}"
+        return {'updates': {'updatedRange': updated, 'updatedRows': len(values)}}
+
+    def _batch_update(self, spreadsheet_id: str, data: List[Dict]) -> Dict:
+        self._check_quota('batchUpdate')
+        for item in data:
+            sheet, start_col, start_row, _, _ = parse_range(item['range'])
+            rows = self.rows(spreadsheet_id, sheet)
+            for offset, values in enumerate(item['values']):
+                index = start_row - 1 + offset
+                while len(rows) <= index:
+                    rows.append([])
+                row = rows[index]
+                if len(row) < start_col + len(values):
+                    row.extend([''] * (start_col + len(values) - len(row)))
+                row[start_col:start_col + len(values)] = list(values)
+        self._save()
+        return {'totalUpdatedRows': sum(len(item['values']) for item in data)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Muestra el contenido de una hoja simulada (archivo JSON del simulador)")
+    parser.add_argument('file', help="Archivo JSON del simulador (--fake de sheets_sync.py)")
+    parser.add_argument('--rows', type=int, default=5, help="Filas a mostrar por hoja")
+    args = parser.parse_args()
+
+    service = FakeSheetsService(args.file)
+    for spreadsheet_id, sheets in service.data.items():
+        for sheet, rows in sheets.items():
+            print(f"📄 {spreadsheet_id} / {sheet}: {len(rows)} filas")
+            for row in rows[:args.rows]:
+                print(f"   {row}")
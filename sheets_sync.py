@@ -0,0 +1,436 @@
+import os
+import re
+import glob
+import json
+import time
+import random
+import argparse
+from collections import deque
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from order_records import load_order_records, order_fingerprint, order_fingerprints
+from product_catalog import parse_quantity
+from birthday_index import load_crm_txt
+from sheets_simulator import FakeSheetsService, column_letters
+
+try:
+    from googleapiclient.discovery import build
+    from google.oauth2.service_account import Credentials
+except ImportError:  # la sincronización es opcional: el scraper no depende de las librerías de Google
+    build = None
+    Credentials = None
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Mismas columnas que insertDataToSheet (A:J) y addNewClient (A:L) del bot de Telegram
+ORDER_HEADER = ['Código', 'Artículo', 'Cantidad', 'Precio sin IVA', 'Total', 'Factura', 'Fecha',
+                'Cliente', 'Teléfono', 'Email']
+CLIENT_HEADER = ['ID', 'Nombre', 'Cédula', 'Email', 'Fecha cumpleaños', 'Número compras', 'Total gastado',
+                 'Ticket promedio', 'Productos únicos', 'Frecuencia compra', 'Primera compra', 'Última compra']
+
+# Errores que se reintentan: cuota (429) y caídas temporales del servicio
+RETRY_STATUS = {429, 500, 502, 503, 504}
+FILE_DATE_RE = re.compile(r'(\d{8})_\d{6}')
+DEFAULT_TAX = 19.0
+
+
+def require_google():
+    if build is None:
+        raise RuntimeError("La sincronización con Sheets necesita google-api-python-client y google-auth: "
+                           "pip install google-api-python-client google-auth (o use --fake)")
+
+
+def build_sheets_service(creds_file: str = './creds.json'):
+    """Cliente de la API v4 con la misma cuenta de servicio (creds.json) que usa el bot"""
+    require_google()
+    credentials = Credentials.from_service_account_file(creds_file, scopes=SCOPES)
+    return build('sheets', 'v4', credentials=credentials, cache_discovery=False)
+
+
+def cell(value) -> str:
+    """Forma canónica de una celda para comparar lo local con lo que devuelve la hoja"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        value = round(value, 2)
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value).strip()
+
+
+def to_number(value) -> float:
+    try:
+        return float(str(value).replace(',', '').replace('$', '') or 0)
+    except ValueError:
+        return 0.0
+
+
+def order_row_keys(rows: List[List]) -> List[Optional[str]]:
+    """Clave de cada fila de ventas: factura + número de línea dentro de la factura"""
+    seen: Dict[str, int] = {}
+    keys = []
+    for row in rows:
+        factura = cell(row[5]) if len(row) > 5 else ''
+        if not factura:
+            keys.append(None)
+            continue
+        seen[factura] = seen.get(factura, 0) + 1
+        keys.append(f"{factura}#{seen[factura]}")
+    return keys
+
+
+def client_row_keys(rows: List[List]) -> List[Optional[str]]:
+    """Clave de cada cliente: email en minúsculas (la búsqueda que hace getClientByEmail)"""
+    return [cell(row[3]).lower() or None if len(row) > 3 else None for row in rows]
+
+
+class QuotaPacer:
+    """Ventana deslizante de requests por minuto (cuota de Sheets: 60 por minuto por usuario)"""
+
+    def __init__(self, requests_per_minute: int = 55, window: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.window = window
+        self._sent = deque()
+        self.waited = 0.0
+
+    def wait(self):
+        """Bloquea hasta que haya cupo en la ventana y registra el request"""
+        now = time.monotonic()
+        while self._sent and now - self._sent[0] >= self.window:
+            self._sent.popleft()
+        if len(self._sent) >= self.requests_per_minute:
+            pause = self.window - (now - self._sent[0])
+            self.waited += pause
+            time.sleep(pause)
+            self._sent.popleft()
+        self._sent.append(time.monotonic())
+
+
+class SheetSnapshot:
+    """Copia local de una hoja destino: fila y número de fila por clave, para enviar solo lo nuevo o cambiado"""
+
+    def __init__(self, path: str, key_func: Callable[[List[List]], List[Optional[str]]]):
+        self.path = path
+        self.key_func = key_func
+        self.rows: Dict[str, List[str]] = {}
+        self.row_numbers: Dict[str, int] = {}
+        self.next_row = 1
+        self.updated = ''
+
+    def load(self) -> bool:
+        """True si había copia local"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        self.rows = data['filas']
+        self.row_numbers = data['numeros']
+        self.next_row = data['siguiente_fila']
+        self.updated = data.get('actualizado', '')
+        return True
+
+    def save(self):
+        self.updated = datetime.now().isoformat(timespec='seconds')
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'filas': self.rows, 'numeros': self.row_numbers, 'siguiente_fila': self.next_row,
+                       'actualizado': self.updated}, f, ensure_ascii=False)
+        os.replace(tmp_file, self.path)
+
+    def rebuild(self, values: List[List]):
+        """Reconstruye la copia desde los valores de la hoja (fila 1 = encabezado)"""
+        self.rows, self.row_numbers = {}, {}
+        body = values[1:]
+        for number, (key, row) in enumerate(zip(self.key_func(body), body), 2):
+            if key:
+                self.rows[key] = [cell(v) for v in row]
+                self.row_numbers[key] = number
+        self.next_row = len(values) + 1
+
+    def record(self, key: str, row: List, row_number: int):
+        self.rows[key] = [cell(v) for v in row]
+        self.row_numbers[key] = row_number
+        self.next_row = max(self.next_row, row_number + 1)
+
+    def changed(self, key: str, row: List) -> bool:
+        stored = self.rows[key]
+        current = [cell(v) for v in row]
+        # La hoja no devuelve celdas vacías al final de la fila
+        return stored + [''] * (len(current) - len(stored)) != current
+
+
+def build_order_rows(record: Dict, sale_date: str) -> List[Tuple[str, List]]:
+    """Filas de ventas (una por producto) de un pedido estructurado, como las arma el bot.
+    La factura sale de la huella del pedido dentro de su archivo (ver load_dated_orders)"""
+    factura = 'WA' + (record.get('huella') or order_fingerprint(record))[:10].upper()
+    items = record.get('productos') or []
+    if not items:
+        # Sin catálogo: el texto de cada producto con su cantidad, sin código ni precio
+        items = []
+        for text in record.get('productos_texto', []):
+            name, quantity = parse_quantity(text)
+            items.append({'codigo': '', 'articulo': name, 'texto': text, 'cantidad': quantity, 'precio': 0.0})
+    rows = []
+    for line, item in enumerate(items, 1):
+        price = float(item.get('precio') or 0.0)
+        tax = item.get('impuesto', DEFAULT_TAX) if price else 0.0
+        quantity = item.get('cantidad') or 1
+        rows.append((f"{factura}#{line}", [
+            item.get('codigo', ''),
+            item.get('articulo') or item.get('texto', ''),
+            quantity,
+            price,
+            round((price + price * tax / 100) * quantity, 2),
+            factura,
+            sale_date,
+            record.get('nombre', ''),
+            record.get('telefono', ''),
+            record.get('email', ''),
+        ]))
+    return rows
+
+
+def client_stats(sales_rows: List[List[str]]) -> Dict[str, Dict]:
+    """Compras, total, ticket, productos únicos, frecuencia (días) y fechas por email, desde la hoja de ventas"""
+    by_email: Dict[str, Dict] = {}
+    for row in sales_rows:
+        row = row + [''] * (10 - len(row))
+        email = row[9].lower()
+        if not email:
+            continue
+        stats = by_email.setdefault(email, {'facturas': {}, 'total': 0.0, 'codigos': set()})
+        stats['total'] += to_number(row[4])
+        stats['facturas'].setdefault(row[5], row[6])
+        if row[0]:
+            stats['codigos'].add(row[0])
+
+    result = {}
+    for email, stats in by_email.items():
+        dates = sorted(d for d in stats['facturas'].values() if d)
+        days = []
+        for previous, current in zip(dates, dates[1:]):
+            try:
+                days.append((date.fromisoformat(current) - date.fromisoformat(previous)).days)
+            except ValueError:
+                pass
+        purchases = len(stats['facturas'])
+        result[email] = {
+            'numeroCompras': purchases,
+            'totalGastado': round(stats['total'], 2),
+            'ticketPromedio': round(stats['total'] / purchases, 2) if purchases else 0,
+            'productosUnicos': len(stats['codigos']),
+            'frecuenciaCompra': round(sum(days) / len(days)) if days else 0,
+            'primeraCompra': dates[0] if dates else '',
+            'ultimaCompra': dates[-1] if dates else '',
+        }
+    return result
+
+
+class SheetsSync:
+    """Sincroniza pedidos (hoja de ventas) y clientes (hoja CRM) por lotes, enviando solo las filas nuevas o cambiadas"""
+
+    def __init__(self, service, destination_sheet_id: str, clients_sheet_id: Optional[str] = None,
+                 cache_dir: str = 'sheets_cache', pacer: Optional[QuotaPacer] = None,
+                 append_chunk: int = 500, update_chunk: int = 200, retries: int = 5):
+        self.service = service
+        self.destination_sheet_id = destination_sheet_id
+        self.clients_sheet_id = clients_sheet_id
+        self.cache_dir = cache_dir
+        self.pacer = pacer or QuotaPacer()
+        self.append_chunk = append_chunk
+        self.update_chunk = update_chunk
+        self.retries = retries
+        self.stats = {'requests': 0, 'reintentos': 0}
+
+    def _execute(self, make_request: Callable):
+        """Ejecuta un request respetando la cuota; 429/5xx se reintentan con backoff exponencial"""
+        for attempt in range(self.retries):
+            self.pacer.wait()
+            self.stats['requests'] += 1
+            try:
+                return make_request().execute()
+            except Exception as e:
+                status = getattr(getattr(e, 'resp', None), 'status', None)
+                if status is None or int(status) not in RETRY_STATUS or attempt == self.retries - 1:
+                    raise
+                wait_time = min(2 ** attempt * 5, 64) + random.uniform(0, 1)
+                self.stats['reintentos'] += 1
+                print(f"⏳ Sheets respondió {status}: reintento en {wait_time:.0f}s")
+                time.sleep(wait_time)
+
+    def snapshot(self, spreadsheet_id: str, width: int, key_func: Callable, refresh: bool = False) -> SheetSnapshot:
+        """Copia local de la hoja; se lee de la API solo si no existe o se pide refrescar"""
+        snapshot = SheetSnapshot(os.path.join(self.cache_dir, f"{spreadsheet_id}.json"), key_func)
+        if refresh or not snapshot.load():
+            response = self._execute(lambda: self.service.spreadsheets().values().get(
+                spreadsheetId=spreadsheet_id, range=f"A:{column_letters(width - 1)}",
+                valueRenderOption='UNFORMATTED_VALUE'))
+            snapshot.rebuild(response.get('values', []))
+            snapshot.save()
+        return snapshot
+
+    def push(self, spreadsheet_id: str, snapshot: SheetSnapshot, desired: List[Tuple[str, List]],
+             header: List[str], dry_run: bool = False) -> Dict[str, int]:
+        """Diff contra la copia local; append por bloques para lo nuevo y batchUpdate por bloques para lo cambiado"""
+        new = [(key, row) for key, row in desired if key not in snapshot.rows]
+        changed = [(key, row) for key, row in desired if key in snapshot.rows and snapshot.changed(key, row)]
+        result = {'nuevas': len(new), 'cambiadas': len(changed), 'sin_cambios': len(desired) - len(new) - len(changed)}
+        if dry_run:
+            return result
+        last_col = column_letters(len(header) - 1)
+
+        for start in range(0, len(new), self.append_chunk):
+            chunk = new[start:start + self.append_chunk]
+            values = [row for _, row in chunk]
+            with_header = snapshot.next_row == 1
+            if with_header:
+                values = [header] + values
+            response = self._execute(lambda: self.service.spreadsheets().values().append(
+                spreadsheetId=spreadsheet_id, range=f"A:{last_col}", valueInputOption='RAW',
+                insertDataOption='INSERT_ROWS', body={'values': values}))
+            updated = response.get('updates', {}).get('updatedRange', '')
+            match = re.search(r'![A-Z]+(\d+)', updated)
+            first_row = int(match.group(1)) if match else snapshot.next_row
+            if with_header:
+                first_row += 1
+            for offset, (key, row) in enumerate(chunk):
+                snapshot.record(key, row, first_row + offset)
+            # Guardar tras cada bloque: si el proceso cae, no se vuelve a agregar lo ya enviado
+            snapshot.save()
+
+        for start in range(0, len(changed), self.update_chunk):
+            chunk = changed[start:start + self.update_chunk]
+            data = [{'range': f"A{snapshot.row_numbers[key]}:{last_col}{snapshot.row_numbers[key]}", 'values': [row]}
+                    for key, row in chunk]
+            self._execute(lambda: self.service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id, body={'valueInputOption': 'RAW', 'data': data}))
+            for key, row in chunk:
+                snapshot.record(key, row, snapshot.row_numbers[key])
+            snapshot.save()
+        return result
+
+    def sync_orders(self, dated_records: List[Tuple[Dict, str]], refresh: bool = False,
+                    dry_run: bool = False) -> Tuple[Dict[str, int], SheetSnapshot]:
+        """Pedidos estructurados (con su fecha) → filas de la hoja de ventas"""
+        snapshot = self.snapshot(self.destination_sheet_id, len(ORDER_HEADER), order_row_keys, refresh)
+        desired = [row for record, sale_date in dated_records for row in build_order_rows(record, sale_date)]
+        result = self.push(self.destination_sheet_id, snapshot, desired, ORDER_HEADER, dry_run)
+        return result, snapshot
+
+    def sync_clients(self, clients: List[Dict[str, str]], sales: SheetSnapshot, refresh: bool = False,
+                     dry_run: bool = False) -> Dict[str, int]:
+        """Clientes por email con sus estadísticas recalculadas desde la hoja de ventas (como processClientData)"""
+        snapshot = self.snapshot(self.clients_sheet_id, len(CLIENT_HEADER), client_row_keys, refresh)
+        stats = client_stats(list(sales.rows.values()))
+        ids = [int(row[0]) for row in snapshot.rows.values() if row and row[0].isdigit()]
+        next_id = max(ids, default=0) + 1
+
+        desired = []
+        for client in clients:
+            email = client['email'].lower()
+            existing = snapshot.rows.get(email, [])
+            existing = existing + [''] * (len(CLIENT_HEADER) - len(existing))
+            if existing[0]:
+                client_id = existing[0]
+            else:
+                client_id, next_id = f"{next_id:03d}", next_id + 1
+            purchase = stats.get(email, {})
+            desired.append((email, [
+                client_id,
+                client['nombre'] or existing[1],
+                client['cedula'] or existing[2],
+                client['email'] or existing[3],
+                client['fecha_cumpleanos'] or existing[4],
+                purchase.get('numeroCompras', 0),
+                purchase.get('totalGastado', 0),
+                purchase.get('ticketPromedio', 0),
+                purchase.get('productosUnicos', 0),
+                purchase.get('frecuenciaCompra', 0),
+                existing[10] or purchase.get('primeraCompra', ''),
+                purchase.get('ultimaCompra', '') or existing[11],
+            ]))
+        return self.push(self.clients_sheet_id, snapshot, desired, CLIENT_HEADER, dry_run)
+
+
+def load_dated_orders(paths: List[str]) -> List[Tuple[Dict, str]]:
+    """Pedidos de los JSONL ORDENES_* con su huella; una venta repetida en corridas posteriores conserva la fecha
+    del primer archivo, y una compra idéntica repetida dentro del mismo archivo es otra venta"""
+    seen, dated = set(), []
+    for path in sorted(paths):
+        date_match = FILE_DATE_RE.search(os.path.basename(path))
+        sale_date = datetime.strptime(date_match.group(1), '%Y%m%d').strftime('%Y-%m-%d') if date_match \
+            else datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d')
+        records = load_order_records(path)
+        for fingerprint, record in zip(order_fingerprints(records), records):
+            if fingerprint not in seen:
+                seen.add(fingerprint)
+                dated.append((dict(record, huella=fingerprint), sale_date))
+    return dated
+
+
+def merge_clients(crm_records: List[Dict[str, str]], dated_orders: List[Tuple[Dict, str]]) -> List[Dict[str, str]]:
+    """Un cliente por email: datos del CRM (extracción AI) y, si faltan, los del pedido estructurado"""
+    clients: Dict[str, Dict[str, str]] = {}
+    for record, _ in dated_orders:
+        if record.get('email'):
+            clients[record['email'].lower()] = {'nombre': record.get('nombre', ''), 'cedula': record.get('cedula', ''),
+                                                'email': record['email'], 'fecha_cumpleanos': record.get('fc', '')}
+    for record in crm_records:
+        email = record['email'].strip().lower()
+        if '@' not in email:
+            continue
+        current = clients.setdefault(email, {'nombre': '', 'cedula': '', 'email': record['email'].strip(),
+                                             'fecha_cumpleanos': ''})
+        current.update({key: value for key, value in record.items() if value and key != 'email'})
+    return list(clients.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sincroniza pedidos y clientes del scraper con Google Sheets (solo filas nuevas o cambiadas)")
+    parser.add_argument('files', nargs='*', help="Archivos JSONL (por defecto ORDENES_WALAKY_*.jsonl)")
+    parser.add_argument('--crm', nargs='*', default=None, help="Archivos CRM_WALAKY_*.txt (por defecto todos)")
+    parser.add_argument('--destination-sheet', default=os.environ.get('DESTINATION_SHEET_ID'), help="Hoja de ventas (DESTINATION_SHEET_ID)")
+    parser.add_argument('--clients-sheet', default=os.environ.get('CLIENTS_SHEET_ID'), help="Hoja de clientes (CLIENTS_SHEET_ID)")
+    parser.add_argument('--creds', default='./creds.json', help="Credenciales de la cuenta de servicio de Google")
+    parser.add_argument('--cache', default='sheets_cache', help="Directorio de las copias locales de las hojas")
+    parser.add_argument('--refresh', action='store_true', help="Releer las hojas antes del diff (si se editaron a mano)")
+    parser.add_argument('--requests-per-minute', type=int, default=55)
+    parser.add_argument('--append-chunk', type=int, default=500, help="Filas por request de append")
+    parser.add_argument('--update-chunk', type=int, default=200, help="Rangos por request de batchUpdate")
+    parser.add_argument('--dry-run', action='store_true', help="Solo mostrar el diff")
+    parser.add_argument('--fake', help="Usar el simulador local de Sheets guardado en este JSON")
+    parser.add_argument('--fake-quota', type=int, default=None, help="Cuota por minuto del simulador")
+    args = parser.parse_args()
+
+    if not args.destination_sheet:
+        if not args.fake:
+            parser.error("Falta la hoja de ventas: --destination-sheet o DESTINATION_SHEET_ID")
+        args.destination_sheet = 'ventas'
+    if args.fake and not args.clients_sheet:
+        args.clients_sheet = 'clientes'
+
+    service = FakeSheetsService(args.fake, args.fake_quota) if args.fake else build_sheets_service(args.creds)
+    sync = SheetsSync(service, args.destination_sheet, args.clients_sheet, args.cache,
+                      QuotaPacer(args.requests_per_minute), args.append_chunk, args.update_chunk)
+
+    dated_orders = load_dated_orders(args.files or glob.glob('ORDENES_WALAKY_*.jsonl'))
+    print(f"📥 {len(dated_orders)} pedidos únicos")
+    started = time.time()
+    orders_result, sales = sync.sync_orders(dated_orders, args.refresh, args.dry_run)
+    print(f"🧾 Ventas: {orders_result['nuevas']} filas nuevas, {orders_result['cambiadas']} cambiadas, "
+          f"{orders_result['sin_cambios']} sin cambios")
+
+    if args.clients_sheet:
+        crm_records = [r for path in sorted(args.crm if args.crm is not None else glob.glob('CRM_WALAKY_*.txt'))
+                       for r in load_crm_txt(path)]
+        clients_result = sync.sync_clients(merge_clients(crm_records, dated_orders), sales, args.refresh, args.dry_run)
+        print(f"👥 Clientes: {clients_result['nuevas']} nuevos, {clients_result['cambiadas']} actualizados, "
+              f"{clients_result['sin_cambios']} sin cambios")
+
+    print(f"🔢 Requests a Sheets: {sync.stats['requests']} ({sync.stats['reintentos']} reintentos, "
+          f"{sync.pacer.waited:.0f}s de pausa por cuota) en {time.time() - started:.1f}s"
+          + (" - DRY-RUN, nada enviado" if args.dry_run else ""))
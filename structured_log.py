@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import threading
+from datetime import datetime
+from typing import Optional
+
+# Verbosidad de consola: silencioso = solo problemas, normal = un evento por mensaje candidato, detallado = cada etapa
+VERBOSITY = {
+    'silencioso': logging.WARNING,
+    'normal': logging.INFO,
+    'detallado': logging.DEBUG,
+}
+
+LOGGER_NAME = 'walaky'
+_logger = logging.getLogger(LOGGER_NAME)
+_logger.propagate = False
+_state = {'listener': None, 'queue': None, 'pid': None, 'config': ('normal', None, True)}
+_configure_lock = threading.Lock()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Encola el registro tal cual: el formateo (texto y JSON) ocurre en el hilo escritor, no en el bucle"""
+
+    def prepare(self, record):
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Una línea JSON por evento: evento, nivel y los campos estructurados (message_id, stage, latencia, tokens...)"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'evento': record.msg,
+        }
+        entry.update(getattr(record, 'campos', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleRenderer(logging.Formatter):
+    """Texto legible para la consola a partir de la plantilla del evento"""
+
+    def format(self, record):
+        template = getattr(record, 'plantilla', None)
+        fields = getattr(record, 'campos', {})
+        if not template:
+            return f"{record.msg} " + ' '.join(f"{k}={v}" for k, v in fields.items())
+        try:
+            return template.format(**fields)
+        except (KeyError, IndexError, ValueError):
+            return template
+
+
+def configure_logging(verbosity: str = 'normal', json_file: Optional[str] = None, console: bool = True):
+    """Handlers de consola y JSONL detrás de una cola: el bucle solo encola, un hilo escribe"""
+    with _configure_lock:
+        _configure(verbosity, json_file, console)
+
+
+def _configure(verbosity: str, json_file: Optional[str], console: bool):
+    stop_logging()
+    console_level = VERBOSITY.get(verbosity, logging.INFO)
+    handlers = []
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(console_level)
+        console_handler.setFormatter(ConsoleRenderer())
+        # Plantilla vacía = evento solo para el JSONL (la consola tiene su propio resumen)
+        console_handler.addFilter(lambda record: getattr(record, 'plantilla', None) != '')
+        handlers.append(console_handler)
+    if json_file:
+        # El archivo guarda al menos un evento por mensaje aunque la consola esté en silencio
+        file_handler = logging.FileHandler(json_file, encoding='utf-8')
+        file_handler.setLevel(min(console_level, logging.INFO))
+        file_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+    _logger.addHandler(DeferredQueueHandler(log_queue))
+    _logger.setLevel(min([h.level for h in handlers], default=logging.WARNING))
+    listener.start()
+    _state['listener'], _state['queue'], _state['pid'] = listener, log_queue, os.getpid()
+    _state['config'] = (verbosity, json_file, console)
+
+
+def stop_logging():
+    """Vacía la cola y detiene el hilo escritor"""
+    listener = _state['listener']
+    if listener is not None and _state['pid'] == os.getpid():
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+        _state['listener'] = None
+
+
+def flush_logs():
+    """Espera a que el hilo escritor vacíe la cola (antes de imprimir resúmenes directo en consola)"""
+    if _state['listener'] is not None and _state['pid'] == os.getpid():
+        _state['queue'].join()
+        sys.stdout.flush()
+
+
+def log_event(event: str, template: Optional[str] = None, level: int = logging.INFO, **fields):
+    """Registra un evento estructurado; la plantilla se formatea con los campos solo si la consola lo muestra
+    (template='' registra el evento solo en el JSONL)"""
+    if _state['pid'] != os.getpid():
+        # Sin configurar, o proceso worker hijo: el hilo escritor del padre no existe aquí
+        with _configure_lock:
+            if _state['pid'] != os.getpid():
+                _state['listener'] = None
+                _configure(*_state['config'])
+    if not _logger.isEnabledFor(level):
+        return
+    _logger.log(level, event, extra={'plantilla': template, 'campos': fields})
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,211 @@
+import time
+
+import pytest
+
+import sheets_sync
+from order_records import save_order_records
+from sheets_simulator import FakeSheetsService
+from sheets_sync import (SheetsSync, QuotaPacer, ORDER_HEADER, CLIENT_HEADER, load_dated_orders, merge_clients,
+                         to_number)
+
+
+def order(nombre='Ana Pérez', cedula='123', productos=None, pago='Contado', email='ana@example.com'):
+    return {
+        'pedido': 1, 'nombre': nombre, 'cedula': cedula, 'telefono': '3001234567', 'email': email,
+        'productos_texto': productos or ['2 Crema facial'], 'pago': pago,
+        'productos': [],
+    }
+
+
+def write_orders(tmp_path, name, records):
+    path = str(tmp_path / name)
+    save_order_records(records, path)
+    return path
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj falso: las pausas de backoff y de cuota avanzan el tiempo sin esperar"""
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+    monkeypatch.setattr(sheets_sync.random, 'uniform', lambda a, b: 0.0)
+    return now
+
+
+def make_sync(tmp_path, service, **kwargs):
+    return SheetsSync(service, 'ventas', 'clientes', str(tmp_path / 'cache'), QuotaPacer(1000), **kwargs)
+
+
+def sheet(service, spreadsheet_id='ventas'):
+    return service.rows(spreadsheet_id)
+
+
+def test_append_writes_header_and_rows_once(tmp_path, clock):
+    service = FakeSheetsService()
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl',
+                        [order(), order('Luis Gómez', '456', ['1 Shampoo', '3 Jabón'])])
+
+    result, _ = make_sync(tmp_path, service).sync_orders(load_dated_orders([path]))
+
+    assert result == {'nuevas': 3, 'cambiadas': 0, 'sin_cambios': 0}
+    assert sheet(service)[0] == ORDER_HEADER
+    assert [row[7] for row in sheet(service)[1:]] == ['Ana Pérez', 'Luis Gómez', 'Luis Gómez']
+    assert sheet(service)[1][6] == '2025-07-16'
+
+    # Segunda corrida con la copia local: nada que enviar, ni siquiera una lectura
+    calls = dict(service.calls)
+    result, _ = make_sync(tmp_path, service).sync_orders(load_dated_orders([path]))
+    assert result == {'nuevas': 0, 'cambiadas': 0, 'sin_cambios': 3}
+    assert service.calls == calls
+
+
+def test_append_in_chunks(tmp_path, clock):
+    service = FakeSheetsService()
+    records = [order(f"Cliente {i}", str(i)) for i in range(7)]
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', records)
+
+    make_sync(tmp_path, service, append_chunk=3).sync_orders(load_dated_orders([path]))
+
+    assert service.calls['append'] == 3
+    assert len(sheet(service)) == 8
+
+
+def test_changed_rows_go_through_batch_update(tmp_path, clock):
+    service = FakeSheetsService()
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', [order(), order('Luis Gómez', '456')])
+    make_sync(tmp_path, service).sync_orders(load_dated_orders([path]))
+
+    # Mismo pedido (misma huella) con el teléfono corregido
+    records = [order(), order('Luis Gómez', '456')]
+    records[1]['telefono'] = '3109998877'
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', records)
+    result, _ = make_sync(tmp_path, service).sync_orders(load_dated_orders([path]))
+
+    assert result == {'nuevas': 0, 'cambiadas': 1, 'sin_cambios': 1}
+    assert service.calls['batchUpdate'] == 1
+    assert sheet(service)[2][8] == '3109998877'
+    assert len(sheet(service)) == 3
+
+
+def test_refresh_rereads_sheet_edited_by_hand(tmp_path, clock):
+    service = FakeSheetsService()
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', [order()])
+    make_sync(tmp_path, service).sync_orders(load_dated_orders([path]))
+    sheet(service)[1][1] = 'Editado a mano'
+
+    # Sin refrescar, la copia local no ve la edición
+    result, _ = make_sync(tmp_path, service).sync_orders(load_dated_orders([path]))
+    assert result['cambiadas'] == 0
+
+    result, _ = make_sync(tmp_path, service).sync_orders(load_dated_orders([path]), refresh=True)
+    assert result['cambiadas'] == 1
+    assert sheet(service)[1][1] == 'Crema facial'
+
+
+def test_quota_errors_are_retried_with_backoff(tmp_path, clock):
+    service = FakeSheetsService(quota_per_minute=2)
+    records = [order(f"Cliente {i}", str(i)) for i in range(6)]
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', records)
+    sync = make_sync(tmp_path, service, append_chunk=2)
+
+    result, _ = sync.sync_orders(load_dated_orders([path]))
+
+    assert result['nuevas'] == 6
+    assert service.calls['rechazadas'] > 0
+    assert sync.stats['reintentos'] == service.calls['rechazadas']
+    assert len(sheet(service)) == 7
+
+
+def test_quota_error_is_raised_when_retries_run_out(tmp_path, clock):
+    # Cuota de 1: la lectura inicial pasa y el append recibe 429 sin reintentos disponibles
+    service = FakeSheetsService(quota_per_minute=1)
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', [order()])
+    sync = make_sync(tmp_path, service, retries=1)
+
+    with pytest.raises(Exception) as error:
+        sync.sync_orders(load_dated_orders([path]))
+    assert error.value.resp.status == 429
+    assert sheet(service) == []
+
+
+def test_repeat_purchases_in_one_file_are_separate_sales(tmp_path, clock):
+    service = FakeSheetsService()
+    first = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', [order(), order()])
+    # La corrida siguiente repite las dos compras y agrega una tercera idéntica
+    second = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250717_090000.jsonl', [order(), order(), order()])
+
+    dated = load_dated_orders([first, second])
+    make_sync(tmp_path, service).sync_orders(dated)
+
+    facturas = [row[5] for row in sheet(service)[1:]]
+    assert len(dated) == 3
+    assert len(set(facturas)) == 3
+    assert [row[6] for row in sheet(service)[1:]] == ['2025-07-16', '2025-07-16', '2025-07-17']
+
+
+def crema(cantidad=2, codigo='C01', precio=10000.0):
+    return [{'codigo': codigo, 'articulo': 'Crema facial', 'cantidad': cantidad, 'precio': precio}]
+
+
+def sync_all(tmp_path, service, paths, crm_records=()):
+    sync = make_sync(tmp_path, service)
+    dated = load_dated_orders(paths)
+    _, sales = sync.sync_orders(dated)
+    return sync.sync_clients(merge_clients(list(crm_records), dated), sales)
+
+
+def test_first_client_sync_allocates_ids_and_stats(tmp_path, clock):
+    service = FakeSheetsService()
+    ana = dict(order(), productos=crema())
+    luis = dict(order('Luis Gómez', '456', ['1 Shampoo'], email='luis@example.com'),
+                productos=crema(1, 'S01', 20000.0))
+    path = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', [ana, luis])
+
+    result = sync_all(tmp_path, service, [path])
+
+    clients = sheet(service, 'clientes')
+    assert result == {'nuevas': 2, 'cambiadas': 0, 'sin_cambios': 0}
+    assert clients[0] == CLIENT_HEADER
+    assert [row[0] for row in clients[1:]] == ['001', '002']
+    assert clients[1][1:6] == ['Ana Pérez', '123', 'ana@example.com', '', 1]
+    # 2 x (10.000 + 19% IVA)
+    assert clients[1][6] == 23800.0
+    assert clients[2][6] == 23800.0
+    assert clients[1][10] == clients[1][11] == '2025-07-16'
+
+
+def test_repeat_purchase_updates_client_stats_in_place(tmp_path, clock):
+    service = FakeSheetsService()
+    first = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250716_223251.jsonl', [dict(order(), productos=crema())])
+    sync_all(tmp_path, service, [first])
+
+    # La corrida siguiente repite el pedido anterior y trae una compra nueva de la misma clienta
+    second = write_orders(tmp_path, 'ORDENES_WALAKY_X_20250726_090000.jsonl', [
+        dict(order(), productos=crema()),
+        dict(order(productos=['1 Jabón']), productos=crema(1, 'J01', 5000.0)),
+    ])
+    calls = service.calls['batchUpdate']
+    result = sync_all(tmp_path, service, [first, second])
+
+    clients = sheet(service, 'clientes')
+    assert result == {'nuevas': 0, 'cambiadas': 1, 'sin_cambios': 0}
+    assert service.calls['batchUpdate'] > calls
+    assert len(clients) == 2
+    assert clients[1][0] == '001'
+    assert [to_number(v) for v in clients[1][5:10]] == [2, 29750, 14875, 2, 10]
+    assert clients[1][10:12] == ['2025-07-16', '2025-07-26']
+
+
+def test_merge_clients_keys_by_email_and_prefers_crm():
+    dated = [(dict(order(email='Ana@Example.com'), fc=''), '2025-07-16'),
+             (order('Sin correo', '789', email=''), '2025-07-16')]
+    crm = [
+        {'nombre': 'Ana María Pérez', 'cedula': '', 'email': ' ana@example.com', 'fecha_cumpleanos': '12/03'},
+        {'nombre': 'Sin email', 'cedula': '1', 'email': 'no tiene', 'fecha_cumpleanos': ''},
+    ]
+
+    clients = merge_clients(crm, dated)
+
+    assert clients == [{'nombre': 'Ana María Pérez', 'cedula': '123', 'email': 'Ana@Example.com',
+                        'fecha_cumpleanos': '12/03'}]
@@ -0,0 +1,172 @@
+import sqlite3
+import threading
+import argparse
+from datetime import datetime
+from typing import List, Dict, Optional
+
+
+class UsageLedger:
+    """Libro de uso append-only: una fila por llamada a la API (persistente entre corridas)"""
+
+    def __init__(self, db_path: str = 'ledger_costos.db'):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts TEXT NOT NULL,
+                day TEXT NOT NULL,
+                run_id TEXT NOT NULL,
+                chat_id TEXT,
+                message_id TEXT,
+                stage TEXT NOT NULL,
+                model TEXT,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                cache_creation_tokens INTEGER NOT NULL DEFAULT 0,
+                cache_read_tokens INTEGER NOT NULL DEFAULT 0,
+                saved_tokens INTEGER NOT NULL DEFAULT 0,
+                input_cost REAL NOT NULL DEFAULT 0,
+                output_cost REAL NOT NULL DEFAULT 0,
+                latency REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_usage_run ON usage(run_id);
+            CREATE INDEX IF NOT EXISTS idx_usage_day ON usage(day);
+            CREATE INDEX IF NOT EXISTS idx_usage_chat ON usage(chat_id);
+            CREATE INDEX IF NOT EXISTS idx_usage_stage ON usage(stage);
+
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                chat_id TEXT,
+                progress_file TEXT,
+                started_at TEXT NOT NULL,
+                closed_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_runs_progress ON runs(progress_file, closed_at);
+        """)
+
+    def open_run(self, chat_id: str, progress_file: str) -> str:
+        """Devuelve la corrida abierta para este archivo de progreso o crea una nueva"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT run_id FROM runs WHERE progress_file = ? AND closed_at IS NULL ORDER BY started_at DESC LIMIT 1",
+                (progress_file,)
+            ).fetchone()
+            if row:
+                return row['run_id']
+
+            run_id = f"{chat_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            self.conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, chat_id, progress_file, started_at) VALUES (?, ?, ?, ?)",
+                (run_id, chat_id, progress_file, datetime.now().isoformat())
+            )
+            return run_id
+
+    def close_run(self, run_id: str):
+        """Marca la corrida como terminada (la siguiente empieza con costo cero)"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE runs SET closed_at = ? WHERE run_id = ? AND closed_at IS NULL",
+                (datetime.now().isoformat(), run_id)
+            )
+
+    def record(self, run_id: str, stage: str, model: Optional[str], input_tokens: int, output_tokens: int,
+               input_cost: float, output_cost: float, cache_creation_tokens: int = 0, cache_read_tokens: int = 0,
+               saved_tokens: int = 0, latency: Optional[float] = None, chat_id: Optional[str] = None,
+               message_id: Optional[str] = None):
+        """Agrega una fila por llamada a la API"""
+        now = datetime.now()
+        with self._lock:
+            self.conn.execute(
+                """INSERT INTO usage (ts, day, run_id, chat_id, message_id, stage, model, input_tokens, output_tokens,
+                                      cache_creation_tokens, cache_read_tokens, saved_tokens, input_cost, output_cost, latency)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (now.isoformat(), now.strftime('%Y-%m-%d'), run_id, chat_id, message_id, stage, model,
+                 input_tokens, output_tokens, cache_creation_tokens, cache_read_tokens, saved_tokens,
+                 input_cost, output_cost, latency)
+            )
+
+    def totals(self, run_id: Optional[str] = None, day: Optional[str] = None,
+               run_ids: Optional[List[str]] = None) -> Dict[str, float]:
+        """Totales agregados (de una corrida, de varias, de un día o de todo el libro)"""
+        where, params = self._where(run_id=run_id, day=day, run_ids=run_ids)
+        row = self.conn.execute(f"""
+            SELECT COUNT(*) AS total_requests,
+                   COALESCE(SUM(input_tokens), 0) AS input_tokens,
+                   COALESCE(SUM(output_tokens), 0) AS output_tokens,
+                   COALESCE(SUM(cache_creation_tokens), 0) AS cache_creation_tokens,
+                   COALESCE(SUM(cache_read_tokens), 0) AS cache_read_tokens,
+                   COALESCE(SUM(saved_tokens), 0) AS input_tokens_saved,
+                   COALESCE(SUM(input_cost), 0) AS input_cost,
+                   COALESCE(SUM(output_cost), 0) AS output_cost,
+                   AVG(latency) AS avg_latency
+            FROM usage {where}""", params).fetchone()
+        totals = dict(row)
+        totals['total_cost'] = totals['input_cost'] + totals['output_cost']
+        return totals
+
+    def _group_by(self, column: str, run_id: Optional[str] = None, run_ids: Optional[List[str]] = None) -> List[Dict]:
+        where, params = self._where(run_id=run_id, run_ids=run_ids)
+        rows = self.conn.execute(f"""
+            SELECT {column} AS grupo, COUNT(*) AS requests,
+                   SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens,
+                   SUM(input_cost + output_cost) AS total_cost, AVG(latency) AS avg_latency
+            FROM usage {where}
+            GROUP BY {column} ORDER BY {column}""", params).fetchall()
+        return [dict(r) for r in rows]
+
+    def cost_by_day(self) -> List[Dict]:
+        """Costo agregado por día"""
+        return self._group_by('day')
+
+    def cost_by_chat(self) -> List[Dict]:
+        """Costo agregado por chat"""
+        return self._group_by('chat_id')
+
+    def cost_by_stage(self, run_id: Optional[str] = None, run_ids: Optional[List[str]] = None) -> List[Dict]:
+        """Costo agregado por etapa (verification, format, crm_extraction)"""
+        return self._group_by('stage', run_id=run_id, run_ids=run_ids)
+
+    @staticmethod
+    def _where(run_id: Optional[str] = None, day: Optional[str] = None, run_ids: Optional[List[str]] = None):
+        clauses, params = [], []
+        if run_id:
+            clauses.append("run_id = ?")
+            params.append(run_id)
+        if run_ids is not None:
+            clauses.append(f"run_id IN ({','.join('?' * len(run_ids)) or 'NULL'})")
+            params.extend(run_ids)
+        if day:
+            clauses.append("day = ?")
+            params.append(day)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def print_breakdown(title: str, rows: List[Dict]):
+    """Imprime una tabla de agregados del ledger"""
+    print(f"\n📒 {title}")
+    print(f"   {'grupo':<40} {'requests':>9} {'in':>11} {'out':>10} {'costo':>10}")
+    for r in rows:
+        print(f"   {str(r['grupo']):<40} {r['requests']:>9} {r['input_tokens'] or 0:>11,} "
+              f"{r['output_tokens'] or 0:>10,} ${r['total_cost'] or 0:>9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultas sobre el ledger de costos Claude")
+    parser.add_argument('--db', default='ledger_costos.db')
+    parser.add_argument('--run', help="Limitar el desglose por etapa a una corrida")
+    args = parser.parse_args()
+
+    ledger = UsageLedger(args.db)
+    print_breakdown("COSTO POR DÍA", ledger.cost_by_day())
+    print_breakdown("COSTO POR CHAT", ledger.cost_by_chat())
+    print_breakdown("COSTO POR ETAPA", ledger.cost_by_stage(args.run))
+    totals = ledger.totals()
+    print(f"\n💰 TOTAL HISTÓRICO: ${totals['total_cost']:.4f} en {totals['total_requests']} requests")
@@ -0,0 +1,196 @@
+import os
+import json
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from typing import Callable, Dict, List, Optional, Tuple
+
+from work_queue import WorkQueue
+from priority_scheduler import LIVE_PRIORITY, GAP_FILL_PRIORITY
+from structured_log import configure_logging, log_event, VERBOSITY
+
+MAX_BODY_BYTES = 1_000_000
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+               405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+
+class WebhookReceiver:
+    """Receptor HTTP asíncrono para los webhooks de mensajes entrantes de UltraMsg"""
+
+    def __init__(self, queue: WorkQueue, chat_ids: List[str], secret: Optional[str] = None,
+                 path: str = '/webhook', instance_id: Optional[str] = None,
+                 live_sink: Optional[Callable[[Dict], bool]] = None):
+        self.queue = queue
+        # Corrida en curso en el mismo proceso (scraper.submit_live): si la acepta, el mensaje no pasa por la cola
+        self.live_sink = live_sink
+        self.chat_ids = set(chat_ids)
+        self.secret = secret
+        self.path = path
+        self.instance_id = instance_id
+        self.stats = {'received': 0, 'queued': 0, 'live': 0, 'ignored': 0, 'invalid': 0}
+        # La cola es SQLite: todas las escrituras van por un único hilo fuera del event loop
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cola')
+
+    def validate(self, payload: Dict) -> Tuple[bool, str, Optional[Dict]]:
+        """Valida el evento y devuelve (válido, motivo, mensaje)"""
+        if not isinstance(payload, dict):
+            return False, 'payload no es un objeto', None
+        if payload.get('event_type') != 'message_received':
+            return True, f"evento ignorado: {payload.get('event_type')}", None
+        if self.instance_id and payload.get('instanceId') is not None:
+            if str(payload['instanceId']).replace('instance', '') != self.instance_id.replace('instance', ''):
+                return False, 'instancia desconocida', None
+
+        data = payload.get('data')
+        if not isinstance(data, dict) or not data.get('id') or not isinstance(data.get('body'), str):
+            return False, 'data incompleta (id/body)', None
+        if data.get('type', 'chat') != 'chat':
+            return True, f"tipo ignorado: {data.get('type')}", None
+
+        chat_id = data.get('from') if str(data.get('from', '')).endswith('@g.us') else data.get('to')
+        if self.chat_ids and chat_id not in self.chat_ids:
+            return True, f"chat no configurado: {chat_id}", None
+
+        return True, 'ok', {'id': data['id'], 'body': data['body'], 'time': data.get('time'), 'chat_id': chat_id}
+
+    def handle(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict]:
+        """Procesa una petición HTTP ya parseada"""
+        url = urlsplit(target)
+        if url.path != self.path:
+            return 404, {'ok': False, 'error': 'ruta desconocida'}
+        if method != 'POST':
+            return 405, {'ok': False, 'error': 'solo POST'}
+
+        if self.secret:
+            token = headers.get('x-webhook-token') or parse_qs(url.query).get('token', [''])[0]
+            if token != self.secret:
+                return 401, {'ok': False, 'error': 'token inválido'}
+
+        self.stats['received'] += 1
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            self.stats['invalid'] += 1
+            return 400, {'ok': False, 'error': 'JSON inválido'}
+
+        valid, reason, message = self.validate(payload)
+        if not valid:
+            self.stats['invalid'] += 1
+            return 400, {'ok': False, 'error': reason}
+        if message is None:
+            self.stats['ignored'] += 1
+            return 200, {'ok': True, 'queued': False, 'reason': reason}
+
+        if self.live_sink is not None and self.live_sink(message):
+            self.stats['live'] += 1
+            log_event('webhook_vivo', "⚡ Webhook: mensaje {message_id} al carril en vivo de la corrida en curso",
+                      message_id=message['id'], chat_id=message['chat_id'])
+            return 200, {'ok': True, 'queued': False, 'live': True}
+
+        # Sin corrida que lo acepte: a la cola persistente, donde lo toman los workers del carril en vivo
+        queued = self.queue.enqueue_messages(message['chat_id'], [message], priority=LIVE_PRIORITY) > 0
+        if queued:
+            self.stats['queued'] += 1
+            log_event('webhook_encolado', "📨 Webhook: mensaje {message_id} encolado ({inicio!r}...)",
+                      message_id=message['id'], chat_id=message['chat_id'], inicio=message['body'][:40])
+        else:
+            self.stats['ignored'] += 1
+        return 200, {'ok': True, 'queued': queued}
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """HTTP/1.1 mínimo: una petición por conexión"""
+        status, response = 400, {'ok': False, 'error': 'petición inválida'}
+        try:
+            request_line = (await asyncio.wait_for(reader.readline(), timeout=10)).decode('latin-1').strip()
+            method, target, _ = request_line.split(' ', 2)
+
+            headers = {}
+            while True:
+                line = (await asyncio.wait_for(reader.readline(), timeout=10)).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', '0') or 0)
+            if length > MAX_BODY_BYTES:
+                status, response = 413, {'ok': False, 'error': 'payload muy grande'}
+            else:
+                body = await asyncio.wait_for(reader.readexactly(length), timeout=10) if length else b''
+                status, response = await asyncio.get_running_loop().run_in_executor(
+                    self._db_executor, self.handle, method, target, headers, body
+                )
+        except Exception as e:
+            status, response = 400, {'ok': False, 'error': str(e)[:100]}
+
+        data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'OK')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def gap_fill_loop(self, scraper, interval_minutes: float, limit: int = 50):
+        """Polling periódico de respaldo: recupera mensajes que el webhook pudo perder"""
+        while True:
+            await asyncio.sleep(interval_minutes * 60)
+            for chat_id in self.chat_ids:
+                loop = asyncio.get_running_loop()
+                messages = await loop.run_in_executor(None, scraper.get_messages, chat_id, limit)
+                queued = await loop.run_in_executor(
+                    self._db_executor, self.queue.enqueue_messages, chat_id, messages, GAP_FILL_PRIORITY
+                )
+                log_event('relleno_polling', "🩹 Relleno por polling {chat_id}: {mensajes} mensajes que faltaban",
+                          chat_id=chat_id, mensajes=queued)
+
+    async def serve(self, host: str = '0.0.0.0', port: int = 8080, scraper=None, gap_fill_minutes: float = 0):
+        """Arranca el servidor (y el polling de respaldo si se configuró)"""
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        print(f"🌐 Webhook escuchando en http://{host}:{port}{self.path} → cola {self.queue.db_path}")
+        tasks = []
+        if scraper is not None and gap_fill_minutes > 0:
+            tasks.append(asyncio.create_task(self.gap_fill_loop(scraper, gap_fill_minutes)))
+            print(f"🩹 Polling de respaldo cada {gap_fill_minutes} min")
+        async with server:
+            await server.serve_forever()
+
+    def serve_in_background(self, host: str = '0.0.0.0', port: int = 8080) -> threading.Thread:
+        """Servidor en un hilo aparte, para recibir webhooks mientras el scraper procesa en el hilo principal"""
+        thread = threading.Thread(target=lambda: asyncio.run(self.serve(host, port)), name='webhook', daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receptor de webhooks UltraMsg → cola de trabajo")
+    parser.add_argument('--db', default='cola_trabajo.db')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--path', default='/webhook')
+    parser.add_argument('--chats', default='', help="Chats aceptados, separados por coma (vacío = todos)")
+    parser.add_argument('--gap-fill-minutes', type=float, default=0, help="Polling de respaldo (0 = desactivado)")
+    parser.add_argument('--log-level', choices=list(VERBOSITY), default='normal', help="Verbosidad de la consola")
+    parser.add_argument('--log-json', default='eventos_walaky.jsonl', help="Archivo JSONL de eventos estructurados ('' = sin archivo)")
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_json or None)
+
+    receiver = WebhookReceiver(
+        WorkQueue(args.db),
+        [c.strip() for c in args.chats.split(',') if c.strip()],
+        secret=os.environ.get('WEBHOOK_SECRET'),
+        path=args.path,
+        instance_id=os.environ.get('ULTRAMSG_INSTANCE_ID')
+    )
+
+    gap_scraper = None
+    if args.gap_fill_minutes > 0:
+        from worker import build_scraper
+        gap_scraper = build_scraper()
+
+    asyncio.run(receiver.serve(args.host, args.port, gap_scraper, args.gap_fill_minutes))
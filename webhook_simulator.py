@@ -0,0 +1,80 @@
+import json
+import time
+import hashlib
+import argparse
+import http.client
+from urllib.parse import urlsplit
+from typing import Dict
+
+from message_archive import load_messages_archive
+
+
+def build_webhook_payload(message: Dict, chat_id: str, instance_id: str = 'instance000000') -> Dict:
+    """Envuelve un mensaje archivado como el evento 'message_received' de UltraMsg"""
+    return {
+        'event_type': 'message_received',
+        'instanceId': instance_id.replace('instance', ''),
+        'data': {
+            'id': message.get('id') or 'sim_' + hashlib.md5(message.get('body', '').encode('utf-8')).hexdigest()[:16],
+            'from': message.get('from') or chat_id,
+            'to': message.get('to') or 'simulador@c.us',
+            'author': message.get('author', ''),
+            'pushname': message.get('pushname', ''),
+            'type': message.get('type', 'chat'),
+            'body': message.get('body', ''),
+            'fromMe': False,
+            'time': message.get('time') or int(time.time()),
+        }
+    }
+
+
+def post_json(url: str, payload: Dict, token: str = '') -> (int, Dict):
+    """POST de un evento al receptor"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['X-Webhook-Token'] = token
+    conn.request('POST', parts.path + (f"?{parts.query}" if parts.query else ''), body=body, headers=headers)
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    try:
+        return res.status, json.loads(data.decode('utf-8'))
+    except json.JSONDecodeError:
+        return res.status, {'raw': data.decode('utf-8', 'replace')}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulador local de webhooks UltraMsg (reproduce mensajes archivados)")
+    parser.add_argument('archive', help="Mensajes archivados (JSON de chats/messages o JSONL)")
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--chat', default='573217003970-1604414717@g.us')
+    parser.add_argument('--rate', type=float, default=2.0, help="Mensajes por segundo (0 = sin pausa)")
+    parser.add_argument('--limit', type=int, default=0)
+    parser.add_argument('--token', default='', help="Secreto del receptor (WEBHOOK_SECRET)")
+    parser.add_argument('--instance', default='instance000000', help="instanceId a simular (ULTRAMSG_INSTANCE_ID del receptor)")
+    args = parser.parse_args()
+
+    messages = load_messages_archive(args.archive)
+    if args.limit:
+        messages = messages[:args.limit]
+
+    counts = {'queued': 0, 'ignored': 0, 'errors': 0}
+    started = time.time()
+    for i, message in enumerate(messages, 1):
+        status, response = post_json(args.url, build_webhook_payload(message, args.chat, args.instance), args.token)
+        if status != 200:
+            counts['errors'] += 1
+            print(f"❌ {i}/{len(messages)} HTTP {status}: {response}")
+        elif response.get('queued'):
+            counts['queued'] += 1
+            print(f"📨 {i}/{len(messages)} encolado")
+        else:
+            counts['ignored'] += 1
+        if args.rate > 0:
+            time.sleep(1 / args.rate)
+
+    print(f"\n🏁 {len(messages)} eventos en {time.time() - started:.1f}s → "
+          f"encolados {counts['queued']}, ignorados {counts['ignored']}, errores {counts['errors']}")
@@ -0,0 +1,83 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+class PacingTuner:
+    """Escala los delays de WhatsApp y checkpoints según la salud observada de UltraMsg"""
+
+    def __init__(self, min_scale: float = 0.3, max_scale: float = 2.0, healthy_latency: float = 3.0,
+                 relax_after: int = 2, relax_factor: float = 0.8, backoff_factor: float = 2.0):
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.healthy_latency = healthy_latency
+        self.relax_after = relax_after
+        self.relax_factor = relax_factor
+        self.backoff_factor = backoff_factor
+        self.scale = 1.0
+        self.healthy_streak = 0
+        self.stats = {'ok': 0, 'slow': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def observe(self, ok: bool, latency: float, status: Optional[int] = None) -> float:
+        """Registra una llamada a UltraMsg y devuelve la nueva escala"""
+        with self._lock:
+            failed = not ok or status == 429 or (status is not None and status >= 500)
+            if failed or latency > self.healthy_latency * 3:
+                # Error o instancia saturada: de inmediato al ritmo completo del perfil, o más lento
+                self.scale = min(self.max_scale, max(1.0, self.scale * self.backoff_factor))
+                self.healthy_streak = 0
+                self.stats['errors' if failed else 'slow'] += 1
+            elif latency <= self.healthy_latency:
+                self.stats['ok'] += 1
+                self.healthy_streak += 1
+                if self.healthy_streak >= self.relax_after:
+                    self.scale = max(self.min_scale, self.scale * self.relax_factor)
+                    self.healthy_streak = 0
+            else:
+                # Lenta pero sin error: se mantiene la escala actual
+                self.stats['slow'] += 1
+                self.healthy_streak = 0
+            return self.scale
+
+
+class WhatsAppPacer:
+    """Política de ritmo compartida por número (instancia UltraMsg), no por chat"""
+
+    _instances: Dict[str, 'WhatsAppPacer'] = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, instance_id: str):
+        self.instance_id = instance_id
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tuner: Optional[PacingTuner] = None
+
+    @classmethod
+    def for_instance(cls, instance_id: str) -> 'WhatsAppPacer':
+        """Un único pacer por instancia, compartido por todos los chats y scrapers del proceso"""
+        with cls._registry_lock:
+            if instance_id not in cls._instances:
+                cls._instances[instance_id] = cls(instance_id)
+            return cls._instances[instance_id]
+
+    @contextmanager
+    def turn(self):
+        """Turno exclusivo sobre el número: las llamadas y sus delays nunca se solapan"""
+        with self._lock:
+            self.requests += 1
+            yield
+
+    def enable_auto_tune(self, **kwargs):
+        """Activa el autoajuste de delays (una sola escala para todo el número)"""
+        if self.tuner is None:
+            self.tuner = PacingTuner(**kwargs)
+
+    def delay_scale(self) -> float:
+        """Factor a aplicar a los delays del perfil (1.0 sin autoajuste)"""
+        return self.tuner.scale if self.tuner else 1.0
+
+    def observe(self, ok: bool, latency: float, status: Optional[int] = None):
+        """Resultado de una llamada a UltraMsg para el autoajuste"""
+        if self.tuner:
+            self.tuner.observe(ok, latency, status)
@@ -0,0 +1,237 @@
+import json
+import time
+import sqlite3
+from typing import List, Dict, Optional
+
+from prefilter import prefilter_score
+from priority_scheduler import LIVE_PRIORITY, backlog_priority
+
+# Etapas del pipeline y la siguiente etapa de cada una
+STAGES = ['verify', 'format', 'crm']
+NEXT_STAGE = {'verify': 'format', 'format': 'crm', 'crm': None}
+
+
+class Job:
+    """Trabajo arrendado por un worker"""
+
+    def __init__(self, row: sqlite3.Row):
+        self.id = row['id']
+        self.stage = row['stage']
+        self.chat_id = row['chat_id']
+        self.message_id = row['message_id']
+        self.seq = row['seq']
+        self.payload = row['payload']
+        self.attempts = row['attempts']
+        self.max_attempts = row['max_attempts']
+        self.priority = row['priority']
+
+
+class WorkQueue:
+    """Cola persistente (SQLite WAL) con leases, visibilidad por timeout y entrega al-menos-una-vez"""
+
+    def __init__(self, db_path: str = 'cola_trabajo.db', lease_seconds: int = 300, aging_seconds: int = 600):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        # Envejecimiento del backlog: +1 de prioridad por cada aging_seconds en espera (sin alcanzar al carril en vivo)
+        self.aging_seconds = aging_seconds
+        # Cada proceso abre su propia conexión; autocommit y transacciones explícitas
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage TEXT NOT NULL,
+                chat_id TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL DEFAULT 5,
+                lease_owner TEXT,
+                lease_until REAL,
+                available_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT,
+                UNIQUE(stage, chat_id, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(stage, status, available_at);
+            CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(status, lease_until);
+
+            CREATE TABLE IF NOT EXISTS results (
+                stage TEXT NOT NULL,
+                chat_id TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                seq INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (stage, chat_id, message_id)
+            );
+        """)
+
+    def enqueue(self, stage: str, chat_id: str, message_id: str, payload: str,
+                seq: int = 0, priority: int = 0, max_attempts: int = 5) -> bool:
+        """Encola un trabajo; es idempotente por (etapa, chat, mensaje)"""
+        now = time.time()
+        cursor = self.conn.execute(
+            """INSERT OR IGNORE INTO jobs (stage, chat_id, message_id, seq, payload, priority, max_attempts,
+                                           available_at, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (stage, chat_id, message_id, seq, payload, priority, max_attempts, now, now, now)
+        )
+        return cursor.rowcount > 0
+
+    def lease(self, worker_id: str, stages: Optional[List[str]] = None, min_priority: Optional[int] = None) -> Optional[Job]:
+        """Arrienda el siguiente trabajo disponible (o uno cuyo lease expiró): carril en vivo primero, luego el
+        backlog por prioridad con envejecimiento y, a igual prioridad, el mensaje más reciente"""
+        stages = stages or STAGES
+        now = time.time()
+        placeholders = ','.join('?' * len(stages))
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Un lease vencido sin intentos restantes es un mensaje que tumba a su worker: se marca fallido
+            self.conn.execute(
+                """UPDATE jobs SET status = 'failed', lease_owner = NULL, lease_until = NULL, updated_at = ?,
+                                   last_error = COALESCE(last_error, 'lease vencido sin intentos restantes')
+                   WHERE status = 'leased' AND lease_until < ? AND attempts >= max_attempts""",
+                (now, now)
+            )
+            row = self.conn.execute(f"""
+                SELECT * FROM jobs
+                WHERE stage IN ({placeholders})
+                  AND available_at <= ?
+                  AND (status = 'pending' OR (status = 'leased' AND lease_until < ? AND attempts < max_attempts))
+                  AND priority >= ?
+                ORDER BY CASE WHEN priority >= ? THEN priority
+                              ELSE MIN(priority + (? - created_at) / ?, ? - 1) END DESC,
+                         seq DESC, id
+                LIMIT 1""", (*stages, now, now, min_priority if min_priority is not None else -1,
+                             LIVE_PRIORITY, now, self.aging_seconds, LIVE_PRIORITY)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+
+            self.conn.execute(
+                """UPDATE jobs SET status = 'leased', lease_owner = ?, lease_until = ?,
+                                   attempts = attempts + 1, updated_at = ?
+                   WHERE id = ?""",
+                (worker_id, now + self.lease_seconds, now, row['id'])
+            )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+        job = Job(row)
+        job.attempts += 1
+        return job
+
+    def extend_lease(self, job: Job, worker_id: str, seconds: Optional[int] = None):
+        """Renueva el lease de un trabajo largo"""
+        self.conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            (time.time() + (seconds or self.lease_seconds), job.id, worker_id)
+        )
+
+    def complete(self, job: Job, worker_id: str, result: Optional[str], next_payload: Optional[str] = None):
+        """Guarda el resultado (idempotente) y encola la siguiente etapa en la misma transacción"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.execute(
+                """INSERT OR REPLACE INTO results (stage, chat_id, message_id, seq, result, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (job.stage, job.chat_id, job.message_id, job.seq, result, now)
+            )
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', lease_owner = ?, updated_at = ?, last_error = NULL WHERE id = ?",
+                (worker_id, now, job.id)
+            )
+            next_stage = NEXT_STAGE.get(job.stage)
+            if next_stage and next_payload is not None:
+                self.conn.execute(
+                    """INSERT OR IGNORE INTO jobs (stage, chat_id, message_id, seq, payload, priority, max_attempts,
+                                                   available_at, created_at, updated_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (next_stage, job.chat_id, job.message_id, job.seq, next_payload, job.priority,
+                     job.max_attempts, now, now, now)
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def fail(self, job: Job, worker_id: str, error: str, retry_delay: float = 30):
+        """Devuelve el trabajo a la cola con backoff, o lo marca fallido si agotó los intentos"""
+        now = time.time()
+        status = 'failed' if job.attempts >= job.max_attempts else 'pending'
+        self.conn.execute(
+            """UPDATE jobs SET status = ?, lease_owner = NULL, lease_until = NULL,
+                               available_at = ?, updated_at = ?, last_error = ?
+               WHERE id = ? AND (lease_owner = ? OR lease_owner IS NULL)""",
+            (status, now + retry_delay * job.attempts, now, error[:500], job.id, worker_id)
+        )
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Conteo de trabajos por etapa y estado"""
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in self.conn.execute("SELECT stage, status, COUNT(*) AS n FROM jobs GROUP BY stage, status"):
+            stats.setdefault(row['stage'], {})[row['status']] = row['n']
+        return stats
+
+    def pending_count(self, stages: Optional[List[str]] = None) -> int:
+        """Trabajos aún no terminados (pendientes o arrendados)"""
+        stages = stages or STAGES
+        placeholders = ','.join('?' * len(stages))
+        row = self.conn.execute(
+            f"SELECT COUNT(*) AS n FROM jobs WHERE stage IN ({placeholders}) AND status IN ('pending', 'leased')",
+            stages
+        ).fetchone()
+        return row['n']
+
+    def results(self, stage: str, chat_id: str) -> List[Dict]:
+        """Resultados de una etapa para un chat, en el orden original de los mensajes"""
+        rows = self.conn.execute(
+            "SELECT message_id, seq, result FROM results WHERE stage = ? AND chat_id = ? ORDER BY seq, message_id",
+            (stage, chat_id)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def enqueue_messages(self, chat_id: str, messages: List[Dict], priority: int = 0) -> int:
+        """Encola como 'verify' los mensajes que pasan el pre-filtro local (en el backlog, más puntaje = antes)"""
+        queued = 0
+        for i, message in enumerate(messages):
+            message_text = message.get('body', '') or ''
+            score = prefilter_score(message_text) if len(message_text.strip()) >= 20 else 0
+            if score == 0:
+                continue
+            message_id = str(message.get('id') or f"idx_{i}")
+            # El timestamp de WhatsApp ordena igual mensajes de polling y de webhook
+            seq = int(message.get('time') or message.get('timestamp') or i)
+            if priority < LIVE_PRIORITY:
+                priority_for_message = backlog_priority(score, priority)
+            else:
+                priority_for_message = priority
+            if self.enqueue('verify', chat_id, message_id, message_text, seq=seq, priority=priority_for_message):
+                queued += 1
+        return queued
+
+
+def crm_records_from_results(queue: WorkQueue, chat_id: str) -> List[Dict[str, str]]:
+    """Registros CRM ya extraídos por los workers"""
+    records = []
+    for row in queue.results('crm', chat_id):
+        try:
+            record = json.loads(row['result'] or '{}')
+        except json.JSONDecodeError:
+            continue
+        if record.get('nombre'):
+            records.append(record)
+    return records
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import argparse
+import multiprocessing
+from typing import Optional, Tuple
+
+from work_queue import WorkQueue, Job, STAGES, crm_records_from_results
+from multi_chat import chat_slug
+from structured_log import configure_logging, flush_logs, log_event, VERBOSITY
+from engine_config import load_config, load_credentials, resolve_pacing_profile
+from priority_scheduler import LIVE_PRIORITY
+
+
+def build_scraper():
+    """Crea el scraper con credenciales del entorno o del config (cada worker tiene su propio cliente)"""
+    from scraper import WhatsAppScraperClaudeProduction
+    config = load_config()
+    credentials = load_credentials(config)
+    if not credentials['anthropic_api_key']:
+        raise RuntimeError("Falta ANTHROPIC_API_KEY (o anthropic_api_key en el config)")
+    scraper = WhatsAppScraperClaudeProduction(
+        credentials['instance_id'],
+        credentials['token'],
+        credentials['anthropic_api_key']
+    )
+    # Perfil por $WALAKY_PACING_PROFILE o el del config (delays, modelo y reintentos)
+    scraper.configure_pacing(resolve_pacing_profile(None, config))
+    return scraper
+
+
+def handle_job(scraper, job: Job) -> Tuple[Optional[str], Optional[str]]:
+    """Ejecuta una etapa; devuelve (resultado, payload de la siguiente etapa)"""
+    if job.stage == 'verify':
+        is_order = scraper.is_order_message(job.payload)
+        return ('SI' if is_order else 'NO'), (job.payload if is_order else None)
+
+    if job.stage == 'format':
+        formatted_message = scraper.format_with_claude(job.payload)
+        if not formatted_message:
+            raise RuntimeError("Formateo falló después de los reintentos")
+        return formatted_message, formatted_message
+
+    if job.stage == 'crm':
+        crm_data = scraper.extract_crm_data_with_ai(job.payload)
+        return json.dumps(crm_data, ensure_ascii=False), None
+
+    raise ValueError(f"Etapa desconocida: {job.stage}")
+
+
+class LeaseHeartbeat:
+    """Renueva el lease mientras corre un trabajo largo (formateo/CRM con reintentos) para que otro worker no lo tome"""
+
+    def __init__(self, queue: WorkQueue, job: Job, worker_id: str, interval: Optional[float] = None):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.interval = interval or queue.lease_seconds / 3
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{job.id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.queue.extend_lease(self.job, self.worker_id)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # Se detiene antes de complete/fail: la conexión no se usa desde dos hilos a la vez
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(db_path: str, stages: list, worker_id: str, idle_exit: bool = False, poll_seconds: float = 2.0,
+               min_priority: Optional[int] = None):
+    """Bucle de un worker: arrienda, procesa y confirma trabajos hasta vaciar la cola
+    (min_priority=LIVE_PRIORITY reserva el worker para el carril en vivo)"""
+    queue = WorkQueue(db_path)
+    scraper = build_scraper()
+    run_ids = {}
+    processed = 0
+
+    lane = ' (carril en vivo)' if min_priority is not None else ''
+    print(f"👷 Worker {worker_id} iniciado{lane} - etapas: {', '.join(stages)}")
+    while True:
+        job = queue.lease(worker_id, stages, min_priority)
+        if job is None:
+            if idle_exit and queue.pending_count(stages) == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        # Una corrida del ledger por chat para todos los workers de la misma cola
+        if job.chat_id not in run_ids:
+            run_ids[job.chat_id] = scraper.ledger.open_run(job.chat_id, f"{os.path.abspath(db_path)}#{job.chat_id}")
+        scraper.set_message_context(job.message_id, job.chat_id, run_ids[job.chat_id])
+
+        started = time.time()
+        try:
+            with LeaseHeartbeat(queue, job, worker_id):
+                result, next_payload = handle_job(scraper, job)
+            queue.complete(job, worker_id, result, next_payload)
+            processed += 1
+            scraper.log('trabajo', "✅ {worker} {stage} {chat_id}/{message_id} (intento {intento}, {latency_ms} ms)",
+                        worker=worker_id, stage=job.stage, chat_id=job.chat_id, intento=job.attempts,
+                        latency_ms=round((time.time() - started) * 1000))
+        except Exception as e:
+            queue.fail(job, worker_id, str(e))
+            scraper.log('trabajo_fallido', "⚠️ {worker} {stage} {message_id} falló (intento {intento}/{max_intentos}): {error}",
+                        logging.WARNING, worker=worker_id, stage=job.stage, chat_id=job.chat_id,
+                        intento=job.attempts, max_intentos=job.max_attempts, error=str(e)[:60])
+
+    log_event('worker_fin', "🏁 Worker {worker} terminó: {trabajos} trabajos", worker=worker_id, trabajos=processed)
+    # Los procesos hijos terminan sin atexit: vaciar la cola del log antes de salir
+    flush_logs()
+
+
+def export_chat(db_path: str, chat_id: str):
+    """Genera los archivos PEDIDOS/CRM de un chat con los resultados de la cola"""
+    queue = WorkQueue(db_path)
+    scraper = build_scraper()
+    formatted_messages = [r['result'] for r in queue.results('format', chat_id) if r['result']]
+    crm_records = crm_records_from_results(queue, chat_id)
+    scraper.configure_catalog(os.environ.get('WALAKY_CATALOG', 'productos.csv'))
+    scraper.run_id = scraper.ledger.open_run(chat_id, f"{os.path.abspath(db_path)}#{chat_id}")
+    scraper.set_message_context(None, chat_id, scraper.run_id)
+    return scraper.save_final_production_files(formatted_messages, file_tag=chat_slug(chat_id), crm_records=crm_records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Workers de la cola persistente Walaky (verify/format/crm)")
+    parser.add_argument('--db', default='cola_trabajo.db', help="Cola SQLite compartida")
+    parser.add_argument('--stages', default=','.join(STAGES), help="Etapas a drenar, separadas por coma")
+    parser.add_argument('--processes', type=int, default=1, help="Procesos worker en esta máquina")
+    parser.add_argument('--live-workers', type=int, default=0,
+                        help="Procesos adicionales reservados para mensajes en vivo (webhook), aunque haya un backfill en cola")
+    parser.add_argument('--idle-exit', action='store_true', help="Terminar cuando no queden trabajos")
+    parser.add_argument('--stats', action='store_true', help="Mostrar el estado de la cola y salir")
+    parser.add_argument('--export', metavar='CHAT_ID', help="Generar PEDIDOS/CRM de un chat desde la cola")
+    parser.add_argument('--log-level', choices=list(VERBOSITY), default='normal', help="Verbosidad de la consola")
+    parser.add_argument('--log-json', default='eventos_walaky.jsonl', help="Archivo JSONL de eventos estructurados ('' = sin archivo)")
+    args = parser.parse_args()
+    configure_logging(args.log_level, args.log_json or None)
+
+    if args.stats:
+        for stage, counts in WorkQueue(args.db).stats().items():
+            print(f"📋 {stage}: " + ", ".join(f"{status}={n}" for status, n in sorted(counts.items())))
+        raise SystemExit(0)
+
+    if args.export:
+        pedidos_file, crm_file = export_chat(args.db, args.export)
+        print(f"📁 {pedidos_file}\n📁 {crm_file}")
+        raise SystemExit(0)
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    # El pid distingue los leases de dos invocaciones en la misma máquina
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    if args.processes == 1 and not args.live_workers:
+        run_worker(args.db, stages, worker_prefix, args.idle_exit)
+    else:
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(args.db, stages, f"{worker_prefix}-w{n}", args.idle_exit))
+            for n in range(args.processes)
+        ]
+        # Carril rápido: sondeo corto y solo trabajos en vivo, para que un pedido nuevo no espere al backlog
+        processes += [
+            multiprocessing.Process(target=run_worker, args=(args.db, stages, f"{worker_prefix}-vivo{n}", args.idle_exit,
+                                                             0.5, LIVE_PRIORITY))
+            for n in range(args.live_workers)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()